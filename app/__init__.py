@@ -1,18 +1,33 @@
 """Application."""
 
 import os
-import requests
+import json
+import time
+import click
 import logging
-import reverse_geocode
 
 from flask import Flask, render_template, flash, redirect, session, g, request, url_for
-from flask_debugtoolbar import DebugToolbarExtension
+from flask import Response, stream_with_context
 from sqlalchemy.exc import IntegrityError
-from flask_mail import Mail, Message
 
 
-from models import User, db, connect_db, Dive_site, Bucket_list_site, Journal_entry
+from models import User, db, connect_db, Dive_site, Bucket_list_site, Journal_entry, Outbox_email
 from forms import UserAddForm, LoginForm, JournalSiteForm
+from catalog import search_local, ingest_catalog, save_sites, fetch_sites, stored_ids
+from cache import search_cache, search_params
+from upstream import upstream, UpstreamUnavailable
+from gateway import cached_search, search_points, search_terms, fetch_details
+from prefetch import prefetcher
+from suggest import suggest_index
+from identity import identity_cache, load_current_user, forget_user, UserGone
+from hashing import hash_pool
+from paging import keyset_page
+from feed import review_feed, feed_item
+from logbook import LogbookImport, logbook_format, EXPORT_FORMATS
+from logbook import export_journal, export_bucket_list
+from clusters import journal_maps, journal_map, parse_bbox
+from conditional import not_modified, add_validators
+from tiles import tile_cache, site_tile, MAX_ZOOM as TILE_MAX_ZOOM, MIME_TYPE as TILE_MIME_TYPE
 
 
 from dotenv import load_dotenv
@@ -21,13 +36,36 @@ from config import config
 
 app = Flask(__name__)
 
-from verify import generate_token, confirm_token, send_email
+from verify import generate_token, confirm_token
+from outbox import outbox_worker, drain
+from digest import send_review_digest
 
 
 def create_app(config_name):
     app.config.from_object(config[config_name])
     config[config_name].init_app(app)
     connect_db(app)
+    if os.environ.get("FLASK_RUN_FROM_CLI"):
+        # flask_migrate pulls in alembic; only the `flask db` commands need it
+        from flask_migrate import Migrate
+
+        Migrate(app, db, directory=os.path.join(os.path.dirname(app.root_path), "migrations"))
+    hash_pool.init_app(app)
+    upstream.init_app(app)
+    prefetcher.init_app(app)
+    outbox_worker.init_app(app)
+    suggest_index.reset()
+    review_feed.configure(size=app.config["FEED_SIZE"], ttl=app.config["FEED_TTL"])
+    tile_cache.configure(app.config["TILE_CACHE_DIR"], ttl=app.config["TILE_CACHE_TTL"])
+    journal_maps.configure(
+        ttl=app.config["JOURNAL_MAP_CACHE_TTL"], max_entries=app.config["JOURNAL_MAP_CACHE_SIZE"]
+    )
+    identity_cache.configure(
+        ttl=app.config["IDENTITY_CACHE_TTL"], max_entries=app.config["IDENTITY_CACHE_SIZE"]
+    )
+    search_cache.configure(
+        ttl=app.config["SEARCH_CACHE_TTL"], max_bytes=app.config["SEARCH_CACHE_MAX_BYTES"]
+    )
     return app
 
 # attach routes and custom error pages here
@@ -35,16 +73,30 @@ def create_app(config_name):
 def add_user_to_g():
     """If logged in, add user to Flask g."""
     if session.get("user_id") is not None:
-        g.user = User.query.get(session["user_id"])
+        g.user = load_current_user(session["user_id"])
 
     else:
         g.user = None
 
 
+@app.after_request
+def add_cache_validators(resp):
+    """Add the ETag and Cache-Control of pages that checked not_modified."""
+    return add_validators(resp)
+
+
 @app.route("/")
 def home():
     """Render home page."""
-    return render_template('index.html')
+    reviews = review_feed.recent(app.config["FEED_HOME_SIZE"])
+    return render_template('index.html', reviews=reviews)
+
+
+@app.route("/feed")
+def show_feed():
+    """Return the newest reviews."""
+    limit = min(request.args.get("limit", 20, type=int), app.config["FEED_SIZE"])
+    return {"items": review_feed.recent(max(limit, 0))}
 
 
 @app.route("/signup", methods=["GET", "POST"])
@@ -59,13 +111,9 @@ def signup():
                 password=form.password.data,
                 email=form.email.data,
             )
+            queue_confirmation(user.email)
             db.session.commit()
-
-            token = generate_token(user.email)
-            confirm_url = url_for('confirm_email', token=token, _external=True)
-            html = render_template('email.html', confirm_url=confirm_url)
-            subject = "Please confirm your email"
-            send_email(user.email, subject, html)
+            outbox_worker.notify()
 
             session["user_id"] = user.id
 
@@ -79,6 +127,15 @@ def signup():
     return render_template("signup.html", form=form)
 
 
+def queue_confirmation(email):
+    """Add a confirmation email to the outbox; sent once the caller commits."""
+    token = generate_token(email)
+    confirm_url = url_for('confirm_email', token=token, _external=True)
+    html = render_template('email.html', confirm_url=confirm_url)
+    subject = "Please confirm your email"
+    Outbox_email.queue(email, subject, html, dedupe_key=f"confirm:{email}")
+
+
 @app.route('/confirm')
 def confirm_message():
     """Show confirmation sent message."""
@@ -95,11 +152,9 @@ def resend_confirmation():
         flash("Log in then click resend to generate new confirmation email.", "danger")
         return redirect("/login")
 
-    token = generate_token(g.user.email)
-    confirm_url = url_for('confirm_email', token=token, _external=True)
-    html = render_template('email.html', confirm_url=confirm_url)
-    subject = "Please confirm your email"
-    send_email(g.user.email, subject, html)
+    queue_confirmation(g.user.email)
+    db.session.commit()
+    outbox_worker.notify()
     flash('A new confirmation email has been sent.', 'success')
 
     return redirect('/')
@@ -120,6 +175,7 @@ def confirm_email(token):
         user.confirmed = True
         db.session.add(user)
         db.session.commit()
+        forget_user(user.id)
         flash(f'Welcome {user.username}! You have confirmed your account. ', 'success')
     return redirect('/')
 
@@ -133,6 +189,8 @@ def login():
         user = User.authenticate(form.username.data, form.password.data)
 
         if user:
+            # saves the password if authenticate upgraded its hash
+            db.session.commit()
             session["user_id"] = user.id
             if user.confirmed is False:
                 return redirect('/confirm')
@@ -170,8 +228,11 @@ def edit_profile():
             try:
                 user.username = (form.username.data,)
                 user.email = (form.email.data,)
+                # site pages show reviewers' usernames
+                Dive_site.reviews_changed(user_id=user.id)
 
                 db.session.commit()
+                forget_user(user.id)
 
                 flash("Profile Updated", "success")
                 return redirect("/")
@@ -195,23 +256,153 @@ def delete_user():
 
     session.pop("user_id", None)
 
-    db.session.delete(g.user)
+    # the user's journal entries are deleted with them
+    ratings = db.session.query(Journal_entry.dive_site_id, Journal_entry.rating).filter(
+        Journal_entry.user_id == g.user.id
+    )
+    for site_id, rating in ratings.all():
+        Dive_site.add_rating(site_id, rating, count=-1)
+    db.session.delete(g.user.model)
     db.session.commit()
+    forget_user(g.user.id)
+    review_feed.remove(user_id=g.user.id)
+    journal_maps.delete(g.user.id)
     flash("User Deleted", "danger")
 
     return redirect("/")
 
 
-@app.route("/sites/search", methods=["POST"])
+@app.route("/sites/search", methods=["GET", "POST"])
 def get_sites():
-    """Send request to api to get list of dive sites based on provided search parameters."""
-    params = request.json
+    """Send request to api to get list of dive sites based on provided search parameters.
+
+    Besides the api's own parameters, `points` (a list of {lat, lng}), `terms`
+    (a list of search strings) or `siteids` (with mode=detail) run several
+    queries at once and return the merged results. Those lists need a json
+    POST and are rejected on a GET. Plain searches can also be a GET with
+    query parameters; a successful one may be cached by browsers and proxies
+    and revalidated against a hash of the body.
+    """
+    if request.method == "POST":
+        params = request.get_json(silent=True)
+        error = search_params_error(params)
+        if error:
+            return {"result": False, "error": error}, 400
+        return search_sites(params)
+
+    params = request.args.to_dict()
+    lists = [name for name in ("points", "terms", "siteids") if name in params]
+    if lists:
+        return {"result": False, "error": f"{', '.join(lists)} need a json POST."}, 400
+
+    resp = app.make_response(search_sites(params))
+    # only successful searches are worth caching; errors are retried
+    if resp.status_code != 200:
+        return resp
+    resp.add_etag()
+    resp.cache_control.public = True
+    resp.cache_control.max_age = app.config["SEARCH_MAX_AGE"]
+    return resp.make_conditional(request)
+
+
+def search_params_error(params):
+    """Return why a json search body can't be run, or None if it can."""
+    if not isinstance(params, dict):
+        return "Send a JSON object of search parameters."
+    for name in ("points", "terms", "siteids"):
+        if name in params and not isinstance(params[name], list):
+            return f"{name} must be a list."
+    for point in params.get("points") or []:
+        try:
+            float(point["lat"]), float(point["lng"])
+        except (TypeError, KeyError, ValueError):
+            return "points must be objects with numeric lat and lng."
+    for term in params.get("terms") or []:
+        if not isinstance(term, str):
+            return "terms must be strings."
+    for site_id in params.get("siteids") or []:
+        if isinstance(site_id, bool) or not str(site_id).isdigit():
+            return "siteids must be numbers."
+    return None
+
+
+def search_sites(params):
+    """Return the search response for params."""
+    if app.config["SITE_SEARCH_SOURCE"] == "local":
+        return search_local(params, app.config["SEARCH_MAX_QUERIES"])
+
+    grid = app.config["SEARCH_CACHE_GRID"]
+    limit = app.config["UPSTREAM_CONCURRENCY"]
+    max_queries = app.config["SEARCH_MAX_QUERIES"]
+
+    if params.get("points"):
+        sites = search_points(
+            params["points"][:max_queries], params.get("dist", 100), grid, limit
+        )
+        prefetch_results(sites)
+        return {"result": True, "request": params, "sites": sites}
+
+    if params.get("terms"):
+        matches = search_terms(params["terms"][:max_queries], grid, limit)
+        prefetch_results(matches)
+        return {"result": True, "request": params, "matches": matches}
+
+    if params.get("siteids"):
+        sites = fetch_details(params["siteids"][:max_queries], limit)
+        return {"result": True, "request": params, "sites": sites}
+
+    key, params = search_params(params, grid)
+    body, status = cached_search(key, params)
+
+    if prefetcher.enabled and status == 200:
+        try:
+            data = json.loads(body)
+            prefetch_results(data.get("sites") or data.get("matches"))
+        except ValueError:
+            pass
+
+    return app.response_class(body, status=status, mimetype="application/json")
+
 
-    res = requests.get("http://api.divesites.com", params=params)
+def prefetch_results(sites):
+    """Queue the top search results so their detail pages are served from the db."""
+    if sites:
+        top = sites[: app.config["PREFETCH_PER_SEARCH"]]
+        prefetcher.enqueue(site["id"] for site in top)
 
-    data = res.json()
 
-    return data
+@app.route("/sites/suggest")
+def suggest_sites():
+    """Return site names and locations that start with the query, for autocomplete."""
+    limit = min(request.args.get("k", app.config["SUGGEST_LIMIT"], type=int), 50)
+    return {"suggestions": suggest_index.complete(request.args.get("q", ""), limit)}
+
+
+@app.route("/tiles/<int:z>/<int:x>/<int:y>.mvt")
+def site_tiles(z, x, y):
+    """Return a Mapbox vector tile of every stored dive site, clustered at low zooms."""
+    if z > TILE_MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+        return {"result": False, "error": "No such tile."}, 404
+
+    digest, data = site_tile(z, x, y)
+    resp = Response(data, mimetype=TILE_MIME_TYPE)
+    resp.set_etag(digest)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = app.config["TILE_MAX_AGE"]
+    return resp.make_conditional(request)
+
+
+@app.route("/metrics")
+def metrics():
+    """Return in-process counters for monitoring."""
+    return {
+        "search_cache": search_cache.stats(),
+        "upstream_breaker": upstream.breaker.state,
+        "identity_cache": identity_cache.stats(),
+        "journal_maps": journal_maps.stats(),
+        "tile_cache": tile_cache.stats(),
+        "password_hashing": hash_pool.stats(),
+    }
 
 
 @app.route("/sites/<int:site_id>")
@@ -220,32 +411,56 @@ def show_site(site_id):
     site = Dive_site.query.get(site_id)
 
     if not site:
-        res = requests.get(
-            "http://api.divesites.com", params={"mode": "detail", "siteid": site_id}
-        )
-
-        data = res.json()
-        lat = float(data["site"]["lat"])
-        lng = float(data["site"]["lng"])
-        coords = [(lat, lng)]
-        loc = reverse_geocode.search(coords)
-        location = f"{loc[0]['city']}, {loc[0]['country']}"
-
-        new_site = Dive_site(
-            id=site_id,
-            name=data["site"]["name"],
-            lng=lng,
-            lat=lat,
-            description=data["site"]["description"],
-            location=location,
-        )
-
-        db.session.add(new_site)
-        db.session.commit()
-
-        return render_template("site-detail.html", site=new_site)
-
-    return render_template("site-detail.html", site=site)
+        data = upstream.get_json({"mode": "detail", "siteid": site_id})
+        # save_sites tolerates a prefetch worker storing the same site meanwhile
+        save_sites([dict(data["site"], id=site_id)])
+        site = Dive_site.query.get(site_id)
+
+    cached = not_modified(site.reviews_version)
+    if cached:
+        return cached
+
+    reviews, next_cursor = review_page(site_id)
+    return render_template(
+        "site-detail.html", site=site, reviews=reviews, next_cursor=next_cursor
+    )
+
+
+@app.route("/sites/<int:site_id>/reviews.json")
+def site_reviews_json(site_id):
+    """Return a page of a site's reviews for infinite scroll."""
+    site = Dive_site.query.get_or_404(site_id)
+    cached = not_modified(site.reviews_version)
+    if cached:
+        return cached
+
+    reviews, next_cursor = review_page(site_id)
+    items = [
+        {
+            "id": entry.id,
+            "username": entry.user.username,
+            "rating": entry.rating,
+            "description": entry.description,
+        }
+        for entry in reviews
+    ]
+    return {
+        "items": items,
+        "next": next_cursor,
+        "review_count": site.review_count,
+        "average_rating": site.average_rating,
+        "rating_histogram": site.rating_histogram,
+    }
+
+
+def review_page(site_id):
+    """Return (reviews, next_cursor) for the page requested by ?cursor."""
+    return keyset_page(
+        Journal_entry.for_site(site_id),
+        Journal_entry.id,
+        request.args.get("cursor"),
+        app.config["PAGE_SIZE"],
+    )
 
 
 @app.route("/bucketlist", methods=["GET", "POST"])
@@ -257,17 +472,57 @@ def add_bucketlist_site():
 
     if request.method == "POST":
         dive_site_id = request.json["id"]
-        site = Dive_site.query.get(dive_site_id)
-        if site in g.user.bucket_list:
-            return {"message": "This site is already in your bucket list."}
+        # only sites saved locally can be listed; check first so the foreign key
+        # error for a missing site isn't taken for a duplicate below
+        if Dive_site.query.get(dive_site_id) is None:
+            return {"message": "Dive site not found."}, 404
         bl_site = Bucket_list_site(dive_site_id=dive_site_id, user_id=g.user.id)
         db.session.add(bl_site)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # the unique (user_id, dive_site_id) index rejects duplicates
+            db.session.rollback()
+            return {"message": "This site is already in your bucket list."}
         return {"message": "Site added to bucket list"}
 
-    sites = g.user.bucket_list
+    sites, next_cursor = keyset_page(
+        Dive_site.bucket_list_of(g.user.id),
+        Dive_site.id,
+        request.args.get("cursor"),
+        app.config["PAGE_SIZE"],
+    )
 
-    return render_template("bucket-list.html", sites=sites)
+    return render_template("bucket-list.html", sites=sites, next_cursor=next_cursor)
+
+
+@app.route("/bucketlist.json")
+def bucket_list_json():
+    """Return a page of the user's bucket list for infinite scroll."""
+    if not g.user:
+        return {"result": False, "error": "Access unauthorized."}, 401
+
+    cached = not_modified(*Bucket_list_site.version(g.user.id))
+    if cached:
+        return cached
+
+    sites, next_cursor = keyset_page(
+        Dive_site.bucket_list_of(g.user.id),
+        Dive_site.id,
+        request.args.get("cursor"),
+        app.config["PAGE_SIZE"],
+    )
+    items = [
+        {
+            "id": site.id,
+            "name": site.name,
+            "location": site.location,
+            "lat": site.lat,
+            "lng": site.lng,
+        }
+        for site in sites
+    ]
+    return {"items": items, "next": next_cursor}
 
 
 @app.route("/bucketlist/<int:site_id>/delete", methods=["POST"])
@@ -283,6 +538,83 @@ def delete_bucketlist_site(site_id):
     return {"message": "Deleted"}
 
 
+@app.route("/bucketlist/batch", methods=["POST"])
+def bucket_list_batch():
+    """Add and remove many sites at once. Returns a status for each site id of each list.
+
+    Sites not stored yet are fetched from upstream, at most BUCKET_BATCH_FETCH_MAX
+    of them within the request. The rest are queued for the prefetch workers
+    and reported "pending"; those the queue can't take are "unavailable".
+    """
+    if not g.user:
+        return {"result": False, "error": "Access unauthorized."}, 401
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return {"result": False, "error": "Send a JSON object with add and remove lists."}, 400
+    add, remove = body.get("add") or [], body.get("remove") or []
+    if not isinstance(add, list) or not isinstance(remove, list):
+        return {"result": False, "error": "add and remove must be lists of site ids."}, 400
+    try:
+        add = list(dict.fromkeys(int(site_id) for site_id in add))
+        remove = list(dict.fromkeys(int(site_id) for site_id in remove))
+    except (TypeError, ValueError):
+        return {"result": False, "error": "Site ids must be numbers."}, 400
+    if len(add) + len(remove) > app.config["BUCKET_BATCH_MAX"]:
+        return {"result": False, "error": "Too many site ids in one request."}, 400
+
+    listed = Bucket_list_site.listed(g.user.id, remove)
+    Bucket_list_site.remove_many(g.user.id, listed)
+    db.session.commit()
+    removed = {site_id: "removed" if site_id in listed else "not_listed" for site_id in remove}
+
+    listed = Bucket_list_site.listed(g.user.id, add)
+    new = [site_id for site_id in add if site_id not in listed]
+    # sites from search results may only exist upstream so far; a few are fetched
+    # now and the rest left to the prefetch workers, so the client retries those
+    stored = stored_ids(new)
+    unstored = [site_id for site_id in new if site_id not in stored]
+    fetch_now = unstored[: app.config["BUCKET_BATCH_FETCH_MAX"]]
+    # the queue takes none when prefetch is off and stops taking ids once it is full
+    deferred = unstored[len(fetch_now):]
+    prefetcher.enqueue(deferred)
+    pending = prefetcher.pending(deferred)
+    failed = set(deferred) - pending
+    fetch_sites(fetch_now, app.config["UPSTREAM_CONCURRENCY"], failed)
+    known = stored_ids(new)
+    try:
+        Bucket_list_site.add_many(g.user.id, [site_id for site_id in new if site_id in known])
+        db.session.commit()
+    except IntegrityError:
+        # a concurrent request added some of these meanwhile, insert only the rest
+        db.session.rollback()
+        listed = Bucket_list_site.listed(g.user.id, add)
+        Bucket_list_site.add_many(
+            g.user.id, [site_id for site_id in new if site_id in known and site_id not in listed]
+        )
+        db.session.commit()
+
+    added = {}
+    for site_id in add:
+        if site_id in listed:
+            added[site_id] = "already_listed"
+        elif site_id in known:
+            added[site_id] = "added"
+        elif site_id in pending:
+            added[site_id] = "pending"
+        elif site_id in failed:
+            added[site_id] = "unavailable"
+        else:
+            added[site_id] = "not_found"
+
+    return {
+        "results": {
+            "add": {str(site_id): status for site_id, status in added.items()},
+            "remove": {str(site_id): status for site_id, status in removed.items()},
+        }
+    }
+
+
 @app.route("/journal")
 def show_dive_journal():
     """Show sites in users dive journal."""
@@ -290,9 +622,39 @@ def show_dive_journal():
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    sites = g.user.dive_journal
+    sites, next_cursor = keyset_page(
+        Journal_entry.for_user(g.user.id),
+        Journal_entry.id,
+        request.args.get("cursor"),
+        app.config["PAGE_SIZE"],
+    )
+
+    return render_template("dive-journal.html", sites=sites, next_cursor=next_cursor)
 
-    return render_template("dive-journal.html", sites=sites)
+
+@app.route("/journal.json")
+def dive_journal_json():
+    """Return a page of the user's dive journal for infinite scroll."""
+    if not g.user:
+        return {"result": False, "error": "Access unauthorized."}, 401
+
+    entries, next_cursor = keyset_page(
+        Journal_entry.for_user(g.user.id),
+        Journal_entry.id,
+        request.args.get("cursor"),
+        app.config["PAGE_SIZE"],
+    )
+    items = [
+        {
+            "id": entry.id,
+            "site_id": entry.dive_site_id,
+            "name": entry.dive_site.name,
+            "location": entry.dive_site.location,
+            "rating": entry.rating,
+        }
+        for entry in entries
+    ]
+    return {"items": items, "next": next_cursor}
 
 
 @app.route("/journal/<int:site_id>/add", methods=["GET", "POST"])
@@ -307,7 +669,7 @@ def add_journal_site(site_id):
     entry = Journal_entry.query.filter(
         Journal_entry.user_id == g.user.id, Journal_entry.dive_site_id == site_id
     ).first()
-    if entry in g.user.dive_journal:
+    if entry:
         flash("Site already in dive journal.", "danger")
         return redirect(f"/sites/{site_id}")
 
@@ -324,7 +686,9 @@ def add_journal_site(site_id):
             user_id=g.user.id,
         )
         db.session.add(entry)
+        Dive_site.add_rating(site_id, rating)
         db.session.commit()
+        review_feed.add(feed_item(entry))
 
         flash("Site added to dive journal.", "success")
         return redirect("/")
@@ -332,6 +696,72 @@ def add_journal_site(site_id):
     return render_template("journal-form.html", form=form, site=site)
 
 
+@app.route("/journal/map.json")
+def dive_journal_map():
+    """Return the user's dive sites inside a bounding box, clustered for a zoom level."""
+    if not g.user:
+        return {"result": False, "error": "Access unauthorized."}, 401
+
+    zoom = request.args.get("zoom", 0, type=int)
+    bbox = parse_bbox(request.args.get("bbox", "-180,-90,180,90"))
+    if bbox is None:
+        return {"result": False, "error": "bbox must be west,south,east,north."}, 400
+
+    features = journal_map(g.user.id).clusters(zoom, *bbox)
+    return {"type": "FeatureCollection", "features": features}
+
+
+@app.route("/journal/import", methods=["POST"])
+def import_journal():
+    """Import an uploaded CSV or UDDF logbook into the user's dive journal.
+
+    Streams one json line of progress per batch, listing that batch's row
+    errors, while the import runs.
+    """
+    if not g.user:
+        return {"result": False, "error": "Access unauthorized."}, 401
+
+    upload = request.files.get("logbook")
+    fmt = request.form.get("format") or (upload and logbook_format(upload.filename))
+    if not upload or fmt not in ("csv", "uddf"):
+        return {"result": False, "error": "Upload a .csv or .uddf logbook."}, 400
+
+    importer = LogbookImport(g.user.id)
+
+    def generate():
+        for progress in importer.run(upload.stream, fmt):
+            yield json.dumps(progress) + "\n"
+        review_feed.reset()
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+@app.route("/journal/export.<fmt>")
+def export_journal_file(fmt):
+    """Download the user's dive journal as csv, geojson or uddf."""
+    return export_response("dive-journal", fmt, export_journal)
+
+
+@app.route("/bucketlist/export.<fmt>")
+def export_bucket_list_file(fmt):
+    """Download the user's bucket list as csv, geojson or uddf."""
+    return export_response("bucket-list", fmt, export_bucket_list)
+
+
+def export_response(name, fmt, export):
+    """Stream export(user_id, fmt) as a file download, row by row."""
+    if not g.user:
+        return {"result": False, "error": "Access unauthorized."}, 401
+    if fmt not in EXPORT_FORMATS:
+        return {"result": False, "error": "Export as csv, geojson or uddf."}, 404
+
+    return Response(
+        stream_with_context(export(g.user.id, fmt)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename={name}.{fmt}"},
+    )
+
+
 @app.route('/journal/<int:entry_id>')
 def show_journal_detail(entry_id):
     """Show dive journal site detail."""
@@ -340,6 +770,9 @@ def show_journal_detail(entry_id):
         return redirect("/")
 
     entry = Journal_entry.query.get_or_404(entry_id)
+    cached = not_modified(entry.version)
+    if cached:
+        return cached
 
     return render_template('journal-detail.html', entry=entry)
 
@@ -352,7 +785,9 @@ def remove_site(entry_id):
 
     entry = Journal_entry.query.get(entry_id)
     db.session.delete(entry)
+    Dive_site.add_rating(entry.dive_site_id, entry.rating, count=-1)
     db.session.commit()
+    review_feed.remove(entry_id=entry_id)
 
     flash("Site deleted.", "danger")
     return redirect('/journal')
@@ -368,15 +803,104 @@ def edit_journal(entry_id):
     form = JournalSiteForm(obj=entry)
 
     if form.validate_on_submit():
+        old_rating = entry.rating
         form.populate_obj(entry)
+        entry.version = Journal_entry.version + 1
+        if int(entry.rating) != int(old_rating):
+            Dive_site.add_rating(entry.dive_site_id, old_rating, count=-1)
+            Dive_site.add_rating(entry.dive_site_id, entry.rating)
+        else:
+            Dive_site.reviews_changed(entry.dive_site_id)
         db.session.add(entry)
         db.session.commit()
+        review_feed.update(feed_item(entry))
         flash("Site updated.", "success")
         return redirect(f'/journal/{entry.id}')
 
     return render_template('journal-form.html', form=form, site=entry.dive_site)
 
 
+@app.cli.command("recompute-ratings")
+def recompute_ratings():
+    """Rebuild every dive site's review count and rating totals from the journal."""
+    updated = Dive_site.recompute_ratings()
+    db.session.commit()
+    click.echo(f"Recomputed ratings for {updated} dive sites.")
+
+
+@app.cli.command("import-log")
+@click.argument("username")
+@click.argument("logbook", type=click.File("rb"))
+@click.option("--format", "fmt", type=click.Choice(["csv", "uddf"]), help="Default: from the file name.")
+def import_log(username, logbook, fmt):
+    """Import a CSV or UDDF logbook into a user's dive journal."""
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException(f"No user named {username}.")
+    fmt = fmt or logbook_format(logbook.name)
+    if fmt is None:
+        raise click.ClickException("Pass --format for files not ending in .csv or .uddf.")
+
+    importer = LogbookImport(user.id)
+    for progress in importer.run(logbook, fmt):
+        for error in progress["errors"]:
+            click.echo(f"line {error['line']}: {error['error']}", err=True)
+        click.echo(
+            f"{progress['imported']} imported, {progress['skipped']} skipped, {progress['failed']} failed"
+        )
+
+
+@app.cli.command("send-outbox")
+@click.option("--loop", is_flag=True, help="Keep polling instead of exiting when the outbox is empty.")
+def send_outbox(loop):
+    """Send queued emails."""
+    while True:
+        sent = drain()
+        if sent:
+            click.echo(f"Sent {sent} emails.")
+        if not loop:
+            break
+        time.sleep(app.config["OUTBOX_POLL_INTERVAL"])
+
+
+@app.cli.command("send-digest")
+@click.option("--hours", default=24, help="Include reviews added in the last this many hours.")
+@click.option("--rate", type=float, help="Messages per second (default DIGEST_SEND_RATE).")
+@click.option("--dry-run", "mbox_path", metavar="MBOX", help="Write messages to this mbox file instead of sending.")
+def send_digest(hours, rate, mbox_path):
+    """Email users the new reviews of sites on their bucket list."""
+    with app.test_request_context(base_url=app.config["SITE_URL"]):
+        mailer = send_review_digest(hours=hours, rate=rate, mbox_path=mbox_path)
+    click.echo(f"Sent {mailer.sent} digests, {mailer.failed} failed.")
+
+
+@app.cli.command("ingest-sites")
+@click.option("--dist", default=300, help="Search radius in miles for each sweep point.")
+@click.option("--batch-size", default=500, help="Rows geocoded and inserted per batch.")
+def ingest_sites(dist, batch_size):
+    """Copy the whole divesites.com catalog into the dive_sites table."""
+    ingest_catalog(dist=dist, batch_size=batch_size, echo=click.echo)
+
+
+@app.cli.command("prune-tiles")
+def prune_tiles():
+    """Delete rendered tiles that no z/x/y points to any more."""
+    click.echo(f"Deleted {tile_cache.prune()} unused tiles.")
+
+
+@app.errorhandler(UpstreamUnavailable)
+def upstream_unavailable(e):
+    """Fail fast with a json error when the dive site api is down."""
+    return {"result": False, "error": str(e)}, 503
+
+
+@app.errorhandler(UserGone)
+def user_gone(e):
+    """The user was deleted by another worker; show the page again logged out."""
+    db.session.rollback()
+    return redirect(request.full_path if request.method == "GET" else "/")
+
+
 @app.errorhandler(Exception)
 def server_error(e):
     """Display error page. Log error message with stack trace."""
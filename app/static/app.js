@@ -1,6 +1,6 @@
 // sends request to server to call API for dive sites near current coordinates
 async function getSites(lng, lat) {
-	let res = await axios.post(`/sites/search`, { mode: 'sites', lat: lat, lng: lng, dist: 100 });
+	let res = await axios.get(`/sites/search`, { params: { mode: 'sites', lat: lat, lng: lng, dist: 100 } });
 	const sites = res.data.sites;
 
 	if (sites.length > 0) {
@@ -27,7 +27,7 @@ async function getSearchResults(str) {
 		return;
 	}
 
-	let res = await axios.post(`/sites/search`, { mode: 'search', str: str });
+	let res = await axios.get(`/sites/search`, { params: { mode: 'search', str: str } });
 	const sites = res.data.matches;
 
 	if (sites.length > 0) {
@@ -70,6 +70,7 @@ function makeList(sites) {
 		const li = $(`<li class="list-group-item sl"><a href="/sites/${site.id}">${site.name}</a></li>`);
 		$('#site-list').append(li);
 	}
+	$('#save-all').data('ids', sites.map((site) => site.id)).removeClass('d-none');
 }
 
 // removes current markers from the map
@@ -78,8 +79,22 @@ function clearMarkers() {
 		marker.remove();
 	}
 	$('#site-list').html('');
+	$('#save-all').addClass('d-none');
 }
 
+// adds every site in the current search results to user's bucket list
+$('#save-all').on('click', async function saveAll() {
+	let res = await axios.post('/bucketlist/batch', { add: $(this).data('ids') });
+	const statuses = Object.values(res.data.results.add);
+	const added = statuses.filter((status) => status === 'added').length;
+	const pending = statuses.filter((status) => status === 'pending' || status === 'unavailable').length;
+	let message = `Added ${added} sites to your bucket list.`;
+	if (pending > 0) {
+		message += ` ${pending} more could not be fetched yet, try again shortly.`;
+	}
+	$('#results').html(`<p>${message}</p>`);
+});
+
 // adds current dive site to user's bucket list
 $('#bucket-list-add').on('click', async function addToList() {
 	// get site id
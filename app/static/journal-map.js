@@ -0,0 +1,58 @@
+mapboxgl.accessToken = mapToken;
+
+// create new map
+let map = new mapboxgl.Map({
+	container : 'journal-map',
+	style     : 'mapbox://styles/blakes24/ckjoq7xhd1bgc19lljdhgtpod'
+});
+
+// Add zoom and rotation controls to the map.
+map.addControl(new mapboxgl.NavigationControl(), 'bottom-right');
+map.setZoom(1);
+map.setCenter([ -170, 20 ]);
+
+// fetch the clusters for the visible part of the map from the server
+async function loadClusters() {
+	const bounds = map.getBounds();
+	const bbox = [ bounds.getWest(), bounds.getSouth(), bounds.getEast(), bounds.getNorth() ].join(',');
+	const res = await axios.get('/journal/map.json', {
+		params : { zoom: Math.floor(map.getZoom()), bbox: bbox }
+	});
+	map.getSource('dives').setData(res.data);
+}
+
+map.on('load', () => {
+	map.addSource('dives', {
+		type : 'geojson',
+		data : { type: 'FeatureCollection', features: [] }
+	});
+	map.addLayer({
+		id     : 'dives',
+		type   : 'circle',
+		source : 'dives',
+		paint  : {
+			'circle-color'  : [ 'case', [ 'get', 'cluster' ], '#8FC0A9', '#F78154' ],
+			'circle-radius' : [ 'step', [ 'get', 'count' ], 7, 10, 12, 100, 18 ]
+		}
+	});
+	map.addLayer({
+		id     : 'dive-counts',
+		type   : 'symbol',
+		source : 'dives',
+		filter : [ 'get', 'cluster' ],
+		layout : { 'text-field': [ 'get', 'count' ], 'text-size': 12 }
+	});
+	loadClusters();
+});
+
+map.on('moveend', loadClusters);
+
+// zoom into a cluster, or open the site of a single dive
+map.on('click', 'dives', (e) => {
+	const feature = e.features[0];
+	if (feature.properties.cluster) {
+		map.easeTo({ center: feature.geometry.coordinates, zoom: feature.properties.expansion_zoom });
+	} else {
+		window.location = `/sites/${feature.properties.site_id}`;
+	}
+});
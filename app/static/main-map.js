@@ -12,6 +12,36 @@ map.addControl(new mapboxgl.NavigationControl(), 'bottom-right');
 map.setZoom(1);
 map.setCenter([ -170, 20 ]);
 
+// show every stored dive site from vector tiles, clustered at low zooms
+map.on('load', () => {
+	map.addSource('sites', {
+		type    : 'vector',
+		tiles   : [ `${window.location.origin}/tiles/{z}/{x}/{y}.mvt` ],
+		maxzoom : 14
+	});
+	map.addLayer({
+		id             : 'sites',
+		type           : 'circle',
+		source         : 'sites',
+		'source-layer' : 'sites',
+		paint          : {
+			'circle-color'   : '#F78154',
+			'circle-opacity' : 0.7,
+			'circle-radius'  : [ 'step', [ 'get', 'count' ], 3, 10, 6, 100, 10, 1000, 14 ]
+		}
+	});
+});
+
+// open a site's page, or zoom into a cluster
+map.on('click', 'sites', (e) => {
+	const feature = e.features[0];
+	if (!feature.properties.cluster) {
+		window.location = `/sites/${feature.id}`;
+	} else {
+		map.easeTo({ center: e.lngLat, zoom: map.getZoom() + 2 });
+	}
+});
+
 const center = map.getCenter();
 const currentMarkers = [];
 
@@ -34,6 +64,28 @@ $('#search-text').on('keyup', () => {
 	pinOnMap = false;
 });
 
+// suggest site names and places as the user types
+let suggestTimer;
+
+$('#search-text').on('input', () => {
+	clearTimeout(suggestTimer);
+	suggestTimer = window.setTimeout(getSuggestions, 150);
+});
+
+async function getSuggestions() {
+	const q = $('#search-text').val().trim();
+	if (q.length < 2) {
+		$('#suggestions').html('');
+		return;
+	}
+
+	let res = await axios.get('/sites/suggest', { params: { q: q } });
+	$('#suggestions').html('');
+	for (let suggestion of res.data.suggestions) {
+		$('#suggestions').append($('<option>').attr('value', suggestion));
+	}
+}
+
 //touch screen: place marker on point where map is touched and held
 let pressTimer;
 
@@ -0,0 +1,71 @@
+"""Startup benchmark: time from import to first response and peak RSS.
+
+Each run happens in a fresh interpreter, like a newly forked worker that
+did not inherit a preloaded app. Run it before and after changes that touch
+imports or app setup and paste the output into the review:
+
+    python bench_startup.py --config testing --runs 5
+"""
+
+import sys
+import json
+import argparse
+import subprocess
+
+CHILD = """
+import sys, json, time, resource
+start = time.perf_counter()
+from app import create_app
+app = create_app(sys.argv[1])
+imported = time.perf_counter()
+resp = app.test_client().get(sys.argv[2])
+responded = time.perf_counter()
+heavy = ["numpy", "scipy", "reverse_geocode", "flask_debugtoolbar", "flask_mail"]
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "first_response_ms": (responded - start) * 1000,
+    "status": resp.status_code,
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavy_modules": [name for name in heavy if name in sys.modules],
+}))
+"""
+
+
+def run_once(config_name, path):
+    """Start a fresh interpreter, serve one request and return its measurements."""
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD, config_name, path],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", default="development")
+    parser.add_argument("--path", default="/login")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, help="fail if median first response is slower")
+    parser.add_argument("--max-rss-mb", type=float, help="fail if peak RSS is higher")
+    args = parser.parse_args()
+
+    results = [run_once(args.config, args.path) for _ in range(args.runs)]
+    first = sorted(result["first_response_ms"] for result in results)
+    imports = sorted(result["import_ms"] for result in results)
+    rss = max(result["peak_rss_mb"] for result in results)
+    median = first[len(first) // 2]
+
+    print(f"runs:                {args.runs} ({args.config}, GET {args.path})")
+    print(f"import + create_app: {imports[len(imports) // 2]:.0f} ms median")
+    print(f"first response:      {median:.0f} ms median, {first[0]:.0f}-{first[-1]:.0f} ms range")
+    print(f"peak RSS per worker: {rss:.1f} MB")
+    print(f"heavy modules:       {', '.join(results[0]['heavy_modules']) or 'none'}")
+
+    failed = (args.max_ms and median > args.max_ms) or (args.max_rss_mb and rss > args.max_rss_mb)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
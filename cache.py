@@ -0,0 +1,130 @@
+"""In-process caches."""
+
+import time
+import threading
+
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+
+    Capacity can be capped by entry count, by total size in bytes (as
+    measured by `sizeof`), or both.
+    """
+
+    def __init__(self, ttl=300, max_entries=None, max_bytes=None, sizeof=len):
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self.sizeof = sizeof
+        self.configure(ttl, max_entries, max_bytes)
+
+    def configure(self, ttl, max_entries=None, max_bytes=None):
+        """Set limits and drop every entry."""
+        with self._lock:
+            self.ttl = ttl
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self._data.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def get(self, key):
+        """Return cached value for key or None if missing or expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, size, expires = entry
+            if expires <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store value for key, evicting least recently used entries if full."""
+        size = self.sizeof(value) if self.max_bytes else 0
+        if self.max_bytes and size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+            self._data[key] = (value, size, time.monotonic() + self.ttl)
+            self.size += size
+
+            while (self.max_entries and len(self._data) > self.max_entries) or (
+                self.max_bytes and self.size > self.max_bytes
+            ):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key):
+        """Remove key if present."""
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        """Remove every entry, keeping counters."""
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def stats(self):
+        """Return counters for monitoring."""
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, key):
+        value, size, expires = self._data.pop(key)
+        self.size -= size
+
+
+def snap(value, grid):
+    """Round a coordinate to the nearest grid line and format it compactly."""
+    snapped = round(float(value) / grid) * grid
+    text = f"{snapped:.4f}".rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+
+def search_params(params, grid):
+    """Normalize /sites/search parameters so nearby requests share a cache entry.
+
+    Returns a (key, params) pair where params are the normalized values to send
+    upstream.
+    """
+    mode = str(params.get("mode", "")).strip().lower()
+    normalized = {"mode": mode}
+
+    if "lat" in params and "lng" in params:
+        normalized["lat"] = snap(params["lat"], grid)
+        normalized["lng"] = snap(params["lng"], grid)
+    if "dist" in params:
+        normalized["dist"] = str(params["dist"]).strip()
+    if "str" in params:
+        normalized["str"] = " ".join(str(params["str"]).lower().split())
+    if "siteid" in params:
+        normalized["siteid"] = str(params["siteid"]).strip()
+
+    key = tuple(sorted(normalized.items()))
+    return key, normalized
+
+
+search_cache = TTLCache()
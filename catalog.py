@@ -0,0 +1,177 @@
+"""Local mirror of the divesites.com catalog."""
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Dive_site
+from geo import MILES_PER_DEGREE
+from upstream import upstream
+from gateway import merge_sites, fetch_details
+from suggest import suggest_index
+from tiles import tile_cache
+from geocode import locate
+
+
+def site_json(site, distance=None):
+    """Serialize a Dive_site the way the upstream api does."""
+    data = {
+        "id": str(site.id),
+        "name": site.name,
+        "lat": str(site.lat),
+        "lng": str(site.lng),
+        "description": site.description,
+        "location": site.location,
+    }
+    if distance is not None:
+        data["distance"] = f"{distance:.2f}"
+    return data
+
+
+def search_local(params, max_queries=20):
+    """Answer a /sites/search request from the dive_sites table."""
+    mode = params.get("mode")
+    request_info = {
+        key: val if isinstance(val, list) else str(val) for key, val in params.items()
+    }
+
+    if params.get("points"):
+        dist = float(params.get("dist", 100))
+        sites = merge_sites(
+            [
+                site_json(site, miles)
+                for site, miles in Dive_site.within(
+                    float(point["lat"]), float(point["lng"]), dist
+                )
+            ]
+            for point in params["points"][:max_queries]
+        )
+        return {"result": True, "request": request_info, "sites": sites}
+
+    if params.get("terms"):
+        matches = merge_sites(
+            [site_json(site) for site in Dive_site.search(term)]
+            for term in params["terms"][:max_queries]
+        )
+        return {"result": True, "request": request_info, "matches": matches}
+
+    if params.get("siteids"):
+        site_ids = [int(site_id) for site_id in params["siteids"][:max_queries]]
+        sites = Dive_site.query.filter(Dive_site.id.in_(site_ids)).all()
+        return {"result": True, "request": request_info, "sites": [site_json(site) for site in sites]}
+
+    if mode == "sites":
+        lat = float(params["lat"])
+        lng = float(params["lng"])
+        dist = float(params.get("dist", 100))
+        sites = [site_json(site, miles) for site, miles in Dive_site.within(lat, lng, dist)]
+        return {"result": True, "request": request_info, "loc": [lat, lng], "sites": sites}
+
+    if mode == "search":
+        matches = [site_json(site) for site in Dive_site.search(params.get("str", ""))]
+        return {
+            "result": True,
+            "request": request_info,
+            "message": f"We found {len(matches)} matching dive sites.",
+            "matches": matches,
+        }
+
+    return {"result": False, "request": request_info, "error": "Unsupported mode."}
+
+
+def stored_ids(site_ids):
+    """Return the subset of site ids already in dive_sites."""
+    if not site_ids:
+        return set()
+    return {
+        site_id
+        for (site_id,) in db.session.query(Dive_site.id).filter(
+            Dive_site.id.in_(list(site_ids))
+        )
+    }
+
+
+def save_sites(rows):
+    """Bulk insert upstream site rows that are not stored yet. Returns count inserted."""
+    rows = {int(row["id"]): row for row in rows}
+    existing = stored_ids(rows)
+    new_rows = [row for site_id, row in rows.items() if site_id not in existing]
+    if not new_rows:
+        return 0
+
+    coords = [(float(row["lat"]), float(row["lng"])) for row in new_rows]
+    locations = locate(coords)
+    mappings = [
+        {
+            "id": int(row["id"]),
+            "name": row["name"],
+            "lat": lat,
+            "lng": lng,
+            "description": row.get("description"),
+            "location": location,
+        }
+        for row, (lat, lng), location in zip(new_rows, coords, locations)
+    ]
+
+    try:
+        db.session.bulk_insert_mappings(Dive_site, mappings)
+        db.session.commit()
+    except IntegrityError:
+        # another worker stored some of these meanwhile, insert only the rest
+        db.session.rollback()
+        existing = stored_ids(rows)
+        mappings = [row for row in mappings if row["id"] not in existing]
+        db.session.bulk_insert_mappings(Dive_site, mappings)
+        db.session.commit()
+
+    suggest_index.add(
+        [row["name"] for row in mappings] + [row["location"] for row in mappings]
+    )
+    tile_cache.invalidate((row["lat"], row["lng"]) for row in mappings)
+    return len(mappings)
+
+
+def fetch_sites(site_ids, limit, failed=None):
+    """Fetch, geocode and store every site id not already in dive_sites. Returns count inserted.
+
+    Ids upstream couldn't be asked about are added to the `failed` set if one is given.
+    """
+    site_ids = {int(site_id) for site_id in site_ids}
+    missing = site_ids - stored_ids(site_ids)
+    if not missing:
+        return 0
+    return save_sites(fetch_details(sorted(missing), limit, failed))
+
+
+def sweep_points(dist):
+    """Yield search centres whose `dist` mile circles cover the globe."""
+    step = dist / MILES_PER_DEGREE
+    lat = -80.0
+    while lat <= 80.0:
+        lng = -180.0
+        while lng < 180.0:
+            yield lat, lng
+            lng += step
+        lat += step
+
+
+def ingest_catalog(dist=300, batch_size=500, echo=print):
+    """Copy the whole upstream catalog into dive_sites. Returns count inserted."""
+    seen = set()
+    batch = []
+    inserted = 0
+
+    for lat, lng in sweep_points(dist):
+        data = upstream.get_json({"mode": "sites", "lat": lat, "lng": lng, "dist": dist})
+        for row in data.get("sites") or []:
+            if row["id"] in seen:
+                continue
+            seen.add(row["id"])
+            batch.append(row)
+
+        if len(batch) >= batch_size:
+            inserted += save_sites(batch)
+            batch = []
+            echo(f"{len(seen)} sites seen, {inserted} inserted")
+
+    inserted += save_sites(batch)
+    echo(f"Done: {len(seen)} sites seen, {inserted} inserted")
+    return inserted
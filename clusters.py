@@ -0,0 +1,159 @@
+"""Server-side point clustering for the dive journal map."""
+
+from math import isfinite
+
+from sqlalchemy import func
+
+from cache import TTLCache
+from geo import project
+from models import db, Dive_site, Journal_entry
+
+# clusters are about 64px across on 256px map tiles
+CELLS_PER_TILE = 4
+MAX_ZOOM = 16
+
+journal_maps = TTLCache()
+
+
+class ClusterIndex:
+    """Grid clusters of points for every zoom level from 0 to max_zoom.
+
+    The deepest level is built from the points and each level above it by
+    merging groups of four cells, so building is linear in the number of
+    points. A query only visits the cells inside the bounding box, so its
+    cost and payload depend on the viewport rather than on the point count.
+    """
+
+    def __init__(self, points, max_zoom=MAX_ZOOM):
+        self.max_zoom = max_zoom
+        self.levels = [None] * (max_zoom + 1)
+
+        size = (2 ** max_zoom) * CELLS_PER_TILE
+        cells = {}
+        for site_id, name, lat, lng in points:
+            x, y = project(lat, lng)
+            key = (min(int(x * size), size - 1), min(int(y * size), size - 1))
+            cell = cells.get(key)
+            if cell is None:
+                cells[key] = [1, lat, lng, site_id, name]
+            else:
+                cell[0] += 1
+                cell[1] += lat
+                cell[2] += lng
+        self.levels[max_zoom] = cells
+
+        for zoom in range(max_zoom - 1, -1, -1):
+            parents = {}
+            for (cx, cy), (count, lat, lng, site_id, name) in self.levels[zoom + 1].items():
+                key = (cx // 2, cy // 2)
+                cell = parents.get(key)
+                if cell is None:
+                    parents[key] = [count, lat, lng, site_id, name]
+                else:
+                    cell[0] += count
+                    cell[1] += lat
+                    cell[2] += lng
+            self.levels[zoom] = parents
+
+    def __len__(self):
+        return sum(cell[0] for cell in self.levels[0].values())
+
+    def clusters(self, zoom, west=-180.0, south=-90.0, east=180.0, north=90.0):
+        """Return the clusters and single points at zoom inside the bounding box.
+
+        A box whose west edge is east of its east edge crosses the antimeridian.
+        """
+        zoom = min(max(int(zoom), 0), self.max_zoom)
+        cells = self.levels[zoom]
+        size = (2 ** zoom) * CELLS_PER_TILE
+
+        x0, y0 = project(north, west)
+        x1, y1 = project(south, east)
+        rows = range(min(int(y0 * size), size - 1), min(int(y1 * size), size - 1) + 1)
+        first, last = min(int(x0 * size), size - 1), min(int(x1 * size), size - 1)
+        if west > east:
+            columns = list(range(first, size)) + list(range(0, last + 1))
+        else:
+            columns = range(first, last + 1)
+
+        # walk whichever is smaller: the cells in the box or the occupied cells
+        if len(columns) * len(rows) < len(cells):
+            found = (cells[(cx, cy)] for cy in rows for cx in columns if (cx, cy) in cells)
+        else:
+            column_set = set(columns)
+            found = (
+                cell for (cx, cy), cell in cells.items() if cx in column_set and cy in rows
+            )
+        return [cluster_feature(cell, zoom) for cell in found]
+
+
+def cluster_feature(cell, zoom):
+    """Return a GeoJSON point feature for a grid cell."""
+    count, lat, lng, site_id, name = cell
+    if count == 1:
+        properties = {"cluster": False, "count": 1, "site_id": site_id, "name": name}
+    else:
+        lat, lng = lat / count, lng / count
+        properties = {"cluster": True, "count": count, "expansion_zoom": zoom + 1}
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [round(lng, 6), round(lat, 6)]},
+        "properties": properties,
+    }
+
+
+def journal_version(user_id):
+    """Return (entry count, newest entry id) for a user's journal.
+
+    Any add or delete changes it, and it is one index-only read on
+    (user_id, id), so every worker sees other workers' writes.
+    """
+    return (
+        db.session.query(func.count(Journal_entry.id), func.max(Journal_entry.id))
+        .filter(Journal_entry.user_id == user_id)
+        .one()
+    )
+
+
+def journal_points(user_id):
+    """Return (site_id, name, lat, lng) for each dive site in a user's journal."""
+    return (
+        db.session.query(Dive_site.id, Dive_site.name, Dive_site.lat, Dive_site.lng)
+        .join(Journal_entry, Journal_entry.dive_site_id == Dive_site.id)
+        .filter(Journal_entry.user_id == user_id)
+        .all()
+    )
+
+
+def journal_map(user_id):
+    """Return the user's ClusterIndex, rebuilding it only if their journal changed."""
+    version = tuple(journal_version(user_id))
+    cached = journal_maps.get(user_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    index = ClusterIndex(journal_points(user_id))
+    journal_maps.set(user_id, (version, index))
+    return index
+
+
+def parse_bbox(text):
+    """Return (west, south, east, north) from "west,south,east,north", or None if invalid.
+
+    Longitudes past the antimeridian, as a panned web map reports them, are
+    wrapped back into -180 to 180, leaving west > east for a box that crosses it.
+    """
+    try:
+        west, south, east, north = (float(value) for value in text.split(","))
+    except ValueError:
+        return None
+    if not (-90 <= south < north <= 90) or not isfinite(east - west):
+        return None
+    if east - west >= 360:
+        return -180.0, south, 180.0, north
+    return wrap(west), south, wrap(east), north
+
+
+def wrap(lng):
+    """Return a longitude wrapped into -180 to 180."""
+    return lng if -180 <= lng <= 180 else (lng + 180) % 360 - 180
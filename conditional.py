@@ -0,0 +1,59 @@
+"""Conditional GET: version ETags, 304 responses and Cache-Control."""
+
+import hashlib
+
+from flask import current_app, g, request, session
+
+
+def page_etag(*version):
+    """Return an ETag for the requested page from the version of its data.
+
+    The url, the viewer's id, username and confirmed flag (the layout shows
+    them) and ETAG_SALT, which changes each release, are part of it too.
+    """
+    viewer = (g.user.id, g.user.username, g.user.confirmed) if g.user else None
+    parts = (
+        current_app.config["ETAG_SALT"],
+        request.path,
+        request.query_string,
+        viewer,
+        version,
+    )
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def not_modified(*version):
+    """Return a 304 response if the client's copy of this page is current, else None.
+
+    Call it with the page's data version before loading or rendering anything
+    else. add_validators puts the ETag and Cache-Control on the full response.
+    Pages with a pending flash message are not validated, since the message
+    is shown once.
+    """
+    if session.get("_flashes"):
+        return None
+    g.etag = page_etag(*version)
+    if g.etag in request.if_none_match:
+        return add_validators(current_app.response_class(status=304))
+    return None
+
+
+def add_validators(response):
+    """Add the ETag from not_modified and Cache-Control to a successful response.
+
+    Pages for a logged in user are private and revalidated on every view;
+    anonymous pages may be reused by any cache for PUBLIC_MAX_AGE seconds.
+    """
+    etag = g.get("etag")
+    if etag is None or response.status_code not in (200, 304):
+        return response
+
+    response.set_etag(etag)
+    if g.user:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config["PUBLIC_MAX_AGE"]
+    response.vary.add("Cookie")
+    return response
@@ -1,5 +1,6 @@
 from dotenv import load_dotenv
 import os
+import tempfile
 
 
 load_dotenv()
@@ -10,6 +11,89 @@ class Config:
     SQLALCHEMY_ECHO = False
     DEBUG_TB_INTERCEPT_REDIRECTS = False
     SECURITY_PASSWORD_SALT = os.environ.get('SECURITY_PASSWORD_SALT')
+    MAIL_SERVER = os.environ.get('MAIL_SERVER')
+    MAIL_PORT = 465
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+    MAIL_USE_TLS = False
+    MAIL_USE_SSL = True
+    MAIL_SUPPRESS_SEND = False
+    # 'upstream' proxies /sites/search to divesites.com, 'local' answers from dive_sites
+    SITE_SEARCH_SOURCE = os.environ.get('SITE_SEARCH_SOURCE', 'upstream')
+    # upstream search responses are cached per process, coordinates snapped to a grid in degrees
+    SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', 6 * 60 * 60))
+    SEARCH_CACHE_MAX_BYTES = int(os.environ.get('SEARCH_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    SEARCH_CACHE_GRID = float(os.environ.get('SEARCH_CACHE_GRID', 0.05))
+    UPSTREAM_URL = os.environ.get('UPSTREAM_URL', 'http://api.divesites.com')
+    UPSTREAM_CONNECT_TIMEOUT = 3.05
+    UPSTREAM_READ_TIMEOUT = 10
+    UPSTREAM_RETRIES = 2
+    UPSTREAM_BACKOFF = 0.25
+    UPSTREAM_POOL_SIZE = 10
+    # failures in a row that open the circuit breaker, and seconds before it tries again
+    UPSTREAM_BREAKER_THRESHOLD = 5
+    UPSTREAM_BREAKER_RESET = 30
+    # parallel upstream requests per fan-out search, and points/terms allowed per search
+    UPSTREAM_CONCURRENCY = 8
+    SEARCH_MAX_QUERIES = 20
+    # details for the top search results are fetched into dive_sites in the background
+    PREFETCH_ENABLED = True
+    PREFETCH_WORKERS = 2
+    PREFETCH_QUEUE_SIZE = 1000
+    PREFETCH_BATCH_SIZE = 25
+    PREFETCH_PER_SEARCH = 50
+    SUGGEST_LIMIT = 10
+    # logged in user snapshots per process; other sessions see profile changes after the ttl
+    IDENTITY_CACHE_TTL = 60
+    IDENTITY_CACHE_SIZE = 10000
+    # bcrypt work factor; existing hashes are upgraded on the next successful login
+    BCRYPT_LOG_ROUNDS = 12
+    BCRYPT_WORKERS = 2
+    BCRYPT_MAX_PENDING = 32
+    # emails are queued in outbox_emails and sent by a thread in each web worker, unless
+    # a separate `flask send-outbox --loop` process (the Procfile worker) sends them
+    OUTBOX_WORKER_ENABLED = os.environ.get('OUTBOX_WORKER_ENABLED', 'true').lower() == 'true'
+    OUTBOX_POLL_INTERVAL = 5
+    OUTBOX_BATCH_SIZE = 50
+    OUTBOX_MAX_ATTEMPTS = 8
+    OUTBOX_BACKOFF = 30
+    # most site ids one /bucketlist/batch request may add or remove
+    BUCKET_BATCH_MAX = 500
+    # most unstored site ids one batch request fetches from upstream while the client
+    # waits, so at worst that many detail calls at UPSTREAM_CONCURRENCY; the rest are prefetched
+    BUCKET_BATCH_FETCH_MAX = 25
+    # logbook rows resolved and inserted per transaction
+    IMPORT_BATCH_SIZE = 500
+    # a site from another app's UDDF logbook matches the nearest stored site this close
+    IMPORT_MATCH_MILES = 0.5
+    # rows fetched per round trip when streaming exports
+    EXPORT_BATCH_SIZE = 1000
+    # rows per page of the journal, bucket list and site reviews
+    PAGE_SIZE = 50
+    # recent reviews feed: reviews kept per worker, reload interval, reviews on the home page
+    FEED_SIZE = 100
+    FEED_TTL = 60
+    FEED_HOME_SIZE = 5
+    # clustered journal maps kept per worker; rebuilt when the user's journal changes
+    JOURNAL_MAP_CACHE_TTL = 60 * 60
+    JOURNAL_MAP_CACHE_SIZE = 1000
+    # rendered vector tiles, shared by every worker on the host; browsers keep them for TILE_MAX_AGE
+    TILE_CACHE_DIR = os.environ.get(
+        'TILE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'dive-atlas-tiles')
+    )
+    TILE_MAX_AGE = 24 * 60 * 60
+    # cached tiles are re-rendered after this long, to pick up sites saved on other hosts
+    TILE_CACHE_TTL = 10 * 60
+    # review digests: messages per second and users fetched per database round trip
+    DIGEST_SEND_RATE = 10
+    DIGEST_BATCH_SIZE = 500
+    # page ETags change with each release; anonymous pages are cached this many seconds
+    ETAG_SALT = os.environ.get('HEROKU_RELEASE_VERSION', '')
+    PUBLIC_MAX_AGE = 60
+    # browsers and proxies may reuse GET /sites/search responses this many seconds
+    SEARCH_MAX_AGE = 5 * 60
+    # used for links in emails sent outside a request
+    SITE_URL = os.environ.get('SITE_URL', 'http://localhost:5000')
 
     @staticmethod
     def init_app(app):
@@ -21,18 +105,39 @@ class DevelopmentConfig(Config):
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('DEV_DATABASE_URL')
 
+    @staticmethod
+    def init_app(app):
+        # the toolbar is only installed for development, so import it here
+        from flask_debugtoolbar import DebugToolbarExtension
+
+        DebugToolbarExtension(app)
+
 class TestingConfig(Config):
     """Configurations for Testing Environment."""
 
     TESTING = True
     WTF_CSRF_ENABLED = False
     MAIL_SUPPRESS_SEND = True
+    # a fixed sender so mail tests don't depend on the environment
+    MAIL_USERNAME = 'atlas@example.com'
+    MAIL_DEFAULT_SENDER = MAIL_USERNAME
+    PREFETCH_ENABLED = False
+    BCRYPT_LOG_ROUNDS = 4
+    OUTBOX_WORKER_ENABLED = False
+    # each test run gets its own tiles, not those of a dev server on the same host
+    TILE_CACHE_DIR = os.path.join(tempfile.gettempdir(), f'dive-atlas-tiles-test-{os.getpid()}')
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL')
 
 class ProductionConfig(Config):
     """Configurations for Production Environment."""
 
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
+    # the Procfile worker process drains the outbox
+    OUTBOX_WORKER_ENABLED = os.environ.get('OUTBOX_WORKER_ENABLED', 'false').lower() == 'true'
+    # load the geocoder in the gunicorn master so workers share it
+    GEOCODER_PRELOAD = os.environ.get('GEOCODER_PRELOAD', 'true').lower() == 'true'
+    # and the autocomplete index, so the first /sites/suggest in each worker doesn't scan dive_sites
+    SUGGEST_PRELOAD = os.environ.get('SUGGEST_PRELOAD', 'true').lower() == 'true'
 
 config = {
     'development': DevelopmentConfig,
@@ -0,0 +1,178 @@
+"""Digest emails sent to many users over one SMTP connection."""
+
+import time
+import logging
+import mailbox
+import smtplib
+
+from datetime import datetime, timedelta
+from itertools import groupby
+
+from flask import current_app, render_template
+from markupsafe import escape
+from sqlalchemy.orm import joinedload
+
+from models import db, User, Bucket_list_site, Journal_entry
+from verify import get_mail
+
+logger = logging.getLogger(__name__)
+
+
+class BulkMailer:
+    """Sends many messages over one connection, at most `rate` per second.
+
+    With `mbox_path` set, messages are appended to that mbox file instead of
+    being sent, for trying out a digest locally.
+    """
+
+    def __init__(self, rate=None, mbox_path=None):
+        self.interval = 1.0 / rate if rate else 0
+        self.mbox_path = mbox_path
+        self.sent = 0
+        self.failed = 0
+        self._next_at = 0
+        self._conn = None
+        self._box = None
+
+    def __enter__(self):
+        if self.mbox_path:
+            self._box = mailbox.mbox(self.mbox_path)
+            self._box.lock()
+        else:
+            self._connect()
+        return self
+
+    def __exit__(self, *exc):
+        if self._box is not None:
+            self._box.flush()
+            self._box.unlock()
+            self._box.close()
+        if self._conn is not None:
+            self._close()
+
+    def _connect(self):
+        self._conn = get_mail().connect()
+        self._conn.__enter__()
+
+    def _close(self):
+        """Close the connection, even one the server has already dropped."""
+        host, self._conn = self._conn.host, None
+        if host is None:
+            return
+        try:
+            host.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        finally:
+            # quit leaves the socket open if the QUIT command itself fails
+            host.close()
+
+    def _throttle(self):
+        """Sleep until the next send is allowed by the rate limit."""
+        now = time.monotonic()
+        if self._next_at > now:
+            time.sleep(self._next_at - now)
+            now = self._next_at
+        self._next_at = now + self.interval
+
+    def send(self, msg):
+        """Send msg, reconnecting once if the server dropped the connection."""
+        self._throttle()
+        if self._box is not None:
+            self._box.add(msg.as_bytes())
+            self.sent += 1
+            return
+
+        try:
+            try:
+                self._conn.send(msg)
+            except smtplib.SMTPServerDisconnected:
+                self._close()
+                self._connect()
+                self._conn.send(msg)
+        except smtplib.SMTPException as e:
+            logger.warning("Sending digest to %s failed: %s", msg.recipients, e)
+            self.failed += 1
+            return
+        self.sent += 1
+
+
+def render_site(site_entries):
+    """Render the new reviews of one site."""
+    return render_template(
+        "digest-site.html", site=site_entries[0].dive_site, entries=site_entries
+    )
+
+
+def recipients(site_ids, batch_size):
+    """Yield (user_id, username, email, site_ids) for confirmed users with any of site_ids
+    in their bucket list, streamed from the database batch_size rows at a time."""
+    rows = (
+        db.session.query(User.id, User.username, User.email, Bucket_list_site.dive_site_id)
+        .join(Bucket_list_site, Bucket_list_site.user_id == User.id)
+        .filter(User.confirmed.is_(True), Bucket_list_site.dive_site_id.in_(site_ids))
+        .order_by(User.id, Bucket_list_site.dive_site_id)
+        .execution_options(stream_results=True)
+        .yield_per(batch_size)
+    )
+    for _, user_rows in groupby(rows, key=lambda row: row.id):
+        user_rows = list(user_rows)
+        first = user_rows[0]
+        yield first.id, first.username, first.email, [row.dive_site_id for row in user_rows]
+
+
+def send_review_digest(hours=24, rate=None, mbox_path=None):
+    """Email each user the reviews other users added in the last `hours` to sites
+    on their bucket list. Returns the BulkMailer, whose counts say what was sent."""
+    from flask_mail import Message
+
+    config = current_app.config
+    since = datetime.utcnow() - timedelta(hours=hours)
+    entries = (
+        Journal_entry.query.options(
+            joinedload(Journal_entry.dive_site), joinedload(Journal_entry.user)
+        )
+        .filter(Journal_entry.created_at >= since)
+        .order_by(Journal_entry.dive_site_id, Journal_entry.id)
+        .all()
+    )
+    by_site = {
+        site_id: list(site_entries)
+        for site_id, site_entries in groupby(entries, key=lambda entry: entry.dive_site_id)
+    }
+    # each site is rendered once, and again only for a user who reviewed it themselves
+    fragments = {site_id: render_site(site_entries) for site_id, site_entries in by_site.items()}
+    authors = {
+        site_id: {entry.user_id for entry in site_entries}
+        for site_id, site_entries in by_site.items()
+    }
+
+    # the layout is rendered once; each user only gets their name and sites filled in
+    layout = render_template("digest.html", username="%%username%%", sites="%%sites%%")
+    subject = "New reviews of sites on your bucket list"
+
+    mailer = BulkMailer(rate or config["DIGEST_SEND_RATE"], mbox_path)
+    if not fragments:
+        return mailer
+
+    with mailer:
+        for user_id, username, email, site_ids in recipients(
+            list(fragments), config["DIGEST_BATCH_SIZE"]
+        ):
+            sites = []
+            for site_id in site_ids:
+                if user_id not in authors[site_id]:
+                    sites.append(fragments[site_id])
+                    continue
+                others = [entry for entry in by_site[site_id] if entry.user_id != user_id]
+                if others:
+                    sites.append(render_site(others))
+            if not sites:
+                continue
+            html = layout.replace("%%username%%", str(escape(username))).replace(
+                "%%sites%%", "".join(sites)
+            )
+            mailer.send(
+                Message(subject, sender=config["MAIL_USERNAME"], recipients=[email], html=html)
+            )
+    return mailer
@@ -0,0 +1,111 @@
+"""In-memory feed of the newest dive site reviews."""
+
+import time
+import threading
+
+from collections import deque
+from itertools import islice
+
+from sqlalchemy.orm import joinedload
+
+from models import Journal_entry
+
+
+def feed_item(entry):
+    """Return the public fields of a journal entry; private notes are left out."""
+    return {
+        "id": entry.id,
+        "user_id": entry.user_id,
+        "username": entry.user.username,
+        "site_id": entry.dive_site_id,
+        "site_name": entry.dive_site.name,
+        "rating": int(entry.rating),
+        "description": entry.description,
+    }
+
+
+def load_recent(size):
+    """Return feed items for the newest `size` journal entries, newest first."""
+    entries = (
+        Journal_entry.query.options(
+            joinedload(Journal_entry.user), joinedload(Journal_entry.dive_site)
+        )
+        .order_by(Journal_entry.id.desc())
+        .limit(size)
+    )
+    return [feed_item(entry) for entry in entries]
+
+
+class ReviewFeed:
+    """Ring buffer of the newest reviews, newest first.
+
+    It is loaded from the database on first use and then updated by the
+    routes that write journal entries. Each worker process has its own copy,
+    so it is also reloaded every `ttl` seconds to pick up other workers' writes.
+    """
+
+    def __init__(self, loader=load_recent, size=100, ttl=60):
+        self.loader = loader
+        self.size = size
+        self.ttl = ttl
+        self._items = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def configure(self, size=None, ttl=None):
+        """Change the limits and drop the buffer."""
+        if size is not None:
+            self.size = size
+        if ttl is not None:
+            self.ttl = ttl
+        self.reset()
+
+    def reset(self):
+        """Drop the buffer so the next read reloads it."""
+        with self._lock:
+            self._items = None
+
+    def recent(self, limit=20):
+        """Return up to limit newest items."""
+        if self._items is None or time.monotonic() - self._loaded_at > self.ttl:
+            self._load()
+        with self._lock:
+            return list(islice(self._items or (), limit))
+
+    def add(self, item):
+        """Put a new review at the front, dropping the oldest if full."""
+        with self._lock:
+            if self._items is not None:
+                self._items.appendleft(item)
+
+    def update(self, item):
+        """Replace a review in place after an edit."""
+        with self._lock:
+            if self._items is not None:
+                self._items = deque(
+                    (item if old["id"] == item["id"] else old for old in self._items),
+                    maxlen=self.size,
+                )
+
+    def remove(self, entry_id=None, user_id=None):
+        """Drop a deleted review, or every review by a deleted user."""
+        with self._lock:
+            if self._items is not None:
+                self._items = deque(
+                    (
+                        item
+                        for item in self._items
+                        if item["id"] != entry_id and item["user_id"] != user_id
+                    ),
+                    maxlen=self.size,
+                )
+
+    def _load(self):
+        """Reload the buffer with loader."""
+        items = deque(self.loader(self.size), maxlen=self.size)
+        with self._lock:
+            self._items = items
+            self._loaded_at = time.monotonic()
+
+
+review_feed = ReviewFeed()
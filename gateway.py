@@ -0,0 +1,170 @@
+"""Concurrent fan-out of divesites.com requests.
+
+Views are synchronous, so each public function here runs its own event loop
+and blocks until every request has finished. The http calls themselves run
+on a shared thread pool through the pooled upstream client.
+"""
+
+import os
+import json
+import asyncio
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import search_cache, search_params
+from upstream import upstream, UpstreamUnavailable
+
+_executor = None
+_executor_pid = None
+_executor_size = 0
+_executor_lock = threading.Lock()
+
+
+def get_executor(size):
+    """Return the process-wide thread pool of at least size threads.
+
+    It is recreated after a fork, and replaced by a bigger one when a caller
+    asks for more threads than it has; the old pool finishes its calls.
+    """
+    global _executor, _executor_pid, _executor_size
+    with _executor_lock:
+        if _executor_pid != os.getpid() or _executor_size < size:
+            if _executor is not None and _executor_pid == os.getpid():
+                _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="upstream")
+            _executor_pid = os.getpid()
+            _executor_size = size
+        return _executor
+
+
+def fan_out(func, args, limit):
+    """Call func(arg) for every arg with at most `limit` in flight.
+
+    Returns results in order; failed calls are returned as their exception.
+    """
+    if not args:
+        return []
+
+    async def run_all():
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(limit)
+        executor = get_executor(limit)
+
+        async def run(arg):
+            async with semaphore:
+                return await loop.run_in_executor(executor, func, arg)
+
+        return await asyncio.gather(*[run(arg) for arg in args], return_exceptions=True)
+
+    return asyncio.run(run_all())
+
+
+def cached_search(key, params):
+    """Return (body, status) from upstream for normalized search params.
+
+    Only successful bodies are kept in the search cache, so an upstream error
+    is passed on with its own status and retried by the next request.
+    """
+    body = search_cache.get(key)
+    if body is not None:
+        return body, 200
+
+    res = upstream.get(params)
+    if res.ok:
+        search_cache.set(key, res.content)
+    return res.content, res.status_code
+
+
+def search_many(queries, grid, limit):
+    """Run several /sites/search queries at once and return their decoded bodies.
+
+    Queries that fail are skipped; UpstreamUnavailable is raised only if all fail.
+    """
+    normalized = dict(search_params(query, grid) for query in queries)
+    results = fan_out(lambda item: cached_search(*item), list(normalized.items()), limit)
+
+    bodies = []
+    errors = []
+    for result in results:
+        if isinstance(result, Exception):
+            errors.append(result)
+            continue
+        body, status = result
+        if status >= 400:
+            errors.append(UpstreamUnavailable(f"The dive site service returned {status}."))
+            continue
+        try:
+            bodies.append(json.loads(body))
+        except ValueError as e:
+            errors.append(e)
+
+    if errors and not bodies:
+        if isinstance(errors[0], UpstreamUnavailable):
+            raise errors[0]
+        raise UpstreamUnavailable("The dive site service returned an invalid response.")
+    return bodies
+
+
+def merge_sites(site_lists):
+    """Merge site lists, keeping one entry per site id.
+
+    When a site appears more than once the entry with the smallest distance
+    wins, and the merged list is ordered nearest first if distances are known.
+    """
+    merged = {}
+    for sites in site_lists:
+        for site in sites or []:
+            current = merged.get(site["id"])
+            if current is None or float(site.get("distance") or 0) < float(
+                current.get("distance") or 0
+            ):
+                merged[site["id"]] = site
+
+    sites = list(merged.values())
+    if all("distance" in site for site in sites):
+        sites.sort(key=lambda site: float(site["distance"]))
+    return sites
+
+
+def search_points(points, dist, grid, limit):
+    """Return dive sites within `dist` miles of any of the points."""
+    queries = [
+        {"mode": "sites", "lat": point["lat"], "lng": point["lng"], "dist": dist}
+        for point in points
+    ]
+    bodies = search_many(queries, grid, limit)
+    return merge_sites(body.get("sites") for body in bodies)
+
+
+def search_terms(terms, grid, limit):
+    """Return dive sites matching any of the search terms."""
+    bodies = search_many([{"mode": "search", "str": term} for term in terms], grid, limit)
+    return merge_sites(body.get("matches") for body in bodies)
+
+
+def fetch_details(site_ids, limit, failed=None):
+    """Return upstream detail records for the site ids that could be fetched.
+
+    Ids whose request failed, as opposed to upstream having no such site, are
+    added to the `failed` set if one is given.
+    """
+    site_ids = list(dict.fromkeys(site_ids))
+    results = fan_out(
+        lambda site_id: upstream.get_json({"mode": "detail", "siteid": site_id}),
+        site_ids,
+        limit,
+    )
+
+    sites = []
+    for site_id, result in zip(site_ids, results):
+        if isinstance(result, Exception):
+            if failed is not None:
+                failed.add(site_id)
+            continue
+        if not result.get("site"):
+            continue
+        site = dict(result["site"])
+        site.setdefault("id", str(site_id))
+        sites.append(site)
+    return sites
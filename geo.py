@@ -0,0 +1,90 @@
+"""Distance and map projection helpers for dive site coordinates."""
+
+from math import radians, degrees, sin, cos, asin, sqrt, log, tan, atan, sinh, pi
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE = 69.0
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Return great-circle distance in miles between two points."""
+    lat1, lng1, lat2, lng2 = map(radians, (lat1, lng1, lat2, lng2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * asin(sqrt(a))
+
+
+def bounding_box(lat, lng, miles):
+    """Return (min_lat, max_lat, min_lng, max_lng) enclosing a radius around a point."""
+    dlat = miles / MILES_PER_DEGREE
+    min_lat = max(lat - dlat, -90.0)
+    max_lat = min(lat + dlat, 90.0)
+
+    # longitude degrees shrink towards the poles
+    widest = max(abs(min_lat), abs(max_lat))
+    if widest >= 89.9:
+        return min_lat, max_lat, -180.0, 180.0
+
+    dlng = miles / (MILES_PER_DEGREE * cos(radians(widest)))
+    if dlng >= 180:
+        return min_lat, max_lat, -180.0, 180.0
+
+    return min_lat, max_lat, lng - dlng, lng + dlng
+
+
+def lng_ranges(min_lng, max_lng):
+    """Split a longitude range that crosses the antimeridian into plain ranges."""
+    if min_lng < -180:
+        return [(min_lng + 360, 180.0), (-180.0, max_lng)]
+    if max_lng > 180:
+        return [(min_lng, 180.0), (-180.0, max_lng - 360)]
+    return [(min_lng, max_lng)]
+
+
+# dive_sites.cell buckets coordinates into a fixed grid so radius queries can
+# use a plain b-tree index on every database
+CELL_DEGREES = 0.5
+CELL_ROWS = int(180 / CELL_DEGREES)
+CELL_COLS = int(360 / CELL_DEGREES)
+MAX_QUERY_CELLS = 400
+
+
+def grid_cell(lat, lng):
+    """Return the grid cell number containing a point."""
+    row = min(int((lat + 90) // CELL_DEGREES), CELL_ROWS - 1)
+    col = int(((lng + 180) % 360) // CELL_DEGREES)
+    return row * CELL_COLS + col
+
+
+def cells_in_box(min_lat, max_lat, min_lng, max_lng):
+    """Return every cell overlapping a bounding box, or None if there are too many to list."""
+    first_row = grid_cell(min_lat, 0) // CELL_COLS
+    last_row = grid_cell(max_lat, 0) // CELL_COLS
+
+    cols = []
+    for lo, hi in lng_ranges(min_lng, max_lng):
+        first_col = grid_cell(0, lo) % CELL_COLS
+        last_col = CELL_COLS - 1 if hi >= 180 else grid_cell(0, hi) % CELL_COLS
+        cols.extend(range(first_col, last_col + 1))
+
+    if (last_row - first_row + 1) * len(cols) > MAX_QUERY_CELLS:
+        return None
+    return [
+        row * CELL_COLS + col for row in range(first_row, last_row + 1) for col in cols
+    ]
+
+
+# web mercator stops short of the poles
+MAX_LAT = 85.05112878
+
+
+def project(lat, lng):
+    """Return web mercator (x, y) for a point, both from 0 to 1."""
+    lat = min(max(lat, -MAX_LAT), MAX_LAT)
+    x = (lng + 180.0) / 360.0
+    y = 0.5 - log(tan(pi / 4 + radians(lat) / 2)) / (2 * pi)
+    return min(max(x, 0.0), 1.0), min(max(y, 0.0), 1.0)
+
+
+def unproject(x, y):
+    """Return (lat, lng) for web mercator (x, y)."""
+    return degrees(atan(sinh(pi * (1 - 2 * y)))), x * 360.0 - 180.0
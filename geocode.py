@@ -0,0 +1,46 @@
+"""Reverse geocoding of dive site coordinates to "city, country" strings."""
+
+from cache import TTLCache
+
+PRECISION = 2
+memo = TTLCache(ttl=30 * 24 * 60 * 60, max_entries=100000)
+
+
+def preload():
+    """Load the city dataset and build its KD-tree now.
+
+    Call this in the master process before gunicorn forks (--preload) so
+    every worker shares one copy of the tree instead of building its own on
+    first use.
+    """
+    import reverse_geocode
+
+    reverse_geocode.search([(0.0, 0.0)])
+
+
+def locate(points):
+    """Return a "city, country" string for each (lat, lng) point.
+
+    Points are rounded to PRECISION decimals (about 1 km) and looked up in the
+    memo first; the remaining unique points go to the KD-tree in one query.
+    """
+    keys = [(round(float(lat), PRECISION), round(float(lng), PRECISION)) for lat, lng in points]
+    found = {}
+    missing = []
+    for key in dict.fromkeys(keys):
+        location = memo.get(key)
+        if location is None:
+            missing.append(key)
+        else:
+            found[key] = location
+
+    if missing:
+        # imported here: reverse_geocode pulls in numpy and scipy
+        import reverse_geocode
+
+        for key, loc in zip(missing, reverse_geocode.search(missing)):
+            location = f"{loc['city']}, {loc['country']}"
+            memo.set(key, location)
+            found[key] = location
+
+    return [found[key] for key in keys]
@@ -0,0 +1,90 @@
+"""Password hashing on a bounded thread pool."""
+
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from flask_bcrypt import Bcrypt
+
+bcrypt = Bcrypt()
+
+
+class HashPool:
+    """Runs bcrypt on a small dedicated pool.
+
+    bcrypt releases the GIL while hashing, so the pool caps how many cores
+    login bursts can take, and at most `max_pending` requests can be waiting
+    for it at once; further callers block until a slot frees up.
+    """
+
+    def __init__(self):
+        self.workers = 2
+        self.max_pending = 32
+        self.rounds = 12
+        self.pending = 0
+        self.peak = 0
+        self._executor = None
+        self._pid = None
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Read settings from app config."""
+        bcrypt.init_app(app)
+        self.workers = app.config["BCRYPT_WORKERS"]
+        self.max_pending = app.config["BCRYPT_MAX_PENDING"]
+        self.rounds = app.config["BCRYPT_LOG_ROUNDS"]
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = None
+
+    @property
+    def executor(self):
+        """Thread pool, created per process so forked workers get their own threads.
+
+        Created under the lock, so concurrent first logins share one pool.
+        """
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="bcrypt"
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def run(self, func, *args):
+        """Run func on the pool and wait for its result."""
+        with self._slots:
+            with self._lock:
+                self.pending += 1
+                self.peak = max(self.peak, self.pending)
+            try:
+                return self.executor.submit(func, *args).result()
+            finally:
+                with self._lock:
+                    self.pending -= 1
+
+    def hash_password(self, password):
+        """Return a bcrypt hash of password at the configured cost."""
+        return self.run(bcrypt.generate_password_hash, password).decode("UTF-8")
+
+    def check_password(self, hashed, password):
+        """Return True if password matches hashed."""
+        return self.run(bcrypt.check_password_hash, hashed, password)
+
+    def needs_rehash(self, hashed):
+        """Return True if hashed was made with a different cost than configured."""
+        try:
+            return int(hashed.split("$")[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def stats(self):
+        """Return queue depth counters for monitoring."""
+        return {
+            "queue_depth": self.pending,
+            "peak_queue_depth": self.peak,
+            "workers": self.workers,
+        }
+
+
+hash_pool = HashPool()
@@ -0,0 +1,84 @@
+"""Per-process cache of the logged in user's identity."""
+
+import time
+
+from flask import session
+
+from cache import TTLCache
+from models import User
+
+identity_cache = TTLCache()
+
+
+class UserGone(Exception):
+    """The logged in user was deleted after their identity was cached."""
+
+
+class CurrentUser:
+    """Stand-in for the logged in User that is filled from the identity cache.
+
+    id, username, email and confirmed are read without a query. Any other
+    attribute (relationships, password, ...) loads the full ORM User once.
+    """
+
+    def __init__(self, id, username, email, confirmed, model=None):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.confirmed = confirmed
+        self._model = model
+
+    @property
+    def model(self):
+        """Return the ORM User, loading it on first use.
+
+        If another worker deleted the user meanwhile, the snapshot and the
+        session login are dropped and UserGone is raised.
+        """
+        if self._model is None:
+            self._model = User.query.get(self.id)
+            if self._model is None:
+                log_out(self.id)
+                raise UserGone(self.id)
+        return self._model
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def __repr__(self):
+        return f"<CurrentUser #{self.id}: {self.username}>"
+
+
+def load_current_user(user_id):
+    """Return a CurrentUser for user_id, or None if the user no longer exists.
+
+    A cached snapshot is only used if it was loaded after this session last
+    changed the user, so the session that made a change never sees stale
+    data in any worker. Other sessions see changes once the ttl expires.
+    """
+    snapshot = identity_cache.get(user_id)
+    if snapshot is not None and snapshot[-1] >= session.get("user_changed_at", 0):
+        return CurrentUser(*snapshot[:-1])
+
+    user = User.query.get(user_id)
+    if user is None:
+        log_out(user_id)
+        return None
+
+    snapshot = (user.id, user.username, user.email, user.confirmed, time.time())
+    identity_cache.set(user_id, snapshot)
+    return CurrentUser(*snapshot[:-1], model=user)
+
+
+def log_out(user_id):
+    """Drop a deleted user's snapshot and end the session's login."""
+    identity_cache.delete(user_id)
+    if session.get("user_id") == user_id:
+        session.pop("user_id")
+
+
+def forget_user(user_id):
+    """Drop the cached identity after the user row changes."""
+    identity_cache.delete(user_id)
+    if session.get("user_id") == user_id:
+        session["user_changed_at"] = time.time()
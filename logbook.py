@@ -0,0 +1,452 @@
+"""Dive logbook import and export as CSV, GeoJSON and UDDF."""
+
+import io
+import re
+import csv
+import json
+
+from datetime import datetime
+from xml.etree.ElementTree import iterparse
+from xml.sax.saxutils import escape, quoteattr
+
+from flask import current_app
+from sqlalchemy import func
+
+from models import db, Dive_site, Journal_entry, Bucket_list_site
+from catalog import fetch_sites, stored_ids
+
+CSV_COLUMNS = ["site_id", "rating", "description", "notes"]
+# the site ids uddf_site writes; other logbooks number their sites their own way
+EXPORT_SITE_ID = re.compile(r"site-(\d+)$")
+
+
+class RowError(ValueError):
+    """A logbook row that can't be imported."""
+
+
+def local_name(tag):
+    """Strip the namespace from an XML tag."""
+    return tag.rsplit("}", 1)[-1]
+
+
+def read_csv(stream):
+    """Yield (line, row) for each row of a CSV logbook with CSV_COLUMNS headers."""
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+    for row in reader:
+        yield reader.line_num, row
+
+
+def uddf_coordinate(elem, name):
+    """Return the number in the first `name` element under a UDDF site, or None."""
+    for child in elem.iter():
+        if local_name(child.tag) == name:
+            try:
+                return float(child.text)
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+def read_uddf(stream):
+    """Yield (dive number, row) for each dive in a UDDF logbook.
+
+    A site with an id this app's export writes ("site-<divesites.com id>")
+    gives the row its site_id. Any other site gives the row a "site" of
+    (id, name, lat, lng) instead, for LogbookImport to match against the
+    stored sites. UDDF ratings go from 1 to 10 and are halved. Paragraphs
+    under <observations> are the description, the public review; all others
+    are the private notes. Sites and dives are removed from the tree once
+    read so memory stays flat however long the logbook is.
+    """
+    sites = {}
+    dives = 0
+    # the open elements, so each site and dive can be detached from its parent
+    parents = []
+    for event, elem in iterparse(stream, events=("start", "end")):
+        if event == "start":
+            parents.append(elem)
+            continue
+        parents.pop()
+        tag = local_name(elem.tag)
+        if tag == "site":
+            site_id = elem.get("id", "")
+            match = EXPORT_SITE_ID.match(site_id)
+            if match:
+                sites[site_id] = {"site_id": match.group(1)}
+            else:
+                name = next(
+                    (child.text for child in elem if local_name(child.tag) == "name"), None
+                )
+                sites[site_id] = {
+                    "site": (
+                        site_id,
+                        (name or "").strip() or None,
+                        uddf_coordinate(elem, "latitude"),
+                        uddf_coordinate(elem, "longitude"),
+                    )
+                }
+        elif tag == "dive":
+            dives += 1
+            row = {"site_id": None, "rating": None, "description": None, "notes": None}
+            paras = {"description": [], "notes": []}
+            observed = set()
+            for child in elem.iter():
+                name = local_name(child.tag)
+                if name == "link" and child.get("ref") in sites:
+                    row.update(sites[child.get("ref")])
+                elif name == "ratingvalue" and (child.text or "").strip().isdigit():
+                    row["rating"] = str((int(child.text) + 1) // 2)
+                elif name == "observations":
+                    # iter() reaches an element before its descendants
+                    observed.update(child.iter())
+                elif name == "para" and child.text:
+                    field = "description" if child in observed else "notes"
+                    paras[field].append(child.text.strip())
+            for field, texts in paras.items():
+                row[field] = "\n".join(texts) or None
+        else:
+            continue
+
+        # clearing alone would leave an empty element behind in the tree for each one
+        elem.clear()
+        if parents:
+            parents[-1].remove(elem)
+        if tag == "dive":
+            yield dives, row
+
+
+READERS = {"csv": read_csv, "uddf": read_uddf}
+
+
+def logbook_format(filename):
+    """Return the reader name for a logbook file name, or None if unsupported."""
+    extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    return {"csv": "csv", "uddf": "uddf", "xml": "uddf"}.get(extension)
+
+
+def parse_row(row):
+    """Return (site_id, rating, description, notes) from a logbook row."""
+    try:
+        site_id = int(row.get("site_id") or "")
+    except ValueError:
+        raise RowError("missing or invalid site_id")
+    try:
+        rating = int(row.get("rating") or "")
+    except ValueError:
+        raise RowError("missing or invalid rating")
+    if not 1 <= rating <= 5:
+        raise RowError("rating must be from 1 to 5")
+    return site_id, rating, row.get("description") or None, row.get("notes") or None
+
+
+def match_site(site_id, name, lat, lng, miles):
+    """Return the id of the stored dive site a site from another logbook describes.
+
+    The nearest stored site within `miles` of its position wins, else the one
+    stored site with exactly its name. Raises RowError if neither matches.
+    """
+    if lat is not None and lng is not None:
+        found = Dive_site.within(lat, lng, miles)
+        if found:
+            return found[0][0].id
+    if name:
+        matches = [
+            match_id
+            for (match_id,) in db.session.query(Dive_site.id)
+            .filter(func.lower(Dive_site.name) == name.lower())
+            .limit(2)
+        ]
+        if len(matches) == 1:
+            return matches[0]
+    raise RowError(f"no stored dive site matches site {site_id}")
+
+
+class LogbookImport:
+    """Imports a logbook into a user's dive journal in batches.
+
+    Each batch resolves its site ids with one IN query, fetches sites only
+    known upstream concurrently, bulk inserts the new entries and commits.
+    A site already in the journal (or earlier in the file) is skipped, since
+    the journal holds one entry per site.
+    """
+
+    def __init__(self, user_id, batch_size=None):
+        self.user_id = user_id
+        self.batch_size = batch_size or current_app.config["IMPORT_BATCH_SIZE"]
+        self.imported = 0
+        self.skipped = 0
+        self.failed = 0
+        self._read_error = None
+        # sites from other logbooks, matched once however many dives use them
+        self._matched = {}
+
+    def run(self, stream, fmt):
+        """Import the logbook, yielding a progress dict after each batch.
+
+        Each dict has the running totals and the errors found in that batch
+        as {"line": n, "error": message} items. A file that stops parsing
+        part way keeps the rows read before the problem.
+        """
+        batch = []
+        for line, row in self._read(stream, fmt):
+            batch.append((line, row))
+            if len(batch) >= self.batch_size:
+                yield self._import(batch, line)
+                batch = []
+
+        progress = self._import(batch, None)
+        if self._read_error:
+            self.failed += 1
+            progress["errors"].append({"line": None, "error": self._read_error})
+        yield progress
+
+    def totals(self):
+        """Return the running totals."""
+        return {"imported": self.imported, "skipped": self.skipped, "failed": self.failed}
+
+    def _read(self, stream, fmt):
+        """Yield rows from the reader, stopping at the first parse error."""
+        try:
+            yield from READERS[fmt](stream)
+        except (csv.Error, SyntaxError, UnicodeDecodeError) as e:
+            self._read_error = f"could not read logbook: {e}"
+
+    def _in_journal(self, site_ids):
+        """Return the subset of site_ids already in the user's journal."""
+        if not site_ids:
+            return set()
+        return {
+            site_id
+            for (site_id,) in db.session.query(Journal_entry.dive_site_id).filter(
+                Journal_entry.user_id == self.user_id,
+                Journal_entry.dive_site_id.in_(list(site_ids)),
+            )
+        }
+
+    def _match(self, site):
+        """Return match_site for a site from another logbook, remembering the answer."""
+        if site not in self._matched:
+            try:
+                self._matched[site] = match_site(
+                    *site, current_app.config["IMPORT_MATCH_MILES"]
+                )
+            except RowError as e:
+                self._matched[site] = e
+        if isinstance(self._matched[site], RowError):
+            raise self._matched[site]
+        return self._matched[site]
+
+    def _import(self, batch, line):
+        """Import one batch of (line, row) pairs and return its progress dict."""
+        errors = []
+        rows = []
+        for row_line, row in batch:
+            try:
+                if not row.get("site_id") and row.get("site"):
+                    row = dict(row, site_id=self._match(row["site"]))
+                rows.append((row_line,) + parse_row(row))
+            except RowError as e:
+                errors.append({"line": row_line, "error": str(e)})
+
+        site_ids = {row[1] for row in rows}
+        fetch_sites(site_ids, current_app.config["UPSTREAM_CONCURRENCY"])
+        known = stored_ids(site_ids)
+        in_journal = self._in_journal(site_ids)
+
+        now = datetime.utcnow()
+        seen = set()
+        mappings = []
+        for row_line, site_id, rating, description, notes in rows:
+            if site_id not in known:
+                errors.append({"line": row_line, "error": f"unknown dive site {site_id}"})
+            elif site_id in in_journal or site_id in seen:
+                self.skipped += 1
+            else:
+                seen.add(site_id)
+                mappings.append(
+                    {
+                        "user_id": self.user_id,
+                        "dive_site_id": site_id,
+                        "rating": rating,
+                        "description": description,
+                        "notes": notes,
+                        "created_at": now,
+                    }
+                )
+
+        if mappings:
+            db.session.bulk_insert_mappings(Journal_entry, mappings)
+            Dive_site.recompute_ratings({row["dive_site_id"] for row in mappings})
+            db.session.commit()
+        self.imported += len(mappings)
+        self.failed += len(errors)
+        return dict(self.totals(), line=line, errors=errors)
+
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "geojson": "application/geo+json",
+    "uddf": "application/xml",
+}
+UDDF_NAMESPACE = "http://www.streit.cc/uddf/3.2/"
+
+
+def stream(query):
+    """Iterate a query over a server-side cursor, EXPORT_BATCH_SIZE rows at a time."""
+    return query.execution_options(stream_results=True).yield_per(
+        current_app.config["EXPORT_BATCH_SIZE"]
+    )
+
+
+def journal_rows(user_id):
+    """Return a query for a user's journal entries joined with their dive sites."""
+    return (
+        db.session.query(
+            Journal_entry.id,
+            Journal_entry.dive_site_id.label("site_id"),
+            Journal_entry.rating,
+            Journal_entry.description,
+            Journal_entry.notes,
+            Journal_entry.created_at,
+            Dive_site.name,
+            Dive_site.location,
+            Dive_site.lat,
+            Dive_site.lng,
+        )
+        .join(Dive_site, Dive_site.id == Journal_entry.dive_site_id)
+        .filter(Journal_entry.user_id == user_id)
+        .order_by(Journal_entry.id)
+    )
+
+
+def bucket_list_rows(user_id):
+    """Return a query for the dive sites in a user's bucket list."""
+    return (
+        db.session.query(
+            Dive_site.id.label("site_id"),
+            Dive_site.name,
+            Dive_site.location,
+            Dive_site.lat,
+            Dive_site.lng,
+            Dive_site.description,
+        )
+        .join(Bucket_list_site, Bucket_list_site.dive_site_id == Dive_site.id)
+        .filter(Bucket_list_site.user_id == user_id)
+        .order_by(Dive_site.id)
+    )
+
+
+def export_csv(query, columns):
+    """Yield a CSV file of the given columns of each row, one line at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in stream(query):
+        writer.writerow([getattr(row, column) for column in columns])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_geojson(query, properties):
+    """Yield a GeoJSON FeatureCollection with a point feature per row."""
+    yield '{"type": "FeatureCollection", "features": ['
+    separator = ""
+    for row in stream(query):
+        feature = {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [row.lng, row.lat]},
+            "properties": {name: json_value(getattr(row, name)) for name in properties},
+        }
+        yield separator + json.dumps(feature)
+        separator = ","
+    yield "]}"
+
+
+def json_value(value):
+    """Return value in a form json.dumps accepts."""
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def uddf_site(row):
+    """Return the UDDF <site> element for a row with site fields."""
+    return (
+        f'<site id="site-{row.site_id}"><name>{escape(row.name)}</name>'
+        f"<geography><location>{escape(row.location or '')}</location>"
+        f"<latitude>{row.lat}</latitude><longitude>{row.lng}</longitude></geography></site>"
+    )
+
+
+def uddf_notes(text):
+    """Return a UDDF notes element holding text, or "" if there is none."""
+    return f"<notes><para>{escape(text)}</para></notes>" if text else ""
+
+
+def export_uddf(user_id, dives=True):
+    """Yield a UDDF logbook of a user's journal, or with dives=False just their
+    bucket list sites.
+
+    Sites must come before dives in UDDF, so the journal takes two streamed
+    passes: one over its distinct sites, then one over its entries.
+    """
+    yield '<?xml version="1.0" encoding="utf-8"?>\n'
+    yield f'<uddf xmlns="{UDDF_NAMESPACE}" version="3.2.0">'
+    yield '<generator><name>Dive Atlas</name></generator>'
+    yield "<divesite>"
+    if dives:
+        sites = (
+            db.session.query(
+                Dive_site.id.label("site_id"),
+                Dive_site.name,
+                Dive_site.location,
+                Dive_site.lat,
+                Dive_site.lng,
+            )
+            .join(Journal_entry, Journal_entry.dive_site_id == Dive_site.id)
+            .filter(Journal_entry.user_id == user_id)
+            .order_by(Dive_site.id)
+        )
+    else:
+        sites = bucket_list_rows(user_id)
+    for row in stream(sites):
+        yield uddf_site(row)
+    yield "</divesite>"
+
+    if dives:
+        yield "<profiledata><repetitiongroup>"
+        for row in stream(journal_rows(user_id)):
+            # the public description goes under observations, apart from the private notes
+            observations = uddf_notes(row.description)
+            if observations:
+                observations = f"<observations>{observations}</observations>"
+            rating = f"<rating><ratingvalue>{row.rating * 2}</ratingvalue></rating>"
+            yield (
+                f"<dive id={quoteattr(f'dive-{row.id}')}>"
+                f'<informationbeforedive><link ref="site-{row.site_id}"/></informationbeforedive>'
+                f"<informationafterdive>{rating}{observations}{uddf_notes(row.notes)}"
+                "</informationafterdive></dive>"
+            )
+        yield "</repetitiongroup></profiledata>"
+    yield "</uddf>\n"
+
+
+def export_journal(user_id, fmt):
+    """Yield a user's dive journal as fmt, a key of EXPORT_FORMATS."""
+    if fmt == "csv":
+        columns = CSV_COLUMNS + ["name", "location", "lat", "lng", "created_at"]
+        return export_csv(journal_rows(user_id), columns)
+    if fmt == "geojson":
+        properties = ["site_id", "name", "location", "rating", "description", "notes", "created_at"]
+        return export_geojson(journal_rows(user_id), properties)
+    return export_uddf(user_id)
+
+
+def export_bucket_list(user_id, fmt):
+    """Yield a user's bucket list as fmt, a key of EXPORT_FORMATS."""
+    columns = ["site_id", "name", "location", "lat", "lng", "description"]
+    if fmt == "csv":
+        return export_csv(bucket_list_rows(user_id), columns)
+    if fmt == "geojson":
+        return export_geojson(bucket_list_rows(user_id), columns[:3] + columns[5:])
+    return export_uddf(user_id, dives=False)
@@ -1,6 +1,27 @@
+import os
+
 from app import create_app
+from geocode import preload
+from models import db
+from suggest import suggest_index
 
 app = create_app('production')
 
+# cli commands like `flask db upgrade` import this module too, but serve nothing
+serving = not os.environ.get('FLASK_RUN_FROM_CLI')
+
+# build the geocoder once in the master so preloaded gunicorn workers share it
+if app.config.get('GEOCODER_PRELOAD') and serving:
+    preload()
+
+# likewise the autocomplete index (which also needs dive_sites, so it can't be
+# built before `flask db upgrade` anyway); the master's connections are closed
+# so no forked worker inherits them
+if app.config.get('SUGGEST_PRELOAD') and serving:
+    with app.app_context():
+        suggest_index.preload()
+        db.session.remove()
+        db.engine.dispose()
+
 if __name__ == '__main__':
     app.run()
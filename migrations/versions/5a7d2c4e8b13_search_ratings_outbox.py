@@ -0,0 +1,172 @@
+"""site search index, rating aggregates, email outbox and keyset indexes
+
+Revision ID: 5a7d2c4e8b13
+Revises: 1f0c3b7a9e21
+Create Date: 2026-10-18 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a7d2c4e8b13'
+down_revision = '1f0c3b7a9e21'
+branch_labels = None
+depends_on = None
+
+PG_SEARCH_DOCUMENT = (
+    "(setweight(to_tsvector('simple', coalesce(name, '')), 'A')"
+    " || setweight(to_tsvector('simple', coalesce(location, '')), 'B')"
+    " || setweight(to_tsvector('simple', coalesce(description, '')), 'C'))"
+)
+
+SQLITE_SEARCH = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS dive_sites_fts USING fts5(
+        name, location, description, content='dive_sites', content_rowid='id')""",
+    """CREATE TRIGGER IF NOT EXISTS dive_sites_fts_insert AFTER INSERT ON dive_sites BEGIN
+        INSERT INTO dive_sites_fts(rowid, name, location, description)
+        VALUES (new.id, new.name, new.location, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS dive_sites_fts_delete AFTER DELETE ON dive_sites BEGIN
+        INSERT INTO dive_sites_fts(dive_sites_fts, rowid, name, location, description)
+        VALUES ('delete', old.id, old.name, old.location, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS dive_sites_fts_update AFTER UPDATE ON dive_sites BEGIN
+        INSERT INTO dive_sites_fts(dive_sites_fts, rowid, name, location, description)
+        VALUES ('delete', old.id, old.name, old.location, old.description);
+        INSERT INTO dive_sites_fts(rowid, name, location, description)
+        VALUES (new.id, new.name, new.location, new.description);
+    END""",
+    "INSERT INTO dive_sites_fts(dive_sites_fts) VALUES ('rebuild')",
+]
+
+# the grid of geo.grid_cell as it was at this revision: half degree cells,
+# numbered row by row from the south pole and the antimeridian
+CELL_DEGREES = 0.5
+CELL_ROWS = 360
+CELL_COLS = 720
+
+RATING_COLUMNS = ['review_count', 'rating_sum'] + [f'rating_{n}' for n in range(1, 6)]
+
+# indexes on tables that already hold data; built concurrently on postgres
+INDEXES = [
+    ('ix_dive_sites_cell', 'dive_sites', ['cell']),
+    ('ix_journal_entries_created_at', 'journal_entries', ['created_at']),
+    ('ix_journal_entries_user_id_id', 'journal_entries', ['user_id', 'id']),
+    ('ix_journal_entries_dive_site_id_id', 'journal_entries', ['dive_site_id', 'id']),
+]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    op.add_column('dive_sites', sa.Column('cell', sa.Integer(), nullable=True))
+    for column in RATING_COLUMNS:
+        op.add_column(
+            'dive_sites', sa.Column(column, sa.Integer(), nullable=False, server_default='0')
+        )
+    op.add_column('journal_entries', sa.Column('created_at', sa.DateTime(), nullable=True))
+
+    op.create_table(
+        'outbox_emails',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('recipient', sa.Text(), nullable=False),
+        sa.Column('subject', sa.Text(), nullable=False),
+        sa.Column('html', sa.Text(), nullable=False),
+        sa.Column('dedupe_key', sa.Text(), nullable=True),
+        sa.Column('status', sa.Text(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_outbox_emails_dedupe_key', 'outbox_emails', ['dedupe_key'])
+    op.create_index('ix_outbox_emails_due', 'outbox_emails', ['status', 'next_attempt_at'])
+
+    backfill_cells()
+    backfill_ratings()
+
+    if dialect == 'sqlite':
+        for statement in SQLITE_SEARCH:
+            op.execute(statement)
+
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True)
+        if dialect == 'postgresql':
+            op.execute(
+                'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_dive_sites_search'
+                f' ON dive_sites USING gin ({PG_SEARCH_DOCUMENT})'
+            )
+
+
+def backfill_cells(batch_size=5000):
+    """Set the grid cell of every existing dive site."""
+    bind = op.get_bind()
+    sites = sa.table('dive_sites', sa.column('id'), sa.column('lat'), sa.column('lng'), sa.column('cell'))
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select([sites.c.id, sites.c.lat, sites.c.lng])
+            .where(sites.c.id > last_id)
+            .order_by(sites.c.id)
+            .limit(batch_size)
+        ).fetchall()
+        if not rows:
+            return
+        bind.execute(
+            sites.update().where(sites.c.id == sa.bindparam('site_id')),
+            [{'site_id': id, 'cell': grid_cell(lat, lng)} for id, lat, lng in rows],
+        )
+        last_id = rows[-1][0]
+
+
+def grid_cell(lat, lng):
+    """Return the grid cell number containing a point."""
+    row = min(int((lat + 90) // CELL_DEGREES), CELL_ROWS - 1)
+    col = int(((lng + 180) % 360) // CELL_DEGREES)
+    return row * CELL_COLS + col
+
+
+def backfill_ratings():
+    """Compute the rating aggregates of every dive site from its journal entries."""
+    sites = sa.table('dive_sites', *[sa.column(name) for name in ['id'] + RATING_COLUMNS])
+    entries = sa.table('journal_entries', sa.column('dive_site_id'), sa.column('rating'))
+
+    def stat(expression, *conditions):
+        return (
+            sa.select([expression])
+            .where(sa.and_(entries.c.dive_site_id == sites.c.id, *conditions))
+            .as_scalar()
+        )
+
+    values = {
+        'review_count': stat(sa.func.count()),
+        'rating_sum': stat(sa.func.coalesce(sa.func.sum(entries.c.rating), 0)),
+    }
+    for rating in range(1, 6):
+        values[f'rating_{rating}'] = stat(sa.func.count(), entries.c.rating == rating)
+    op.execute(sites.update().values(**values))
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_dive_sites_search')
+    if dialect == 'sqlite':
+        for name in ['insert', 'delete', 'update']:
+            op.execute(f'DROP TRIGGER IF EXISTS dive_sites_fts_{name}')
+        op.execute('DROP TABLE IF EXISTS dive_sites_fts')
+
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
+    op.drop_table('outbox_emails')
+
+    with op.batch_alter_table('journal_entries') as batch:
+        batch.drop_column('created_at')
+    with op.batch_alter_table('dive_sites') as batch:
+        for column in ['cell'] + RATING_COLUMNS:
+            batch.drop_column(column)
@@ -0,0 +1,66 @@
+"""unique (user_id, dive_site_id) on bucket list and journal
+
+Revision ID: 9e4b6f1d2a35
+Revises: 5a7d2c4e8b13
+Create Date: 2026-10-18 09:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4b6f1d2a35'
+down_revision = '5a7d2c4e8b13'
+branch_labels = None
+depends_on = None
+
+TABLES = ['bucket_list_sites', 'journal_entries']
+
+
+def upgrade():
+    # keep the oldest row of any duplicate pair so the unique indexes can be built
+    for table in TABLES:
+        op.execute(
+            f'DELETE FROM {table} WHERE id NOT IN'
+            f' (SELECT min(id) FROM {table} GROUP BY user_id, dive_site_id)'
+        )
+    recount_ratings()
+
+    # CONCURRENTLY builds without locking out writes; rows that sneak in a
+    # duplicate meanwhile make the build fail and it can simply be rerun
+    with op.get_context().autocommit_block():
+        for table in TABLES:
+            name = f'ix_{table}_user_id_dive_site_id'
+            if op.get_bind().dialect.name == 'postgresql':
+                op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+            op.create_index(
+                name, table, ['user_id', 'dive_site_id'], unique=True, postgresql_concurrently=True
+            )
+
+
+def recount_ratings():
+    """Recompute site rating aggregates after dropping duplicate journal entries."""
+    columns = ['review_count', 'rating_sum'] + [f'rating_{n}' for n in range(1, 6)]
+    sites = sa.table('dive_sites', *[sa.column(name) for name in ['id'] + columns])
+    entries = sa.table('journal_entries', sa.column('dive_site_id'), sa.column('rating'))
+
+    def stat(expression, *conditions):
+        return (
+            sa.select([expression])
+            .where(sa.and_(entries.c.dive_site_id == sites.c.id, *conditions))
+            .as_scalar()
+        )
+
+    values = {
+        'review_count': stat(sa.func.count()),
+        'rating_sum': stat(sa.func.coalesce(sa.func.sum(entries.c.rating), 0)),
+    }
+    for rating in range(1, 6):
+        values[f'rating_{rating}'] = stat(sa.func.count(), entries.c.rating == rating)
+    op.execute(sites.update().values(**values))
+
+
+def downgrade():
+    for table in TABLES:
+        op.drop_index(f'ix_{table}_user_id_dive_site_id', table_name=table)
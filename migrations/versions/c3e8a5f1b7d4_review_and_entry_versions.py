@@ -0,0 +1,35 @@
+"""version counters for conditional GET on site and journal pages
+
+Revision ID: c3e8a5f1b7d4
+Revises: 9e4b6f1d2a35
+Create Date: 2026-10-18 14:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e8a5f1b7d4'
+down_revision = '9e4b6f1d2a35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # a constant server default fills existing rows without rewriting them on postgres 11+
+    op.add_column(
+        'dive_sites',
+        sa.Column('reviews_version', sa.Integer(), nullable=False, server_default='0'),
+    )
+    op.add_column(
+        'journal_entries',
+        sa.Column('version', sa.Integer(), nullable=False, server_default='1'),
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('journal_entries') as batch:
+        batch.drop_column('version')
+    with op.batch_alter_table('dive_sites') as batch:
+        batch.drop_column('reviews_version')
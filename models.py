@@ -1,16 +1,22 @@
 """SQLAlchemy models."""
 
-from flask_bcrypt import Bcrypt
+import re
+
+from datetime import datetime
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import or_, and_, func, select, event, DDL
+from sqlalchemy.orm import joinedload, validates
+
+from hashing import bcrypt, hash_pool
+from geo import haversine, bounding_box, lng_ranges, grid_cell, cells_in_box
 
-bcrypt = Bcrypt()
 db = SQLAlchemy()
 
 def connect_db(app):
-    """Connect to the database and create all tables."""
+    """Connect to the database. The schema is managed with `flask db upgrade`."""
     db.app = app
     db.init_app(app)
-    db.create_all()
 
 class User(db.Model):
     """User info."""
@@ -38,7 +44,7 @@ class User(db.Model):
     @classmethod
     def signup(cls, username, email, password):
         """Sign up user and hash password."""
-        hashed_pwd = bcrypt.generate_password_hash(password).decode("UTF-8")
+        hashed_pwd = hash_pool.hash_password(password)
 
         user = User(username=username, email=email, password=hashed_pwd)
 
@@ -47,18 +53,31 @@ class User(db.Model):
 
     @classmethod
     def authenticate(cls, username, password):
-        """Find user with `username` and `password`. Returns user object if valid, false if not valid."""
+        """Find user with `username` and `password`. Returns user object if valid, false if not valid.
+
+        A hash made at an old cost is replaced on success; the caller commits it.
+        """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hash_pool.check_password(user.password, password)
             if is_auth:
+                if hash_pool.needs_rehash(user.password):
+                    user.password = hash_pool.hash_password(password)
                 return user
 
         return False
 
 
+def site_cell(context):
+    """Column default: grid cell for the row's lat/lng."""
+    params = context.get_current_parameters()
+    if params.get("lat") is None or params.get("lng") is None:
+        return None
+    return grid_cell(params["lat"], params["lng"])
+
+
 class Dive_site(db.Model):
     """Dive site."""
 
@@ -70,8 +89,218 @@ class Dive_site(db.Model):
     lng = db.Column(db.Float, nullable=False)
     description = db.Column(db.Text)
     location = db.Column(db.Text, nullable=False)
+    cell = db.Column(db.Integer, default=site_cell, index=True)
+
+    # rating aggregates, kept in step with journal_entries by add_rating
+    review_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_1 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_2 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_3 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_4 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_5 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # bumped whenever a review of the site changes, so its pages can be revalidated cheaply
+    reviews_version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    journal_entries = db.relationship("Journal_entry", order_by="Journal_entry.id")
+
+    @validates("lat", "lng")
+    def update_cell(self, key, value):
+        """Keep cell in step when lat or lng is set on a loaded or new site."""
+        lat = value if key == "lat" else self.lat
+        lng = value if key == "lng" else self.lng
+        if lat is not None and lng is not None:
+            self.cell = grid_cell(float(lat), float(lng))
+        return value
+
+    @property
+    def average_rating(self):
+        """Mean rating, or None if the site has no reviews."""
+        if not self.review_count:
+            return None
+        return self.rating_sum / self.review_count
+
+    @property
+    def rating_histogram(self):
+        """Number of reviews with each rating from 1 to 5."""
+        return [self.rating_1, self.rating_2, self.rating_3, self.rating_4, self.rating_5]
+
+    @classmethod
+    def add_rating(cls, site_id, rating, count=1):
+        """Count a review with `rating` in the site's aggregates (count=-1 removes one).
+
+        The update is done in SQL in the caller's transaction, so concurrent
+        reviews of the same site never overwrite each other's counts.
+        """
+        rating = int(rating)
+        values = {
+            cls.review_count: cls.review_count + count,
+            cls.rating_sum: cls.rating_sum + rating * count,
+            cls.reviews_version: cls.reviews_version + 1,
+        }
+        if 1 <= rating <= 5:
+            column = getattr(cls, f"rating_{rating}")
+            values[column] = column + count
+        cls.query.filter(cls.id == site_id).update(values, synchronize_session=False)
+
+    @classmethod
+    def recompute_ratings(cls, site_ids=None):
+        """Rebuild the rating aggregates of the given sites (default all) from
+        journal_entries in one statement."""
+        sites = cls.__table__
+        entries = Journal_entry.__table__
+
+        def stat(expression, *conditions):
+            return (
+                select([expression])
+                .where(and_(entries.c.dive_site_id == sites.c.id, *conditions))
+                .as_scalar()
+            )
+
+        values = {
+            "review_count": stat(func.count()),
+            "rating_sum": stat(func.coalesce(func.sum(entries.c.rating), 0)),
+        }
+        for rating in range(1, 6):
+            values[f"rating_{rating}"] = stat(func.count(), entries.c.rating == rating)
+        values["reviews_version"] = sites.c.reviews_version + 1
+        update = sites.update().values(**values)
+        if site_ids is not None:
+            update = update.where(sites.c.id.in_(list(site_ids)))
+        return db.session.execute(update).rowcount
+
+    @classmethod
+    def reviews_changed(cls, site_id=None, user_id=None):
+        """Bump reviews_version of a site, or of every site a user has reviewed."""
+        if user_id is not None:
+            reviewed = db.session.query(Journal_entry.dive_site_id).filter(
+                Journal_entry.user_id == user_id
+            )
+            query = cls.query.filter(cls.id.in_(reviewed.subquery()))
+        else:
+            query = cls.query.filter(cls.id == site_id)
+        query.update({cls.reviews_version: cls.reviews_version + 1}, synchronize_session=False)
+
+    @classmethod
+    def bucket_list_of(cls, user_id):
+        """Return a query for the sites in a user's bucket list."""
+        return cls.query.join(Bucket_list_site, Bucket_list_site.dive_site_id == cls.id).filter(
+            Bucket_list_site.user_id == user_id
+        )
+
+    @classmethod
+    def within(cls, lat, lng, miles):
+        """Return (site, distance) pairs within `miles` of a point, nearest first.
+
+        Candidates come from the indexed grid cells covering the bounding box,
+        then exact haversine distances drop the corners.
+        """
+        min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, miles)
+        query = cls.query.filter(
+            cls.lat.between(min_lat, max_lat),
+            or_(*[cls.lng.between(lo, hi) for lo, hi in lng_ranges(min_lng, max_lng)]),
+        )
+
+        cells = cells_in_box(min_lat, max_lat, min_lng, max_lng)
+        if cells is not None:
+            query = query.filter(cls.cell.in_(cells))
+
+        found = []
+        for site in query:
+            distance = haversine(lat, lng, site.lat, site.lng)
+            if distance <= miles:
+                found.append((site, distance))
+
+        found.sort(key=lambda pair: pair[1])
+        return found
+
+    @classmethod
+    def search(cls, text, limit=100):
+        """Return sites matching every word of `text` as a prefix, best match first.
+
+        Uses the full-text index on name, location and description: a GIN
+        expression index on PostgreSQL or the dive_sites_fts FTS5 table on SQLite.
+        """
+        words = re.findall(r"\w+", text.lower())
+        if not words:
+            return []
+
+        dialect = db.session.get_bind(mapper=cls.__mapper__).dialect.name
+        if dialect == "postgresql":
+            sql = f"""SELECT id FROM dive_sites
+                WHERE {PG_SEARCH_DOCUMENT} @@ to_tsquery('simple', :query)
+                ORDER BY ts_rank({PG_SEARCH_DOCUMENT}, to_tsquery('simple', :query)) DESC
+                LIMIT :limit"""
+            query = " & ".join(f"{word}:*" for word in words)
+        elif dialect == "sqlite":
+            sql = """SELECT rowid FROM dive_sites_fts
+                WHERE dive_sites_fts MATCH :query
+                ORDER BY bm25(dive_sites_fts, 10.0, 5.0, 1.0)
+                LIMIT :limit"""
+            query = " ".join(f'"{word}"*' for word in words)
+        else:
+            pattern = f"%{text.strip()}%"
+            return (
+                cls.query.filter(or_(cls.name.ilike(pattern), cls.location.ilike(pattern)))
+                .order_by(cls.name)
+                .limit(limit)
+                .all()
+            )
+
+        ids = [
+            site_id
+            for (site_id,) in db.session.execute(sql, {"query": query, "limit": limit})
+        ]
+        if not ids:
+            return []
+        sites = {site.id: site for site in cls.query.filter(cls.id.in_(ids))}
+        return [sites[site_id] for site_id in ids if site_id in sites]
+
 
-    journal_entries = db.relationship("Journal_entry")
+# Full-text search over dive sites. Postgres indexes a weighted tsvector
+# expression directly, so it can never drift from the table. SQLite keeps an
+# external-content FTS5 table in step with triggers.
+PG_SEARCH_DOCUMENT = (
+    "(setweight(to_tsvector('simple', coalesce(name, '')), 'A')"
+    " || setweight(to_tsvector('simple', coalesce(location, '')), 'B')"
+    " || setweight(to_tsvector('simple', coalesce(description, '')), 'C'))"
+)
+
+event.listen(
+    Dive_site.__table__,
+    "after_create",
+    DDL(
+        f"CREATE INDEX IF NOT EXISTS ix_dive_sites_search ON dive_sites USING gin ({PG_SEARCH_DOCUMENT})"
+    ).execute_if(dialect="postgresql"),
+)
+
+for statement in [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS dive_sites_fts USING fts5(
+        name, location, description, content='dive_sites', content_rowid='id')""",
+    """CREATE TRIGGER IF NOT EXISTS dive_sites_fts_insert AFTER INSERT ON dive_sites BEGIN
+        INSERT INTO dive_sites_fts(rowid, name, location, description)
+        VALUES (new.id, new.name, new.location, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS dive_sites_fts_delete AFTER DELETE ON dive_sites BEGIN
+        INSERT INTO dive_sites_fts(dive_sites_fts, rowid, name, location, description)
+        VALUES ('delete', old.id, old.name, old.location, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS dive_sites_fts_update AFTER UPDATE ON dive_sites BEGIN
+        INSERT INTO dive_sites_fts(dive_sites_fts, rowid, name, location, description)
+        VALUES ('delete', old.id, old.name, old.location, old.description);
+        INSERT INTO dive_sites_fts(rowid, name, location, description)
+        VALUES (new.id, new.name, new.location, new.description);
+    END""",
+]:
+    event.listen(
+        Dive_site.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite")
+    )
+
+event.listen(
+    Dive_site.__table__,
+    "before_drop",
+    DDL("DROP TABLE IF EXISTS dive_sites_fts").execute_if(dialect="sqlite"),
+)
 
 
 class Bucket_list_site(db.Model):
@@ -87,6 +316,48 @@ class Bucket_list_site(db.Model):
         db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False
     )
 
+    __table_args__ = (
+        db.Index(
+            "ix_bucket_list_sites_user_id_dive_site_id", "user_id", "dive_site_id", unique=True
+        ),
+    )
+
+    @classmethod
+    def listed(cls, user_id, site_ids):
+        """Return the subset of site_ids in a user's bucket list, with one IN query."""
+        if not site_ids:
+            return set()
+        return {
+            site_id
+            for (site_id,) in db.session.query(cls.dive_site_id).filter(
+                cls.user_id == user_id, cls.dive_site_id.in_(list(site_ids))
+            )
+        }
+
+    @classmethod
+    def version(cls, user_id):
+        """Return (row count, newest row id) of a user's bucket list.
+
+        Any add or remove changes it, so it versions the list's pages.
+        """
+        query = db.session.query(func.count(cls.id), func.max(cls.id))
+        return tuple(query.filter(cls.user_id == user_id).one())
+
+    @classmethod
+    def add_many(cls, user_id, site_ids):
+        """Bulk insert sites into a user's bucket list; the caller commits."""
+        db.session.bulk_insert_mappings(
+            cls, [{"user_id": user_id, "dive_site_id": site_id} for site_id in site_ids]
+        )
+
+    @classmethod
+    def remove_many(cls, user_id, site_ids):
+        """Delete sites from a user's bucket list in one statement; the caller commits."""
+        if site_ids:
+            cls.query.filter(
+                cls.user_id == user_id, cls.dive_site_id.in_(list(site_ids))
+            ).delete(synchronize_session=False)
+
 
 class Journal_entry(db.Model):
     """Dive journal entry."""
@@ -103,6 +374,71 @@ class Journal_entry(db.Model):
     user_id = db.Column(
         db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False
     )
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    # bumped on every edit, so the entry page can be revalidated cheaply
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
 
     user = db.relationship("User")
     dive_site = db.relationship("Dive_site")
+
+    # keyset pagination walks these in id order
+    __table_args__ = (
+        db.Index("ix_journal_entries_user_id_id", "user_id", "id"),
+        db.Index("ix_journal_entries_dive_site_id_id", "dive_site_id", "id"),
+        db.Index(
+            "ix_journal_entries_user_id_dive_site_id", "user_id", "dive_site_id", unique=True
+        ),
+    )
+
+    @classmethod
+    def for_user(cls, user_id):
+        """Return a query for a user's journal entries with their dive sites joined in."""
+        return cls.query.options(joinedload(cls.dive_site)).filter(cls.user_id == user_id)
+
+    @classmethod
+    def for_site(cls, site_id):
+        """Return a query for a site's reviews with their users joined in."""
+        return cls.query.options(joinedload(cls.user)).filter(cls.dive_site_id == site_id)
+
+
+class Outbox_email(db.Model):
+    """Email waiting to be sent by the outbox worker."""
+
+    __tablename__ = "outbox_emails"
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.Text, nullable=False)
+    subject = db.Column(db.Text, nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    dedupe_key = db.Column(db.Text, index=True)
+    status = db.Column(db.Text, nullable=False, default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+    __table_args__ = (db.Index("ix_outbox_emails_due", "status", "next_attempt_at"),)
+
+    def __repr__(self):
+        return f"<Outbox_email #{self.id}: {self.recipient} {self.status}>"
+
+    @classmethod
+    def queue(cls, recipient, subject, html, dedupe_key=None):
+        """Add an email to the session; it is sent after the caller commits.
+
+        If an unsent email with the same dedupe_key is waiting, it is replaced
+        instead of queueing a second one.
+        """
+        email = None
+        if dedupe_key is not None:
+            email = cls.query.filter_by(dedupe_key=dedupe_key, status="pending").first()
+        if email is None:
+            email = cls(dedupe_key=dedupe_key)
+            db.session.add(email)
+
+        email.recipient = recipient
+        email.subject = subject
+        email.html = html
+        email.next_attempt_at = datetime.utcnow()
+        return email
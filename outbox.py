@@ -0,0 +1,154 @@
+"""Background delivery of emails queued in the outbox_emails table."""
+
+import os
+import logging
+import threading
+
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from models import db, Outbox_email
+from verify import get_mail
+
+logger = logging.getLogger(__name__)
+
+
+def due_emails(limit, now):
+    """Return up to limit pending emails that are due, oldest first.
+
+    Rows are locked with SKIP LOCKED on postgres so several workers can drain
+    the outbox without sending the same email twice.
+    """
+    query = (
+        Outbox_email.query.filter(
+            Outbox_email.status == "pending", Outbox_email.next_attempt_at <= now
+        )
+        .order_by(Outbox_email.id)
+        .limit(limit)
+    )
+    if db.engine.dialect.name == "postgresql":
+        query = query.with_for_update(skip_locked=True)
+    return query.all()
+
+
+def failed(email, error, now):
+    """Record a failed attempt and schedule the next one with exponential backoff."""
+    config = current_app.config
+    email.attempts += 1
+    email.last_error = str(error)[:500]
+    if email.attempts >= config["OUTBOX_MAX_ATTEMPTS"]:
+        email.status = "failed"
+    else:
+        delay = config["OUTBOX_BACKOFF"] * 2 ** (email.attempts - 1)
+        email.next_attempt_at = now + timedelta(seconds=delay)
+
+
+def deliver_pending(limit=None):
+    """Send one batch of due emails over a single SMTP connection.
+
+    Returns the number of emails sent.
+    """
+    from flask_mail import Message
+
+    limit = limit or current_app.config["OUTBOX_BATCH_SIZE"]
+    now = datetime.utcnow()
+    emails = due_emails(limit, now)
+    if not emails:
+        db.session.commit()
+        return 0
+
+    sent = 0
+    done = set()
+    try:
+        with get_mail().connect() as conn:
+            for email in emails:
+                done.add(email.id)
+                msg = Message(
+                    email.subject,
+                    sender=current_app.config["MAIL_USERNAME"],
+                    recipients=[email.recipient],
+                    html=email.html,
+                )
+                try:
+                    conn.send(msg)
+                except Exception as e:
+                    logger.warning("Sending email #%s failed: %s", email.id, e)
+                    failed(email, e, now)
+                    continue
+                email.status = "sent"
+                email.sent_at = datetime.utcnow()
+                sent += 1
+    except Exception as e:
+        # could not connect (or the connection dropped): retry the rest later
+        logger.warning("Mail server unavailable: %s", e)
+        for email in emails:
+            if email.id not in done:
+                failed(email, e, now)
+
+    db.session.commit()
+    return sent
+
+
+def drain(limit=None):
+    """Send batches until nothing is due. Returns the number of emails sent."""
+    total = 0
+    while True:
+        sent = deliver_pending(limit)
+        total += sent
+        if not sent:
+            return total
+
+
+class OutboxWorker:
+    """Daemon thread that drains the outbox.
+
+    It wakes up when `notify` is called after an email is committed, and
+    every poll_interval seconds to pick up retries.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def init_app(self, app):
+        """Read settings from app config."""
+        self.app = app
+        self.enabled = app.config["OUTBOX_WORKER_ENABLED"]
+        self.poll_interval = app.config["OUTBOX_POLL_INTERVAL"]
+        self._pid = None
+
+    def notify(self):
+        """Wake the worker, starting it in this process if needed."""
+        if not self.enabled:
+            return
+        self._start()
+        self._wake.set()
+
+    def _start(self):
+        """Start the worker thread once per process."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._wake = threading.Event()
+            thread = threading.Thread(target=self._work, name="outbox", daemon=True)
+            thread.start()
+            self._pid = os.getpid()
+
+    def _work(self):
+        """Drain the outbox whenever woken or the poll interval passes."""
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    drain()
+            except Exception:
+                logger.exception("Outbox delivery failed")
+                with self.app.app_context():
+                    db.session.rollback()
+
+
+outbox_worker = OutboxWorker()
@@ -0,0 +1,36 @@
+"""Keyset pagination with opaque cursors."""
+
+import base64
+import binascii
+
+
+def encode_cursor(key):
+    """Return an opaque cursor for the last key on a page."""
+    return base64.urlsafe_b64encode(str(key).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return the key a cursor points after, or None for a missing or bad cursor."""
+    if not cursor:
+        return None
+    try:
+        return int(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def keyset_page(query, column, cursor, limit):
+    """Return (rows, next_cursor) for the page of query after cursor.
+
+    Rows are ordered by column, which must be unique and indexed together with
+    the query's filters, so every page is one bounded index range scan however
+    deep it is. next_cursor is None on the last page.
+    """
+    after = decode_cursor(cursor)
+    if after is not None:
+        query = query.filter(column > after)
+    rows = query.order_by(column).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(getattr(rows[-1], column.key))
@@ -0,0 +1,111 @@
+"""Background prefetch of dive site details returned by searches."""
+
+import os
+import queue
+import logging
+import threading
+
+from flask import current_app
+
+from catalog import fetch_sites
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_and_store(site_ids):
+    """Default prefetch job: store details for site ids missing from dive_sites."""
+    fetch_sites(site_ids, current_app.config["UPSTREAM_CONCURRENCY"])
+
+
+class Prefetcher:
+    """Bounded pool of daemon threads that runs `job` on batches of site ids.
+
+    Ids are dropped rather than queued when the queue is full, and ids that
+    are already queued or in progress are not queued again.
+    """
+
+    def __init__(self, job=fetch_and_store):
+        self.job = job
+        self.enabled = False
+        self._queue = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def init_app(self, app):
+        """Read settings from app config."""
+        self.app = app
+        self.enabled = app.config["PREFETCH_ENABLED"]
+        self.workers = app.config["PREFETCH_WORKERS"]
+        self.queue_size = app.config["PREFETCH_QUEUE_SIZE"]
+        self.batch_size = app.config["PREFETCH_BATCH_SIZE"]
+        self._pid = None
+
+    def enqueue(self, site_ids):
+        """Queue site ids for prefetching. Returns how many were queued."""
+        if not self.enabled:
+            return 0
+        self._start()
+
+        queued = 0
+        with self._lock:
+            for site_id in site_ids:
+                site_id = int(site_id)
+                if site_id in self._pending:
+                    continue
+                try:
+                    self._queue.put_nowait(site_id)
+                except queue.Full:
+                    break
+                self._pending.add(site_id)
+                queued += 1
+        return queued
+
+    def pending(self, site_ids):
+        """Return the subset of site ids that are queued or being fetched."""
+        with self._lock:
+            return {int(site_id) for site_id in site_ids} & self._pending
+
+    def join(self):
+        """Block until every queued id has been processed."""
+        if self._queue is not None:
+            self._queue.join()
+
+    def _start(self):
+        """Start worker threads once per process."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._pending = set()
+            for n in range(self.workers):
+                thread = threading.Thread(
+                    target=self._work, name=f"prefetch-{n}", daemon=True
+                )
+                thread.start()
+            self._pid = os.getpid()
+
+    def _work(self):
+        """Take up to batch_size ids at a time and run the job on them."""
+        work_queue = self._queue
+        while True:
+            batch = [work_queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(work_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                with self.app.app_context():
+                    self.job(batch)
+            except Exception:
+                logger.exception("Prefetch failed for sites %s", batch)
+            finally:
+                with self._lock:
+                    self._pending.difference_update(batch)
+                for _ in batch:
+                    work_queue.task_done()
+
+
+prefetcher = Prefetcher()
@@ -0,0 +1,132 @@
+"""Prefix autocomplete over dive site names and locations."""
+
+import re
+import threading
+
+from heapq import merge
+from bisect import bisect_left, insort
+
+from models import db, Dive_site
+
+MAX_KEY_LENGTH = 32
+MAX_WORD_KEYS = 3
+# entries added since the build are kept apart until there are this many
+MAX_ADDED = 1000
+
+
+def normalize(text):
+    """Lowercase and collapse whitespace."""
+    return " ".join(text.lower().split())
+
+
+def keys_for(text):
+    """Return the lookup keys for a name: the whole string and the suffixes
+    starting at its next few words, so "Blue Hole" is found by "hole" too."""
+    text = normalize(text)
+    starts = [match.start() for match in re.finditer(r"\b\w", text)][:MAX_WORD_KEYS]
+    if 0 not in starts:
+        starts.insert(0, 0)
+    return {text[start:start + MAX_KEY_LENGTH] for start in starts}
+
+
+class SuggestIndex:
+    """Sorted array of (key, text) pairs searched with binary search.
+
+    Production builds it from the database with `preload` in the gunicorn
+    master, so forked workers share one copy. Anywhere else it is built by
+    `loader` on first use. Sites added later go to a small second array, so
+    the big one is never written to (which would unshare its pages); it is
+    only rebuilt, and swapped in whole, once MAX_ADDED entries pile up.
+    """
+
+    def __init__(self, loader=None, max_added=MAX_ADDED):
+        self.loader = loader
+        self.max_added = max_added
+        self._entries = None
+        self._added = []
+        self._texts = set()
+        self._lock = threading.Lock()
+
+    def build(self, texts):
+        """Replace the index with the given texts."""
+        texts = {text for text in texts if text}
+        entries = sorted((key, text) for text in texts for key in keys_for(text))
+        with self._lock:
+            self._entries = entries
+            self._added = []
+            self._texts = texts
+
+    def reset(self):
+        """Drop the index so the next lookup rebuilds it."""
+        with self._lock:
+            self._entries = None
+            self._added = []
+            self._texts = set()
+
+    def preload(self):
+        """Build the index from loader now rather than on the first lookup."""
+        self.build(self.loader() if self.loader else [])
+
+    def add(self, texts):
+        """Add texts to a built index; ignored until the index has been built.
+
+        Both arrays are copied and swapped rather than changed in place, so
+        lookups can walk them without the lock.
+        """
+        with self._lock:
+            if self._entries is None:
+                return
+            added = list(self._added)
+            for text in texts:
+                if not text or text in self._texts:
+                    continue
+                self._texts.add(text)
+                for key in keys_for(text):
+                    insort(added, (key, text))
+            if len(added) >= self.max_added:
+                self._entries = list(merge(self._entries, added))
+                added = []
+            self._added = added
+
+    def complete(self, prefix, k=10):
+        """Return up to k texts with a word starting with prefix.
+
+        Texts that start with the prefix come first, then shorter texts.
+        """
+        prefix = normalize(prefix)[:MAX_KEY_LENGTH]
+        if not prefix:
+            return []
+        if self._entries is None:
+            self.preload()
+
+        with self._lock:
+            arrays = (self._entries, self._added)
+        found = []
+        seen = set()
+        for entries in arrays:
+            i = bisect_left(entries, (prefix,))
+            # look a little past k so whole-string matches can outrank word matches
+            limit = len(found) + k * 4
+            while i < len(entries) and len(found) < limit:
+                key, text = entries[i]
+                if not key.startswith(prefix):
+                    break
+                if text not in seen:
+                    seen.add(text)
+                    found.append(text)
+                i += 1
+
+        found.sort(key=lambda text: (not normalize(text).startswith(prefix), len(text), text))
+        return found[:k]
+
+
+def load_site_texts():
+    """Return every dive site name and location string."""
+    texts = set()
+    for name, location in db.session.query(Dive_site.name, Dive_site.location):
+        texts.add(name)
+        texts.add(location)
+    return texts
+
+
+suggest_index = SuggestIndex(loader=load_site_texts)
@@ -0,0 +1,85 @@
+"""Cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest tests/test_cache.py
+
+import time
+from unittest import TestCase
+from cache import TTLCache, search_params
+
+
+class TTLCacheTestCase(TestCase):
+    """Test TTLCache."""
+
+    def test_get_set(self):
+        """Does it return stored values and count hits and misses?"""
+        cache = TTLCache(ttl=60)
+        self.assertIsNone(cache.get("a"))
+        cache.set("a", b"1")
+
+        self.assertEqual(cache.get("a"), b"1")
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_expiry(self):
+        """Does it drop entries older than the ttl?"""
+        cache = TTLCache(ttl=0.01)
+        cache.set("a", b"1")
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_lru_by_bytes(self):
+        """Does it evict the least recently used entry when over the byte cap?"""
+        cache = TTLCache(ttl=60, max_bytes=10)
+        cache.set("a", b"xxxx")
+        cache.set("b", b"xxxx")
+        cache.get("a")
+        cache.set("c", b"xxxx")
+
+        self.assertEqual(cache.get("a"), b"xxxx")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats()["bytes"], 8)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_too_big(self):
+        """Does it skip values larger than the whole cache?"""
+        cache = TTLCache(ttl=60, max_bytes=2)
+        cache.set("a", b"xxxx")
+
+        self.assertIsNone(cache.get("a"))
+
+    def test_max_entries(self):
+        """Does it cap the number of entries?"""
+        cache = TTLCache(ttl=60, max_entries=2)
+        for key in "abc":
+            cache.set(key, key)
+
+        self.assertEqual(cache.stats()["entries"], 2)
+        self.assertIsNone(cache.get("a"))
+
+
+class SearchParamsTestCase(TestCase):
+    """Test search parameter normalization."""
+
+    def test_nearby_coords_share_key(self):
+        """Do pins a few hundred metres apart share a key?"""
+        key1, params1 = search_params(
+            {"mode": "sites", "lat": 27.251, "lng": 33.812, "dist": 100}, 0.05
+        )
+        key2, params2 = search_params(
+            {"mode": "sites", "lat": 27.253, "lng": 33.809, "dist": 100}, 0.05
+        )
+
+        self.assertEqual(key1, key2)
+        self.assertEqual(params1, {"mode": "sites", "lat": "27.25", "lng": "33.8", "dist": "100"})
+
+    def test_search_string(self):
+        """Is the search string trimmed and lowercased?"""
+        key1, params = search_params({"mode": "search", "str": "  Blue  Hole "}, 0.05)
+        key2, _ = search_params({"mode": "search", "str": "blue hole"}, 0.05)
+
+        self.assertEqual(key1, key2)
+        self.assertEqual(params["str"], "blue hole")
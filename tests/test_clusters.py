@@ -0,0 +1,71 @@
+"""Journal map clustering tests."""
+
+# run these tests like:
+#
+#    python -m unittest tests/test_clusters.py
+
+from unittest import TestCase
+from clusters import ClusterIndex, parse_bbox
+
+
+class ClusterIndexTestCase(TestCase):
+    """Test ClusterIndex."""
+
+    def setUp(self):
+        # a tight group of three sites in the Red Sea and one in Fiji
+        self.index = ClusterIndex(
+            [
+                (1, "Ras Mohammed", 27.73, 34.25),
+                (2, "Shark Reef", 27.74, 34.26),
+                (3, "Yolanda Reef", 27.735, 34.255),
+                (4, "Rainbow Reef", -16.8, 179.9),
+            ]
+        )
+
+    def test_low_zoom_clusters(self):
+        """Are nearby sites merged into one cluster at low zoom?"""
+        features = self.index.clusters(2)
+        counts = sorted(f["properties"]["count"] for f in features)
+        self.assertEqual(counts, [1, 3])
+        self.assertEqual(len(self.index), 4)
+
+        cluster = next(f for f in features if f["properties"]["cluster"])
+        lng, lat = cluster["geometry"]["coordinates"]
+        self.assertAlmostEqual(lat, 27.735, places=3)
+        self.assertAlmostEqual(lng, 34.255, places=3)
+        self.assertEqual(cluster["properties"]["expansion_zoom"], 3)
+
+    def test_high_zoom_points(self):
+        """Are sites returned one by one once zoomed in?"""
+        features = self.index.clusters(16)
+        self.assertEqual(len(features), 4)
+        self.assertEqual(
+            sorted(f["properties"]["site_id"] for f in features), [1, 2, 3, 4]
+        )
+        self.assertEqual(self.index.clusters(30), features)
+
+    def test_bbox(self):
+        """Are only clusters inside the bounding box returned?"""
+        features = self.index.clusters(16, 34.2, 27.7, 34.3, 27.8)
+        self.assertEqual(len(features), 3)
+        self.assertEqual(self.index.clusters(16, 0, 0, 10, 10), [])
+
+        # a box over the antimeridian
+        features = self.index.clusters(8, 179, -17, -179, -16)
+        self.assertEqual([f["properties"]["name"] for f in features], ["Rainbow Reef"])
+
+    def test_empty(self):
+        """Does an empty journal give no features?"""
+        self.assertEqual(ClusterIndex([]).clusters(5), [])
+
+
+class ParseBboxTestCase(TestCase):
+    """Test parse_bbox."""
+
+    def test_parse(self):
+        """Are boxes parsed, wrapped and validated?"""
+        self.assertEqual(parse_bbox("1,2,3,4"), (1, 2, 3, 4))
+        self.assertEqual(parse_bbox("170,0,190,10"), (170, 0, -170, 10))
+        self.assertEqual(parse_bbox("-400,0,400,10"), (-180, 0, 180, 10))
+        for text in ["", "1,2,3", "a,b,c,d", "0,10,1,5", "0,-100,1,5", "nan,0,1,1"]:
+            self.assertIsNone(parse_bbox(text))
@@ -0,0 +1,119 @@
+"""Digest mailer tests."""
+
+# run these tests like:
+#
+#    python -m unittest tests/test_digest.py
+
+import os
+import mailbox
+import smtplib
+import tempfile
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from app import create_app
+from models import db, User, Dive_site, Bucket_list_site, Journal_entry
+from digest import BulkMailer, send_review_digest
+from verify import get_mail
+
+
+class DigestTestCase(TestCase):
+    """Test send_review_digest."""
+
+    def setUp(self):
+        self.app = create_app("testing")
+        self.ctx = self.app.test_request_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+
+        users = []
+        for n in range(3):
+            u = User.signup(email=f"u{n}@test.com", username=f"user{n}", password="password")
+            u.confirmed = n != 2
+            users.append(u)
+        db.session.add_all([
+            Dive_site(id=1, name="Blue Hole", lat=17.3, lng=-87.5, location="Belize"),
+            Dive_site(id=2, name="Yongala", lat=-19.3, lng=147.6, location="Australia"),
+        ])
+        db.session.commit()
+
+        db.session.add_all([
+            Bucket_list_site(user_id=users[0].id, dive_site_id=1),
+            Bucket_list_site(user_id=users[0].id, dive_site_id=2),
+            Bucket_list_site(user_id=users[1].id, dive_site_id=2),
+            Bucket_list_site(user_id=users[2].id, dive_site_id=1),
+            Journal_entry(user_id=users[1].id, dive_site_id=1, rating=5, description="Deep"),
+            Journal_entry(
+                user_id=users[0].id,
+                dive_site_id=2,
+                rating=3,
+                created_at=datetime.utcnow() - timedelta(days=3),
+            ),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_send_review_digest(self):
+        """Do confirmed users with a reviewed site get one digest each?"""
+        with get_mail().record_messages() as outbox:
+            mailer = send_review_digest(hours=24)
+
+        self.assertEqual(mailer.sent, 1)
+        self.assertEqual([msg.recipients for msg in outbox], [["u0@test.com"]])
+        self.assertEqual(outbox[0].sender, "atlas@example.com")
+        self.assertIn("Hi user0", outbox[0].html)
+        self.assertIn("Blue Hole", outbox[0].html)
+        self.assertIn("5/5 from user1: Deep", outbox[0].html)
+        self.assertNotIn("Yongala", outbox[0].html)
+
+    def test_dry_run(self):
+        """Does dry run write messages to an mbox instead of sending?"""
+        path = os.path.join(tempfile.mkdtemp(), "digest.mbox")
+        with get_mail().record_messages() as outbox:
+            mailer = send_review_digest(hours=24 * 7, mbox_path=path)
+
+        self.assertEqual(outbox, [])
+        self.assertEqual(mailer.sent, 2)
+        box = mailbox.mbox(path)
+        self.assertEqual(sorted(msg["To"] for msg in box), ["u0@test.com", "u1@test.com"])
+        self.assertEqual({msg["From"] for msg in box}, {"atlas@example.com"})
+        box.close()
+
+    def test_own_reviews(self):
+        """Are a user's own reviews left out of their digest?"""
+        with get_mail().record_messages() as outbox:
+            send_review_digest(hours=24 * 7)
+
+        html = {msg.recipients[0]: msg.html for msg in outbox}
+        self.assertIn("Blue Hole", html["u0@test.com"])
+        self.assertNotIn("Yongala", html["u0@test.com"])
+        self.assertIn("Yongala", html["u1@test.com"])
+
+    def test_reconnect(self):
+        """Is a dropped connection closed before a new one is opened?"""
+        dropped = MagicMock()
+        dropped.send.side_effect = smtplib.SMTPServerDisconnected()
+        dropped.host.quit.side_effect = smtplib.SMTPServerDisconnected()
+        fresh = MagicMock()
+        mailer = BulkMailer()
+        mailer._conn = dropped
+
+        with patch.object(BulkMailer, "_connect", lambda self: setattr(self, "_conn", fresh)):
+            mailer.send(MagicMock())
+
+        dropped.host.close.assert_called_once()
+        fresh.send.assert_called_once()
+        self.assertEqual(mailer.sent, 1)
+
+    def test_throttle(self):
+        """Does the mailer keep to its send rate?"""
+        mailer = BulkMailer(rate=100)
+        start = datetime.utcnow()
+        for _ in range(5):
+            mailer._throttle()
+        self.assertGreaterEqual(datetime.utcnow() - start, timedelta(seconds=0.04))
@@ -0,0 +1,58 @@
+"""Review feed tests."""
+
+# run these tests like:
+#
+#    python -m unittest tests/test_feed.py
+
+from unittest import TestCase
+from feed import ReviewFeed
+
+
+def item(n, user_id=1):
+    return {"id": n, "user_id": user_id, "rating": 3, "description": f"review {n}"}
+
+
+class ReviewFeedTestCase(TestCase):
+    """Test ReviewFeed."""
+
+    def setUp(self):
+        self.loads = 0
+
+        def loader(size):
+            self.loads += 1
+            return [item(n) for n in range(10, 10 - size, -1) if n > 0]
+
+        self.feed = ReviewFeed(loader=loader, size=5, ttl=60)
+
+    def test_recent(self):
+        """Does it load once and return the newest items first?"""
+        self.assertEqual([i["id"] for i in self.feed.recent(3)], [10, 9, 8])
+        self.assertEqual([i["id"] for i in self.feed.recent(10)], [10, 9, 8, 7, 6])
+        self.assertEqual(self.loads, 1)
+
+    def test_add_update_remove(self):
+        """Do writes change the buffer without reloading it?"""
+        self.feed.recent()
+        self.feed.add(item(11, user_id=2))
+        self.feed.update(dict(item(9), description="edited"))
+        self.feed.remove(entry_id=8)
+
+        items = self.feed.recent()
+        self.assertEqual([i["id"] for i in items], [11, 10, 9, 7])
+        self.assertEqual(items[2]["description"], "edited")
+
+        self.feed.remove(user_id=2)
+        self.assertEqual([i["id"] for i in self.feed.recent()], [10, 9, 7])
+        self.assertEqual(self.loads, 1)
+
+    def test_ttl(self):
+        """Is the buffer reloaded after the ttl?"""
+        self.feed.ttl = 0
+        self.feed.recent()
+        self.feed.recent()
+        self.assertEqual(self.loads, 2)
+
+    def test_add_before_load(self):
+        """Are writes ignored until the first read loads the buffer?"""
+        self.feed.add(item(11))
+        self.assertEqual(self.feed.recent(1)[0]["id"], 10)
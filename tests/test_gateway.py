@@ -0,0 +1,84 @@
+"""Gateway tests."""
+
+# run these tests like:
+#
+#    python -m unittest tests/test_gateway.py
+
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from cache import search_cache
+from gateway import fan_out, merge_sites, cached_search
+
+
+class FakeResponse:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self.ok = status_code < 400
+
+
+class GatewayTestCase(TestCase):
+    """Test concurrent fan-out helpers."""
+
+    def test_fan_out_concurrent(self):
+        """Do calls run concurrently and keep their order?"""
+
+        def slow_double(n):
+            time.sleep(0.1)
+            return n * 2
+
+        start = time.monotonic()
+        results = fan_out(slow_double, [1, 2, 3, 4], limit=4)
+
+        self.assertEqual(results, [2, 4, 6, 8])
+        self.assertLess(time.monotonic() - start, 0.3)
+
+    def test_fan_out_bigger_limit(self):
+        """Does a larger limit than the pool's first size still run that many at once?"""
+
+        def slow_double(n):
+            time.sleep(0.1)
+            return n * 2
+
+        fan_out(slow_double, [1], limit=1)
+        start = time.monotonic()
+        self.assertEqual(fan_out(slow_double, [1, 2, 3, 4, 5, 6], limit=6), [2, 4, 6, 8, 10, 12])
+        self.assertLess(time.monotonic() - start, 0.3)
+
+    def test_fan_out_errors(self):
+        """Are failures returned in place instead of raised?"""
+
+        def check(n):
+            if n == 2:
+                raise ValueError("bad")
+            return n
+
+        results = fan_out(check, [1, 2, 3], limit=2)
+
+        self.assertEqual(results[0], 1)
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(results[2], 3)
+
+    def test_merge_sites(self):
+        """Does it dedupe by id keeping the nearest entry?"""
+        merged = merge_sites(
+            [
+                [{"id": "1", "distance": "40.00"}, {"id": "2", "distance": "5.00"}],
+                [{"id": "1", "distance": "10.00"}],
+            ]
+        )
+
+        self.assertEqual(merged, [{"id": "2", "distance": "5.00"}, {"id": "1", "distance": "10.00"}])
+
+    def test_cached_search_errors(self):
+        """Are upstream errors passed on with their status and left out of the cache?"""
+        search_cache.configure(ttl=60)
+        with patch("gateway.upstream.get", return_value=FakeResponse(502, b"bad gateway")):
+            self.assertEqual(cached_search("k", {}), (b"bad gateway", 502))
+        self.assertIsNone(search_cache.get("k"))
+
+        with patch("gateway.upstream.get", return_value=FakeResponse(200, b"{}")) as get:
+            self.assertEqual(cached_search("k", {}), (b"{}", 200))
+            self.assertEqual(cached_search("k", {}), (b"{}", 200))
+            self.assertEqual(get.call_count, 1)
@@ -0,0 +1,33 @@
+"""Geocoding tests."""
+
+# run these tests like:
+#
+#    python -m unittest tests/test_geocode.py
+
+from unittest import TestCase
+from geocode import locate, memo
+
+
+class GeocodeTestCase(TestCase):
+    """Test batch reverse geocoding."""
+
+    def setUp(self):
+        memo.clear()
+
+    def test_locate(self):
+        """Does it return a location per point, in order?"""
+        locations = locate([(17.245744, -87.555542), (27.25, 33.81), (17.245744, -87.555542)])
+
+        self.assertEqual(len(locations), 3)
+        self.assertTrue(locations[0].endswith("Belize"))
+        self.assertTrue(locations[1].endswith("Egypt"))
+        self.assertEqual(locations[0], locations[2])
+
+    def test_memo(self):
+        """Are nearby points answered from the memo?"""
+        locate([(17.2457, -87.5555)])
+        misses = memo.stats()["misses"]
+        locate([(17.2461, -87.5551)])
+
+        self.assertEqual(memo.stats()["misses"], misses)
+        self.assertEqual(memo.stats()["entries"], 1)
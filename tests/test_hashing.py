@@ -0,0 +1,64 @@
+"""Password hashing tests."""
+
+# run these tests like:
+#
+#    python -m unittest tests/test_hashing.py
+
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from hashing import HashPool
+
+
+class HashPoolTestCase(TestCase):
+    """Test HashPool."""
+
+    def setUp(self):
+        self.pool = HashPool()
+        self.pool.rounds = 4
+
+    def test_needs_rehash(self):
+        """Does it detect hashes made at another cost?"""
+        self.assertFalse(self.pool.needs_rehash("$2b$04$" + "x" * 53))
+        self.assertTrue(self.pool.needs_rehash("$2b$12$" + "x" * 53))
+        self.assertTrue(self.pool.needs_rehash("not a hash"))
+
+    def test_run_counts_pending(self):
+        """Does it track queue depth while work is waiting on the pool?"""
+        self.pool.workers = 1
+        release = threading.Event()
+        threads = [
+            threading.Thread(target=self.pool.run, args=(release.wait,)) for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        while self.pool.pending < 3:
+            time.sleep(0.01)
+
+        self.assertEqual(self.pool.stats()["queue_depth"], 3)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.pool.stats()["queue_depth"], 0)
+        self.assertEqual(self.pool.stats()["peak_queue_depth"], 3)
+
+    def test_one_executor(self):
+        """Do concurrent first callers share one pool?"""
+
+        def slow_pool(**kwargs):
+            time.sleep(0.05)
+            return object()
+
+        found = []
+        with patch("hashing.ThreadPoolExecutor", side_effect=slow_pool) as pool_class:
+            threads = [
+                threading.Thread(target=lambda: found.append(self.pool.executor)) for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(pool_class.call_count, 1)
+        self.assertEqual(len({id(executor) for executor in found}), 1)
@@ -0,0 +1,221 @@
+"""Logbook import tests."""
+
+# run these tests like:
+#
+#    python -m unittest tests/test_logbook.py
+
+import io
+import json
+import tracemalloc
+from unittest import TestCase
+from app import create_app
+from models import db, User, Dive_site, Bucket_list_site, Journal_entry
+from logbook import LogbookImport, read_uddf, logbook_format, export_journal, export_bucket_list
+from upstream import upstream
+
+UDDF = b"""<?xml version="1.0" encoding="utf-8"?>
+<uddf xmlns="http://www.streit.cc/uddf/3.2/" version="3.2.0">
+  <divesite>
+    <site id="site-1"><name>Site1</name></site>
+    <site id="site-2"><name>Site2</name></site>
+  </divesite>
+  <profiledata>
+    <repetitiongroup>
+      <dive id="d1">
+        <informationbeforedive><link ref="site-1"/></informationbeforedive>
+        <informationafterdive>
+          <rating><ratingvalue>9</ratingvalue></rating>
+          <observations><notes><para>Clear water</para></notes></observations>
+          <notes><para>Turtles</para></notes>
+        </informationafterdive>
+      </dive>
+      <dive id="d2">
+        <informationbeforedive><link ref="site-2"/></informationbeforedive>
+      </dive>
+    </repetitiongroup>
+  </profiledata>
+</uddf>"""
+
+
+class LogbookTestCase(TestCase):
+    """Test LogbookImport."""
+
+    def setUp(self):
+        self.app = create_app("testing")
+        self.app.config["UPSTREAM_URL"] = "http://127.0.0.1:9"
+        self.app.config["UPSTREAM_RETRIES"] = 0
+        upstream.init_app(self.app)
+        self.ctx = self.app.test_request_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+
+        self.u = User.signup(email="t@test.com", username="tester", password="password")
+        db.session.add_all(
+            Dive_site(id=n, name=f"Site{n}", lat=n, lng=n, location="somewhere")
+            for n in range(1, 6)
+        )
+        db.session.commit()
+        db.session.add(Journal_entry(user_id=self.u.id, dive_site_id=5, rating=3))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_import_csv(self):
+        """Are rows imported in batches with per-row errors?"""
+        data = (
+            "site_id,rating,description,notes\n"
+            "1,5,Great,\n"
+            "2,4,,private\n"
+            "x,4,,\n"
+            "3,9,,\n"
+            "4,2,,\n"
+            "1,3,,\n"
+            "5,3,,\n"
+            "999,3,,\n"
+        )
+        importer = LogbookImport(self.u.id, batch_size=3)
+        progress = list(importer.run(io.BytesIO(data.encode()), "csv"))
+
+        self.assertEqual(len(progress), 3)
+        self.assertEqual(
+            [error for p in progress for error in p["errors"]],
+            [
+                {"line": 4, "error": "missing or invalid site_id"},
+                {"line": 5, "error": "rating must be from 1 to 5"},
+                {"line": 9, "error": "unknown dive site 999"},
+            ],
+        )
+        self.assertEqual(importer.totals(), {"imported": 3, "skipped": 2, "failed": 3})
+
+        entries = Journal_entry.query.filter_by(user_id=self.u.id).order_by(
+            Journal_entry.dive_site_id
+        )
+        self.assertEqual(
+            [(e.dive_site_id, e.rating) for e in entries], [(1, 5), (2, 4), (4, 2), (5, 3)]
+        )
+        self.assertEqual(Journal_entry.query.filter_by(dive_site_id=2).one().notes, "private")
+        self.assertEqual(Dive_site.query.get(1).review_count, 1)
+
+    def test_read_uddf(self):
+        """Are UDDF dives read with their site ids, ratings, descriptions and notes?"""
+        rows = [row for _, row in read_uddf(io.BytesIO(UDDF))]
+        self.assertEqual(
+            rows,
+            [
+                {"site_id": "1", "rating": "5", "description": "Clear water", "notes": "Turtles"},
+                {"site_id": "2", "rating": None, "description": None, "notes": None},
+            ],
+        )
+
+    def test_import_foreign_uddf(self):
+        """Are sites from another logbook matched by position or name, not by their ids?"""
+        data = b"""<?xml version="1.0" encoding="utf-8"?>
+<uddf xmlns="http://www.streit.cc/uddf/3.2/" version="3.2.0">
+  <divesite>
+    <site id="site3"><name>Somewhere else</name>
+      <geography><latitude>2.001</latitude><longitude>2.001</longitude></geography></site>
+    <site id="s1"><name>site4</name></site>
+    <site id="s5"><name>Nowhere</name></site>
+  </divesite>
+  <profiledata><repetitiongroup>
+    <dive id="d1"><informationbeforedive><link ref="site3"/></informationbeforedive>
+      <informationafterdive><rating><ratingvalue>8</ratingvalue></rating>
+      </informationafterdive></dive>
+    <dive id="d2"><informationbeforedive><link ref="s1"/></informationbeforedive>
+      <informationafterdive><rating><ratingvalue>6</ratingvalue></rating>
+      </informationafterdive></dive>
+    <dive id="d3"><informationbeforedive><link ref="s5"/></informationbeforedive>
+      <informationafterdive><rating><ratingvalue>6</ratingvalue></rating>
+      </informationafterdive></dive>
+  </repetitiongroup></profiledata>
+</uddf>"""
+        importer = LogbookImport(self.u.id)
+        progress = list(importer.run(io.BytesIO(data), "uddf"))
+
+        self.assertEqual(
+            progress[-1]["errors"], [{"line": 3, "error": "no stored dive site matches site s5"}]
+        )
+        entries = Journal_entry.query.filter_by(user_id=self.u.id).order_by(
+            Journal_entry.dive_site_id
+        )
+        self.assertEqual([(e.dive_site_id, e.rating) for e in entries], [(2, 4), (4, 3), (5, 3)])
+
+    def test_read_uddf_memory(self):
+        """Does reading a long logbook take no more memory than a short one?"""
+        dive = UDDF[UDDF.index(b"<dive "):UDDF.index(b"</dive>") + 7]
+        peaks = []
+        for count in (1000, 20000):
+            data = UDDF.replace(dive, dive * count)
+            tracemalloc.start()
+            for _ in read_uddf(io.BytesIO(data)):
+                pass
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        self.assertLess(peaks[1], peaks[0] * 2)
+
+    def test_bad_file(self):
+        """Does an unreadable file report an error and keep earlier rows?"""
+        importer = LogbookImport(self.u.id)
+        progress = list(importer.run(io.BytesIO(UDDF[:400]), "uddf"))
+        self.assertIn("could not read logbook", progress[-1]["errors"][-1]["error"])
+
+    def test_logbook_format(self):
+        """Is the format taken from the file extension?"""
+        self.assertEqual(logbook_format("dives.CSV"), "csv")
+        self.assertEqual(logbook_format("dives.uddf"), "uddf")
+        self.assertIsNone(logbook_format("dives"))
+
+
+class ExportTestCase(TestCase):
+    """Test the journal and bucket list exports."""
+
+    tearDown = LogbookTestCase.tearDown
+
+    def setUp(self):
+        LogbookTestCase.setUp(self)
+        entry = Journal_entry(
+            user_id=self.u.id, dive_site_id=2, rating=4, description="Nice & clear", notes="Eels"
+        )
+        db.session.add(entry)
+        db.session.add(Bucket_list_site(user_id=self.u.id, dive_site_id=3))
+        db.session.commit()
+
+    def test_export_csv(self):
+        """Does the csv export reimport as the same journal?"""
+        data = "".join(export_journal(self.u.id, "csv"))
+        lines = data.splitlines()
+        self.assertEqual(
+            lines[0], "site_id,rating,description,notes,name,location,lat,lng,created_at"
+        )
+        self.assertEqual(len(lines), 3)
+
+        Journal_entry.query.delete()
+        db.session.commit()
+        importer = LogbookImport(self.u.id)
+        list(importer.run(io.BytesIO(data.encode()), "csv"))
+        self.assertEqual(importer.totals(), {"imported": 2, "skipped": 0, "failed": 0})
+
+    def test_export_geojson(self):
+        """Is the geojson export a feature collection of the bucket list?"""
+        data = json.loads("".join(export_bucket_list(self.u.id, "geojson")))
+        self.assertEqual(data["type"], "FeatureCollection")
+        self.assertEqual(
+            [(f["properties"]["site_id"], f["geometry"]["coordinates"]) for f in data["features"]],
+            [(3, [3.0, 3.0])],
+        )
+
+    def test_export_uddf(self):
+        """Does the uddf export read back unchanged with the logbook importer's reader?"""
+        data = "".join(export_journal(self.u.id, "uddf")).encode()
+        rows = [row for _, row in read_uddf(io.BytesIO(data))]
+        self.assertEqual(
+            rows,
+            [
+                {"site_id": "5", "rating": "3", "description": None, "notes": None},
+                {"site_id": "2", "rating": "4", "description": "Nice & clear", "notes": "Eels"},
+            ],
+        )
@@ -0,0 +1,45 @@
+"""Migration tests."""
+
+# run these tests like:
+#
+#    python -m unittest tests/test_migrations.py
+
+import os
+from unittest import TestCase
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from flask_migrate import Migrate, upgrade, downgrade
+from app import create_app
+from models import db
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "migrations")
+
+
+class MigrationTestCase(TestCase):
+    """Test the migration scripts."""
+
+    def setUp(self):
+        self.app = create_app("testing")
+        Migrate(self.app, db, directory=MIGRATIONS)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.engine.execute("DROP TABLE IF EXISTS alembic_version")
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.engine.execute("DROP TABLE IF EXISTS alembic_version")
+        self.ctx.pop()
+
+    def test_upgrade_matches_models(self):
+        """Do the migrations build the schema the models describe, and undo it?"""
+        upgrade(directory=MIGRATIONS)
+
+        with db.engine.connect() as conn:
+            skip_fts = lambda obj, name, *args: not name.startswith("dive_sites_fts")
+            context = MigrationContext.configure(conn, opts={"include_object": skip_fts})
+            self.assertEqual(compare_metadata(context, db.metadata), [])
+
+        downgrade(directory=MIGRATIONS, revision="base")
+        self.assertEqual(db.engine.table_names(), ["alembic_version"])
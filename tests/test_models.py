@@ -8,6 +8,11 @@ from app import create_app
 from unittest import TestCase
 from sqlalchemy import exc
 from models import db, User, Dive_site, Bucket_list_site, Journal_entry
+from hashing import bcrypt, hash_pool
+
+
+def bcrypt_hash(password, rounds):
+    return bcrypt.generate_password_hash(password, rounds).decode("UTF-8")
 
 
 class ModelTestCase(TestCase):
@@ -87,6 +92,19 @@ class ModelTestCase(TestCase):
         # authenticate should return the user
         self.assertEqual(u, self.u)
 
+    def test_authenticate_rehash(self):
+        """Does a valid login upgrade a hash made at an old cost?"""
+
+        self.u.password = hash_pool.run(bcrypt_hash, "password", 5)
+        db.session.commit()
+
+        u = User.authenticate("testyuser", "password")
+        db.session.commit()
+
+        self.assertEqual(u, self.u)
+        self.assertTrue(u.password.startswith("$2b$04$"))
+        self.assertTrue(User.authenticate("testyuser", "password"))
+
     def test_invalid_username(self):
         """Does invalid username fail?"""
 
@@ -202,3 +220,67 @@ class ModelTestCase(TestCase):
         db.session.add(entry)
 
         self.assertRaises(exc.IntegrityError, db.session.commit)
+
+    def test_dive_site_within(self):
+        """Does the radius query use grid cells and return nearest sites first?"""
+        db.session.add_all(
+            [
+                Dive_site(name="Near", id=1, lat=10.1, lng=20, location="a"),
+                Dive_site(name="Nearer", id=2, lat=10.01, lng=20, location="b"),
+                Dive_site(name="Far", id=3, lat=12, lng=20, location="c"),
+            ]
+        )
+        db.session.commit()
+
+        self.assertIsNotNone(Dive_site.query.get(1).cell)
+
+        found = Dive_site.within(10, 20, 100)
+        self.assertEqual([site.name for site, miles in found], ["Nearer", "Near"])
+        self.assertAlmostEqual(found[1][1], 6.9, places=1)
+
+        # moving a site moves it to the right cell
+        Dive_site.query.get(3).lat = 10.05
+        db.session.commit()
+        found = Dive_site.within(10, 20, 100)
+        self.assertEqual([site.name for site, miles in found], ["Nearer", "Far", "Near"])
+
+    def test_dive_site_within_antimeridian(self):
+        """Does the radius query find sites across the antimeridian?"""
+        db.session.bulk_insert_mappings(
+            Dive_site,
+            [
+                {"id": 1, "name": "East", "lat": -17, "lng": 179.9, "location": "a"},
+                {"id": 2, "name": "West", "lat": -17, "lng": -179.9, "location": "b"},
+            ],
+        )
+        db.session.commit()
+
+        found = Dive_site.within(-17, 179.95, 50)
+        self.assertEqual(sorted(site.name for site, miles in found), ["East", "West"])
+
+    def test_dive_site_search(self):
+        """Does full-text search match word prefixes and rank name matches first?"""
+        db.session.add_all(
+            [
+                Dive_site(
+                    name="Coral Garden", id=1, lat=1, lng=1, description="Blue water.", location="a"
+                ),
+                Dive_site(
+                    name="Blue Hole", id=2, lat=1, lng=1, description="Sinkhole.", location="b"
+                ),
+                Dive_site(
+                    name="Wreck", id=3, lat=1, lng=1, description="Sunk ship.", location="c"
+                ),
+            ]
+        )
+        db.session.commit()
+
+        self.assertEqual([site.id for site in Dive_site.search("blu")], [2, 1])
+        self.assertEqual([site.id for site in Dive_site.search("blue hole")], [2])
+        self.assertEqual(Dive_site.search("  "), [])
+
+        site = Dive_site.query.get(3)
+        site.name = "Blue Wreck"
+        db.session.commit()
+        self.assertIn(3, [site.id for site in Dive_site.search("wreck")])
+        self.assertEqual(len(Dive_site.search("blue")), 3)
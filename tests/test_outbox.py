@@ -0,0 +1,74 @@
+"""Outbox delivery tests."""
+
+# run these tests like:
+#
+#    python -m unittest tests/test_outbox.py
+
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import patch
+from app import create_app
+from models import db, Outbox_email
+from outbox import deliver_pending
+from verify import get_mail
+
+
+class OutboxTestCase(TestCase):
+    """Test deliver_pending."""
+
+    def setUp(self):
+        self.app = create_app("testing")
+        self.ctx = self.app.test_request_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+
+        Outbox_email.queue("a@test.com", "Hello", "<p>a</p>")
+        Outbox_email.queue("b@test.com", "Hello", "<p>b</p>")
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_deliver_pending(self):
+        """Are due emails sent over one connection and marked sent?"""
+        with get_mail().record_messages() as outbox:
+            sent = deliver_pending()
+
+        self.assertEqual(sent, 2)
+        self.assertEqual([msg.recipients for msg in outbox], [["a@test.com"], ["b@test.com"]])
+        self.assertEqual({e.status for e in Outbox_email.query}, {"sent"})
+        self.assertEqual(deliver_pending(), 0)
+
+    def test_queue_dedupe(self):
+        """Does queueing with a pending dedupe_key replace the waiting email?"""
+        Outbox_email.queue("c@test.com", "Confirm", "<p>1</p>", dedupe_key="confirm:c")
+        Outbox_email.queue("c@test.com", "Confirm", "<p>2</p>", dedupe_key="confirm:c")
+        db.session.commit()
+
+        emails = Outbox_email.query.filter_by(dedupe_key="confirm:c").all()
+        self.assertEqual([e.html for e in emails], ["<p>2</p>"])
+
+    def test_retry_backoff(self):
+        """Are emails retried later when the mail server is down?"""
+        mail = get_mail()
+        with patch.object(mail, "connect", side_effect=OSError("connection refused")):
+            sent = deliver_pending()
+
+        self.assertEqual(sent, 0)
+        for email in Outbox_email.query:
+            self.assertEqual(email.status, "pending")
+            self.assertEqual(email.attempts, 1)
+            self.assertEqual(email.last_error, "connection refused")
+            self.assertGreater(email.next_attempt_at, datetime.utcnow())
+
+    def test_gives_up(self):
+        """Are emails marked failed after OUTBOX_MAX_ATTEMPTS?"""
+        Outbox_email.query.update({"attempts": self.app.config["OUTBOX_MAX_ATTEMPTS"] - 1})
+        db.session.commit()
+        with patch.object(get_mail(), "connect", side_effect=OSError("down")):
+            deliver_pending()
+
+        self.assertEqual({e.status for e in Outbox_email.query}, {"failed"})
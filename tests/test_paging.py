@@ -0,0 +1,24 @@
+"""Pagination cursor tests."""
+
+# run these tests like:
+#
+#    python -m unittest tests/test_paging.py
+
+from unittest import TestCase
+from paging import encode_cursor, decode_cursor
+
+
+class CursorTestCase(TestCase):
+    """Test encode_cursor and decode_cursor."""
+
+    def test_round_trip(self):
+        """Does a cursor decode to the key it was made from?"""
+        for key in [1, 42, 10 ** 12]:
+            cursor = encode_cursor(key)
+            self.assertNotIn("=", cursor)
+            self.assertEqual(decode_cursor(cursor), key)
+
+    def test_bad_cursor(self):
+        """Do missing or garbled cursors start from the first page?"""
+        for cursor in [None, "", "!!", encode_cursor("abc")]:
+            self.assertIsNone(decode_cursor(cursor))
@@ -0,0 +1,49 @@
+"""Prefetch tests."""
+
+# run these tests like:
+#
+#    python -m unittest tests/test_prefetch.py
+
+from unittest import TestCase
+from flask import Flask
+from prefetch import Prefetcher
+
+
+class PrefetcherTestCase(TestCase):
+    """Test Prefetcher."""
+
+    def setUp(self):
+        """Create a prefetcher that records batches instead of fetching."""
+        self.batches = []
+        self.app = Flask(__name__)
+        self.app.config.update(
+            PREFETCH_ENABLED=True,
+            PREFETCH_WORKERS=1,
+            PREFETCH_QUEUE_SIZE=3,
+            PREFETCH_BATCH_SIZE=10,
+        )
+        self.prefetcher = Prefetcher(job=self.batches.append)
+        self.prefetcher.init_app(self.app)
+
+    def test_enqueue(self):
+        """Are queued ids processed in batches?"""
+        self.prefetcher.enqueue(["1", "2"])
+        self.prefetcher.join()
+
+        self.assertEqual(sorted(id for batch in self.batches for id in batch), [1, 2])
+
+    def test_bounded(self):
+        """Are duplicates skipped and ids dropped once the queue is full?"""
+        self.app.config["PREFETCH_WORKERS"] = 0
+        self.prefetcher.init_app(self.app)
+
+        self.assertEqual(self.prefetcher.enqueue([1, 1, 2, 3, 4, 5]), 3)
+        self.assertEqual(self.prefetcher.enqueue([2, 6]), 0)
+        self.assertEqual(self.prefetcher.pending([2, 5, 6]), {2})
+
+    def test_disabled(self):
+        """Does it do nothing when disabled?"""
+        self.app.config["PREFETCH_ENABLED"] = False
+        self.prefetcher.init_app(self.app)
+
+        self.assertEqual(self.prefetcher.enqueue([1]), 0)
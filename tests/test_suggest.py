@@ -0,0 +1,63 @@
+"""Autocomplete tests."""
+
+# run these tests like:
+#
+#    python -m unittest tests/test_suggest.py
+
+from unittest import TestCase
+from suggest import SuggestIndex
+
+
+class SuggestIndexTestCase(TestCase):
+    """Test SuggestIndex."""
+
+    def setUp(self):
+        """Build an index of a few names."""
+        self.index = SuggestIndex()
+        self.index.build(
+            ["The Blue Hole", "Blue Corner", "Bluewater Reef", "Belize City, Belize"]
+        )
+
+    def test_prefix(self):
+        """Does it return texts starting with the prefix, whole matches first?"""
+        self.assertEqual(
+            self.index.complete("blue"), ["Blue Corner", "Bluewater Reef", "The Blue Hole"]
+        )
+
+    def test_word_prefix(self):
+        """Does it match the start of later words?"""
+        self.assertEqual(self.index.complete("hol"), ["The Blue Hole"])
+        self.assertEqual(self.index.complete("belize c"), ["Belize City, Belize"])
+
+    def test_limit(self):
+        """Does it return at most k texts?"""
+        self.assertEqual(len(self.index.complete("b", k=2)), 2)
+
+    def test_add(self):
+        """Are added texts found?"""
+        entries = self.index._entries
+        self.index.add(["Blue Heron Bridge"])
+
+        self.assertIs(self.index._entries, entries)
+        self.assertIn("Blue Heron Bridge", self.index.complete("blue h"))
+        self.assertEqual(self.index.complete("nothing"), [])
+
+    def test_merge_added(self):
+        """Are added entries merged into a new main array once there are enough?"""
+        index = SuggestIndex(max_added=3)
+        index.build(["Shark Reef"])
+        entries = index._entries
+        index.add(["Manta Point"])
+        self.assertIs(index._entries, entries)
+
+        index.add(["Coral Garden"])
+        self.assertIsNot(index._entries, entries)
+        self.assertEqual(index._added, [])
+        self.assertEqual(index._entries, sorted(index._entries))
+        self.assertEqual(index.complete("manta"), ["Manta Point"])
+
+    def test_preload(self):
+        """Does preload build the index from the loader before any lookup?"""
+        index = SuggestIndex(loader=lambda: ["Shark Reef"])
+        index.preload()
+        self.assertEqual(index._entries, [("reef", "Shark Reef"), ("shark reef", "Shark Reef")])
@@ -0,0 +1,114 @@
+"""Vector tile tests."""
+
+# run these tests like:
+#
+#    python -m unittest tests/test_tiles.py
+
+import os
+import time
+import shutil
+import tempfile
+from unittest import TestCase
+from tiles import TileCache, encode_tile, varint, zigzag, tile_bounds, to_tile
+
+
+class EncodeTestCase(TestCase):
+    """Test the vector tile encoder."""
+
+    def test_varint(self):
+        """Are integers encoded as protobuf varints?"""
+        self.assertEqual(varint(1), b"\x01")
+        self.assertEqual(varint(300), b"\xac\x02")
+        self.assertEqual([zigzag(n) for n in [0, -1, 1, -2]], [0, 1, 2, 3])
+
+    def test_encode_tile(self):
+        """Is a point feature encoded as a version 2 tile layer?"""
+        tile = encode_tile([(1, 10, 20, {"name": "a", "count": 1})])
+        self.assertEqual(
+            tile.hex(),
+            "1a33"  # layer
+            "7802"  # version 2
+            "0a057369746573"  # name "sites"
+            "120f0801120400000101180122030914"  # feature 1, tags, point type, MoveTo
+            "28"  # (10, 20)
+            "1a046e616d651a05636f756e74"  # keys "name", "count"
+            "22030a016122022801"  # values "a", 1
+            "288020",  # extent 4096
+        )
+        self.assertEqual(encode_tile([]), b"")
+
+    def test_tile_coordinates(self):
+        """Do tile bounds and pixel positions line up?"""
+        west, south, east, north = tile_bounds(1, 1, 0, buffer=0)
+        self.assertEqual((west, east), (0, 180))
+        self.assertAlmostEqual(south, 0)
+        self.assertEqual(to_tile(1, 1, 0, 0, 0), (0, 4096))
+        self.assertEqual(to_tile(0, 0, 0, 0, 0), (2048, 2048))
+
+
+class TileCacheTestCase(TestCase):
+    """Test TileCache."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = TileCache()
+        self.cache.configure(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_get(self):
+        """Are tiles stored once per content and found by z/x/y?"""
+        self.assertIsNone(self.cache.get(1, 0, 0))
+        digest = self.cache.put(1, 0, 0, b"tile")
+        self.assertEqual(self.cache.put(1, 1, 0, b"tile"), digest)
+        self.assertEqual(self.cache.get(1, 1, 0), (digest, b"tile"))
+        self.assertEqual(len(os.listdir(os.path.join(self.directory, "objects", digest[:2]))), 1)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_invalidate(self):
+        """Are only the tiles drawing a new point dropped, at every zoom?"""
+        self.cache.put(0, 0, 0, b"world")
+        self.cache.put(1, 1, 0, b"north east")
+        self.cache.put(1, 0, 1, b"south west")
+
+        self.assertEqual(self.cache.invalidate([(27.7, 34.2)]), 2)
+        self.assertIsNone(self.cache.get(0, 0, 0))
+        self.assertIsNone(self.cache.get(1, 1, 0))
+        self.assertIsNotNone(self.cache.get(1, 0, 1))
+
+    def test_invalidate_cell(self):
+        """Below the cluster zoom, are the tiles the site's whole grid cell overlaps dropped?"""
+        # the site is just outside the buffer of tile 4/8/7, but its cell reaches into it
+        self.cache.put(4, 8, 7, b"east of the meridian")
+        self.cache.put(4, 6, 7, b"far west")
+
+        self.cache.invalidate([(10.2, -1.45)])
+        self.assertIsNone(self.cache.get(4, 8, 7))
+        self.assertIsNotNone(self.cache.get(4, 6, 7))
+
+    def test_ttl(self):
+        """Are pointers older than the ttl treated as missing?"""
+        self.cache.configure(self.directory, ttl=60)
+        self.cache.put(1, 0, 0, b"tile")
+        self.assertIsNotNone(self.cache.get(1, 0, 0))
+        pointer = os.path.join(self.directory, "tiles", "1", "0", "0")
+        os.utime(pointer, (time.time() - 120, time.time() - 120))
+        self.assertIsNone(self.cache.get(1, 0, 0))
+
+    def test_render_before_invalidate(self):
+        """Is a tile rendered before an invalidation stored without a pointer?"""
+        rendered_at = time.time()
+        self.cache.invalidate([(27.7, 34.2)])
+        digest = self.cache.put(0, 0, 0, b"stale", rendered_at)
+        self.assertIsNone(self.cache.get(0, 0, 0))
+        self.assertEqual(self.cache.put(0, 0, 0, b"fresh", time.time()), self.cache.get(0, 0, 0)[0])
+        self.assertNotEqual(digest, self.cache.get(0, 0, 0)[0])
+
+    def test_prune(self):
+        """Are tiles no pointer names deleted?"""
+        self.cache.put(1, 0, 0, b"old")
+        self.cache.put(1, 0, 1, b"kept")
+        self.cache.put(1, 0, 0, b"new")
+        self.assertEqual(self.cache.prune(), 1)
+        self.assertEqual(self.cache.get(1, 0, 1)[1], b"kept")
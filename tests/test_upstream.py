@@ -0,0 +1,63 @@
+"""Upstream client tests."""
+
+# run these tests like:
+#
+#    python -m unittest tests/test_upstream.py
+
+import time
+import requests
+from unittest import TestCase
+from unittest.mock import patch
+from upstream import CircuitBreaker, UpstreamClient, UpstreamUnavailable
+
+
+class CircuitBreakerTestCase(TestCase):
+    """Test CircuitBreaker."""
+
+    def test_opens_at_threshold(self):
+        """Does it fail fast after repeated failures?"""
+        breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+
+    def test_half_open_trial(self):
+        """Does it let one trial call through after the reset timeout?"""
+        breaker = CircuitBreaker(threshold=1, reset_timeout=0.01)
+        breaker.record_failure()
+        time.sleep(0.02)
+
+        self.assertEqual(breaker.state, "half-open")
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        self.assertTrue(breaker.allow())
+
+
+class UpstreamClientTestCase(TestCase):
+    """Test UpstreamClient."""
+
+    def test_trial_other_request_error(self):
+        """Does a failed half-open trial of any request error reopen the breaker
+        instead of leaving it stuck?"""
+        client = UpstreamClient()
+        client.url = "http://127.0.0.1:9"
+        client.timeout = (0.1, 0.1)
+        client.retries = 0
+        client.breaker = CircuitBreaker(threshold=1, reset_timeout=0.01)
+        client.breaker.record_failure()
+        time.sleep(0.02)
+
+        client.pool_size = 1
+        with patch.object(requests.Session, "get", side_effect=requests.TooManyRedirects()):
+            with self.assertRaises(UpstreamUnavailable):
+                client.get({})
+
+        time.sleep(0.02)
+        self.assertEqual(client.breaker.state, "half-open")
+        self.assertTrue(client.breaker.allow())
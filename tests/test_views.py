@@ -4,11 +4,21 @@
 #
 #    FLASK_ENV=production python -m unittest tests/test_views.py
 
+import io
+import json
+import shutil
+import tempfile
+from unittest.mock import MagicMock, patch
 from flask_mail import Mail
+from sqlalchemy import event
 from app import create_app
 from unittest import TestCase
-from models import db, User, Dive_site, Bucket_list_site, Journal_entry
+from models import db, User, Dive_site, Bucket_list_site, Journal_entry, Outbox_email
 from verify import generate_token, send_email
+from upstream import upstream
+from prefetch import prefetcher
+from tiles import tile_cache, site_clusters
+from paging import encode_cursor
 
 
 class ViewTestCase(TestCase):
@@ -70,6 +80,10 @@ class ViewTestCase(TestCase):
             self.assertIn("<h1>Welcome testyuser!</h1>", html)
             self.assertIn("You have not confirmed your account.", html)
 
+            email = Outbox_email.query.one()
+            self.assertEqual(email.recipient, "testy@test.com")
+            self.assertEqual(email.status, "pending")
+
     def test_signup_invalid_name(self):
         """Will user get warning if username or email already exists?"""
         with self.client as c:
@@ -197,6 +211,60 @@ class ViewTestCase(TestCase):
             self.assertNotIn('<a class="nav-link" href="/login">Log In</a>', html)
 
 
+    def test_identity_cached(self):
+        """Does a warm identity cache fill g.user without querying users?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess["user_id"] = self.u.id
+
+            c.get("/")
+            statements = []
+
+            def record(conn, cursor, statement, *args):
+                statements.append(statement)
+
+            event.listen(db.engine, "before_cursor_execute", record)
+            try:
+                resp = c.get("/")
+            finally:
+                event.remove(db.engine, "before_cursor_execute", record)
+
+            self.assertIn("testuser</a>", resp.get_data(as_text=True))
+            self.assertFalse([s for s in statements if "FROM users" in s])
+
+    def test_identity_refreshed_on_confirm(self):
+        """Does confirming email refresh the cached identity?"""
+        token = generate_token(self.u2.email)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess["user_id"] = self.u2.id
+
+            html = c.get("/").get_data(as_text=True)
+            self.assertNotIn('href="/bucketlist">Bucket List</a>', html)
+
+            resp = c.get(f"/confirm/{token}", follow_redirects=True)
+            html = resp.get_data(as_text=True)
+            self.assertIn('href="/bucketlist">Bucket List</a>', html)
+
+    def test_identity_user_deleted(self):
+        """Is a user deleted by another worker logged out instead of causing errors?"""
+        user_id = self.u.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess["user_id"] = user_id
+            c.get("/")
+
+            db.session.delete(User.query.get(user_id))
+            db.session.commit()
+
+            resp = c.get("/user/edit", follow_redirects=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Access unauthorized.", resp.get_data(as_text=True))
+            with c.session_transaction() as sess:
+                self.assertNotIn("user_id", sess)
+
     def test_edit_user(self):
         """Does it edit a user's info?"""
         with self.client as c:
@@ -332,6 +400,81 @@ class ViewTestCase(TestCase):
             self.assertIn('"32"', res)
             self.assertIn('"-117"', res)
 
+    def test_site_search_upstream_down(self):
+        """Does it return a json error when the api can't be reached?"""
+        self.app.config["UPSTREAM_URL"] = "http://127.0.0.1:9"
+        self.app.config["UPSTREAM_RETRIES"] = 0
+        upstream.init_app(self.app)
+
+        with self.client as c:
+            resp = c.post("/sites/search", json={"mode": "search", "str": "pinnacle"})
+
+            self.assertEqual(resp.status_code, 503)
+            self.assertFalse(resp.json["result"])
+            self.assertIn("dive site service", resp.json["error"])
+
+    def test_site_search_local_coord(self):
+        """Does local mode return nearby sites from the database?"""
+        self.setup_dive_sites()
+        self.app.config["SITE_SEARCH_SOURCE"] = "local"
+
+        with self.client as c:
+            resp = c.post(
+                "/sites/search",
+                json={"mode": "sites", "lat": 10.5, "lng": 20, "dist": 100},
+            )
+            data = resp.json
+
+            self.assertTrue(data["result"])
+            self.assertEqual(len(data["sites"]), 1)
+            self.assertEqual(data["sites"][0]["name"], "Site1")
+
+            resp = c.post(
+                "/sites/search",
+                json={"mode": "sites", "lat": 40, "lng": 20, "dist": 100},
+            )
+            self.assertEqual(resp.json["sites"], [])
+
+    def test_site_search_local_points(self):
+        """Does local mode merge results for several pins?"""
+        self.setup_dive_sites()
+        self.app.config["SITE_SEARCH_SOURCE"] = "local"
+
+        with self.client as c:
+            resp = c.post(
+                "/sites/search",
+                json={
+                    "mode": "sites",
+                    "points": [{"lat": 10.5, "lng": 20}, {"lat": 10, "lng": 20.5}],
+                    "dist": 100,
+                },
+            )
+            data = resp.json
+
+            self.assertTrue(data["result"])
+            self.assertEqual([site["id"] for site in data["sites"]], ["1"])
+
+    def test_site_search_local_term(self):
+        """Does local mode return matching sites from the database?"""
+        self.setup_dive_sites()
+        self.app.config["SITE_SEARCH_SOURCE"] = "local"
+
+        with self.client as c:
+            resp = c.post("/sites/search", json={"mode": "search", "str": "site"})
+            data = resp.json
+
+            self.assertTrue(data["result"])
+            self.assertEqual([site["id"] for site in data["matches"]], ["1"])
+
+    def test_site_suggest(self):
+        """Does it suggest site names for a prefix?"""
+        self.setup_dive_sites()
+
+        with self.client as c:
+            resp = c.get("/sites/suggest?q=sit")
+
+            self.assertEqual(resp.json, {"suggestions": ["Site1"]})
+
     def test_show_site(self):
         """Does it display site details?"""
         self.setup_dive_sites()
@@ -466,6 +609,19 @@ class ViewTestCase(TestCase):
                 data, {"message": "This site is already in your bucket list."}
             )
 
+    def test_add_missing_site(self):
+        """Does it report a site that isn't stored rather than a duplicate?"""
+        self.setup_bucket_list()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess["user_id"] = self.u.id
+
+            resp = c.post("/bucketlist", json={"id": 999})
+
+            self.assertEqual(resp.status_code, 404)
+            self.assertEqual(resp.json, {"message": "Dive site not found."})
+
     def test_bucket_list_delete(self):
         """Does it delete a site from user's bucket list?"""
         self.setup_bucket_list()
@@ -480,6 +636,56 @@ class ViewTestCase(TestCase):
             self.assertEqual(data, {"message": "Deleted"})
             self.assertEqual(len(Bucket_list_site.query.all()), 0)
 
+    def test_bucket_list_batch(self):
+        """Does it add and remove many sites with a status for each?"""
+        self.setup_bucket_list()
+        self.app.config["UPSTREAM_URL"] = "http://127.0.0.1:9"
+        self.app.config["UPSTREAM_RETRIES"] = 0
+        upstream.init_app(self.app)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess["user_id"] = self.u.id
+
+            resp = c.post("/bucketlist/batch", json={"add": [1, 2, 2, 999]})
+            self.assertEqual(
+                resp.json["results"],
+                {"add": {"1": "already_listed", "2": "added", "999": "unavailable"}, "remove": {}},
+            )
+
+            with patch("gateway.upstream.get_json", return_value={"result": False}):
+                resp = c.post("/bucketlist/batch", json={"add": [999]})
+            self.assertEqual(resp.json["results"]["add"], {"999": "not_found"})
+
+            # ids past the per request fetch limit are left for the prefetch workers,
+            # and are unavailable if prefetching is off
+            self.app.config["BUCKET_BATCH_FETCH_MAX"] = 0
+            resp = c.post("/bucketlist/batch", json={"add": [998]})
+            self.assertEqual(resp.json["results"]["add"], {"998": "unavailable"})
+            with patch.multiple(
+                prefetcher, enabled=True, workers=0, queue_size=1, _pid=None, _pending=set()
+            ):
+                resp = c.post("/bucketlist/batch", json={"add": [997, 998]})
+            self.assertEqual(
+                resp.json["results"]["add"], {"997": "pending", "998": "unavailable"}
+            )
+
+            resp = c.post("/bucketlist/batch", json={"remove": [1, 3], "add": ["1"]})
+            self.assertEqual(
+                resp.json["results"],
+                {"add": {"1": "added"}, "remove": {"1": "removed", "3": "not_listed"}},
+            )
+            self.assertEqual(
+                sorted(b.dive_site_id for b in Bucket_list_site.query.filter_by(user_id=self.u.id)),
+                [1, 2],
+            )
+
+            for body in ({"add": ["x"]}, {"add": "12"}, [1, 2], None):
+                resp = c.post("/bucketlist/batch", json=body)
+                self.assertEqual(resp.status_code, 400)
+            resp = c.post("/bucketlist/batch", data="{", content_type="application/json")
+            self.assertEqual(resp.status_code, 400)
+
     ##### Test dive journal views #####
 
     def setup_dive_journal(self):
@@ -517,6 +723,205 @@ class ViewTestCase(TestCase):
             self.assertIn("Site1 (somewhere)</a>", html)
             self.assertNotIn("Site2 (someplace)</a>", html)
 
+    def count_queries(self, client, url):
+        """Return how many SQL statements a GET of url runs."""
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            resp = client.get(url)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+        self.assertEqual(resp.status_code, 200)
+        return len(statements)
+
+    def add_rows(self, first_id, count):
+        """Add `count` sites, each reviewed by a new user and on self.u's lists."""
+        for n in range(first_id, first_id + count):
+            user = User(id=n, username=f"user{n}", email=f"u{n}@test.com", password="x")
+            site = Dive_site(id=n, name=f"Site{n}", lat=1, lng=n, location=f"place{n}")
+            db.session.add_all([user, site])
+            db.session.flush()
+            db.session.add_all([
+                Journal_entry(dive_site_id=n, user_id=self.u.id, rating=4),
+                Journal_entry(dive_site_id=1, user_id=n, rating=2, description="meh"),
+                Bucket_list_site(dive_site_id=n, user_id=self.u.id),
+            ])
+        db.session.commit()
+
+    def test_query_count_constant(self):
+        """Do the journal, bucket list and site pages run the same number of
+        queries no matter how many rows they show?"""
+        self.setup_dive_sites()
+        urls = ["/journal", "/bucketlist", "/sites/1"]
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess["user_id"] = self.u.id
+            c.get("/")
+
+            self.add_rows(100, 2)
+            few = [self.count_queries(c, url) for url in urls]
+            self.add_rows(200, 20)
+            many = [self.count_queries(c, url) for url in urls]
+
+            self.assertEqual(few, many)
+            self.assertIn("user219</b>", c.get("/sites/1").get_data(as_text=True))
+
+    def test_pagination(self):
+        """Do the json views page through every row with cursors?"""
+        self.setup_dive_sites()
+        self.add_rows(100, 7)
+        self.app.config["PAGE_SIZE"] = 3
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess["user_id"] = self.u.id
+
+            for url in ["/journal.json", "/bucketlist.json", "/sites/1/reviews.json"]:
+                ids = []
+                cursor = ""
+                while cursor is not None:
+                    page = c.get(f"{url}?cursor={cursor}").json
+                    self.assertLessEqual(len(page["items"]), 3)
+                    ids.extend(item["id"] for item in page["items"])
+                    cursor = page["next"]
+                self.assertEqual(len(ids), 7)
+                self.assertEqual(ids, sorted(set(ids)))
+
+            html = c.get("/journal").get_data(as_text=True)
+            self.assertIn("Site102 (place102)", html)
+            self.assertNotIn("Site103 (place103)", html)
+            self.assertIn("?cursor=", html)
+
+    def test_reviews_past_the_end(self):
+        """Does a cursor past the last review say so rather than "No reviews yet"?"""
+        self.setup_dive_journal()
+
+        with self.client as c:
+            html = c.get(f"/sites/1?cursor={encode_cursor(10 ** 6)}").get_data(as_text=True)
+            self.assertIn("No more reviews", html)
+            self.assertIn('<a href="/sites/1">', html)
+            self.assertNotIn("No reviews yet", html)
+
+    def test_journal_import(self):
+        """Does it stream progress while importing an uploaded logbook?"""
+        self.setup_dive_journal()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess["user_id"] = self.u.id
+
+            data = b"site_id,rating,description,notes\n1,5,,\n2,4,Nice,\n"
+            resp = c.post(
+                "/journal/import",
+                data={"logbook": (io.BytesIO(data), "dives.csv")},
+                content_type="multipart/form-data",
+            )
+            lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+
+            self.assertEqual(resp.mimetype, "application/x-ndjson")
+            self.assertEqual(lines[-1]["imported"], 1)
+            self.assertEqual(lines[-1]["skipped"], 1)
+            self.assertIn("Site2 (someplace)", c.get("/journal").get_data(as_text=True))
+
+            resp = c.post(
+                "/journal/import",
+                data={"logbook": (io.BytesIO(data), "dives.txt")},
+                content_type="multipart/form-data",
+            )
+            self.assertEqual(resp.status_code, 400)
+
+    def test_journal_export(self):
+        """Does it download the journal as an attachment?"""
+        self.setup_dive_journal()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess["user_id"] = self.u.id
+
+            resp = c.get("/journal/export.csv")
+            self.assertEqual(resp.mimetype, "text/csv")
+            self.assertIn("dive-journal.csv", resp.headers["Content-Disposition"])
+            self.assertIn("1,3,,ok,Site1,somewhere", resp.get_data(as_text=True))
+
+            self.assertEqual(c.get("/bucketlist/export.pdf").status_code, 404)
+
+    def test_site_tiles(self):
+        """Does it serve cacheable vector tiles, answer revalidation with 304,
+        and re-render a tile after a site is added?"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        tile_cache.configure(directory)
+        self.setup_dive_journal()
+
+        with self.client as c:
+            resp = c.get("/tiles/0/0/0.mvt")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.mimetype, "application/vnd.mapbox-vector-tile")
+            self.assertIn("public", resp.headers["Cache-Control"])
+            self.assertIn(b"count", resp.data)
+            etag = resp.headers["ETag"]
+
+            resp = c.get("/tiles/0/0/0.mvt", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(c.get("/tiles/6/35/30.mvt").data.count(b"Site"), 1)
+
+            db.session.add(Dive_site(id=3, name="Site3", lat=-10, lng=-40, location="x"))
+            db.session.commit()
+            tile_cache.invalidate([(-10, -40)])
+            resp = c.get("/tiles/0/0/0.mvt", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp.headers["ETag"], etag)
+
+            self.assertEqual(c.get("/tiles/1/2/0.mvt").status_code, 404)
+            self.assertEqual(c.get("/tiles/15/0/0.mvt").status_code, 404)
+
+    def test_site_clusters(self):
+        """Is a low zoom bin of one site drawn as that site, and a bin of many as a cluster?"""
+        self.setup_dive_journal()
+        self.assertEqual(
+            sorted((feature[0], feature[3]) for feature in site_clusters(0, 0, 0)),
+            [
+                (1, {"cluster": False, "count": 1, "name": "Site1"}),
+                (2, {"cluster": False, "count": 1, "name": "Site2"}),
+            ],
+        )
+
+        db.session.add(Dive_site(id=3, name="Site3", lat=10.1, lng=20.1, location="x"))
+        db.session.commit()
+        features = sorted(site_clusters(0, 0, 0), key=lambda feature: feature[3]["count"])
+        self.assertEqual([feature[3] for feature in features][1], {"cluster": True, "count": 2})
+        self.assertNotIn(1, [feature[0] for feature in features])
+
+    def test_journal_map(self):
+        """Does it return the journal's sites in the box, and rebuild after a change?"""
+        self.setup_dive_journal()
+        user_id = self.u.id
+
+        with self.client as c:
+            self.assertEqual(c.get("/journal/map.json").status_code, 401)
+            with c.session_transaction() as sess:
+                sess["user_id"] = user_id
+
+            resp = c.get("/journal/map.json?zoom=10&bbox=0,0,30,20")
+            features = resp.json["features"]
+            self.assertEqual(len(features), 1)
+            self.assertEqual(features[0]["properties"]["site_id"], 1)
+            self.assertEqual(features[0]["geometry"]["coordinates"], [20, 10])
+
+            db.session.add(Journal_entry(dive_site_id=2, user_id=user_id, rating=5))
+            db.session.commit()
+            resp = c.get("/journal/map.json?zoom=0")
+            self.assertEqual([f["properties"]["count"] for f in resp.json["features"]], [2])
+            resp = c.get("/journal/map.json?zoom=5")
+            self.assertEqual([f["properties"]["count"] for f in resp.json["features"]], [1, 1])
+
+            self.assertEqual(c.get("/journal/map.json?bbox=1,2").status_code, 400)
+
     def test_show_journal_unauthorized(self):
         """Does it redirect the user if they are not logged in?"""
         self.setup_dive_journal()
@@ -683,6 +1088,179 @@ class ViewTestCase(TestCase):
             self.assertIn('<p>so so</p>', html)
             self.assertNotIn('ok', html)
 
+    def test_site_not_modified(self):
+        """Does a site page revalidate to 304 until its reviews change, with
+        public caching for anonymous and private caching for logged in users?"""
+        self.setup_dive_journal()
+        user_id = self.u.id
+
+        with self.client as c:
+            resp = c.get("/sites/1")
+            etag = resp.headers["ETag"]
+            self.assertIn("public", resp.headers["Cache-Control"])
+            self.assertIn("Cookie", resp.headers["Vary"])
+
+            resp = c.get("/sites/1", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.data, b"")
+
+            with c.session_transaction() as sess:
+                sess["user_id"] = user_id
+            resp = c.get("/sites/1", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("private", resp.headers["Cache-Control"])
+            self.assertIn("no-cache", resp.headers["Cache-Control"])
+            etag = resp.headers["ETag"]
+            self.assertEqual(c.get("/sites/1", headers={"If-None-Match": etag}).status_code, 304)
+
+            c.post("/journal/1/edit", data={"description": "meh", "notes": "ok", "rating": 3})
+            resp = c.get("/sites/1", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("meh", resp.get_data(as_text=True))
+
+            etag = c.get("/sites/1/reviews.json").headers["ETag"]
+            resp = c.get("/sites/1/reviews.json", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 304)
+
+    def test_journal_detail_not_modified(self):
+        """Does the journal page revalidate to 304 until the entry is edited?"""
+        self.setup_dive_journal()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess["user_id"] = self.u.id
+
+            etag = c.get("/journal/1").headers["ETag"]
+            self.assertEqual(c.get("/journal/1", headers={"If-None-Match": etag}).status_code, 304)
+
+            c.post("/journal/1/edit", data={"description": "", "notes": "better", "rating": 3})
+            # the page after the edit shows a flash message, so it isn't validated
+            resp = c.get("/journal/1", headers={"If-None-Match": etag})
+            self.assertIn("Site updated.", resp.get_data(as_text=True))
+            self.assertNotIn("ETag", resp.headers)
+
+            resp = c.get("/journal/1", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("<p>better</p>", resp.get_data(as_text=True))
+
+    def test_bucket_list_not_modified(self):
+        """Does the bucket list json revalidate to 304 until the list changes?"""
+        self.setup_dive_journal()
+        user_id = self.u.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess["user_id"] = user_id
+
+            etag = c.get("/bucketlist.json").headers["ETag"]
+            resp = c.get("/bucketlist.json", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 304)
+
+            db.session.add(Bucket_list_site(dive_site_id=2, user_id=user_id))
+            db.session.commit()
+            resp = c.get("/bucketlist.json", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([item["id"] for item in resp.json["items"]], [2])
+
+    def test_site_search_get(self):
+        """Can a plain search be a cacheable GET that revalidates to 304?"""
+        self.setup_dive_sites()
+        self.app.config["SITE_SEARCH_SOURCE"] = "local"
+
+        with self.client as c:
+            resp = c.get("/sites/search?mode=search&str=site")
+            self.assertEqual([site["id"] for site in resp.json["matches"]], ["1"])
+            self.assertIn("public", resp.headers["Cache-Control"])
+
+            resp = c.get(
+                "/sites/search?mode=search&str=site",
+                headers={"If-None-Match": resp.headers["ETag"]},
+            )
+            self.assertEqual(resp.status_code, 304)
+
+    def test_site_search_post_invalid(self):
+        """Are list parameters of the wrong type rejected with 400?"""
+        bodies = [
+            {"points": "abc"},
+            {"points": [{"lat": "x", "lng": 1}]},
+            {"points": [[1, 2]]},
+            {"terms": 5},
+            {"terms": [5]},
+            {"siteids": ["1; drop"]},
+            [1, 2],
+        ]
+        for body in bodies:
+            resp = self.client.post("/sites/search", json=body)
+            self.assertEqual(resp.status_code, 400, body)
+            self.assertFalse(resp.json["result"])
+
+    def test_site_search_get_errors(self):
+        """Are list parameters on a GET rejected, and errors sent without caching headers?"""
+        for query in ("terms=reef", "points=abc", "siteids=123"):
+            resp = self.client.get(f"/sites/search?mode=search&{query}")
+            self.assertEqual(resp.status_code, 400)
+            self.assertNotIn("ETag", resp.headers)
+
+        failed = MagicMock(ok=False, status_code=502, content=b'{"error": "down"}')
+        with patch("gateway.upstream.get", return_value=failed):
+            resp = self.client.get("/sites/search?mode=search&str=reef")
+        self.assertEqual(resp.status_code, 502)
+        self.assertNotIn("ETag", resp.headers)
+        self.assertNotIn("public", resp.headers.get("Cache-Control", ""))
+
+    def test_rating_aggregates(self):
+        """Do journal add, edit and delete keep site rating totals up to date?"""
+        self.setup_dive_journal()
+        Dive_site.recompute_ratings()
+        db.session.commit()
+
+        def totals():
+            site = Dive_site.query.get(1)
+            return site.review_count, site.rating_sum, site.rating_histogram
+
+        self.assertEqual(totals(), (1, 3, [0, 0, 1, 0, 0]))
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess["user_id"] = self.u2.id
+
+            c.post("/journal/1/add", data={"description": "nice", "rating": 5})
+            self.assertEqual(totals(), (2, 8, [0, 0, 1, 0, 1]))
+            html = c.get("/sites/1").get_data(as_text=True)
+            self.assertIn("4.0 / 5 from 2 reviews", html)
+
+            entry = Journal_entry.query.filter_by(user_id=self.u2.id).one()
+            c.post(f"/journal/{entry.id}/edit", data={"description": "ok", "rating": 2})
+            self.assertEqual(totals(), (2, 5, [0, 1, 1, 0, 0]))
+
+            c.post(f"/journal/{entry.id}/delete")
+            self.assertEqual(totals(), (1, 3, [0, 0, 1, 0, 0]))
+
+        Dive_site.recompute_ratings()
+        db.session.commit()
+        self.assertEqual(totals(), (1, 3, [0, 0, 1, 0, 0]))
+
+    def test_feed(self):
+        """Do new reviews show up in the feed, served without queries once warm?"""
+        self.setup_dive_journal()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess["user_id"] = self.u.id
+
+            self.assertEqual(len(c.get("/feed").json["items"]), 1)
+            c.post("/journal/2/add", data={"description": "Great wall", "notes": "secret", "rating": 5})
+
+            html = c.get("/").get_data(as_text=True)
+            self.assertIn("Great wall", html)
+            self.assertNotIn("secret", html)
+
+            with c.session_transaction() as sess:
+                del sess["user_id"]
+            self.assertEqual(self.count_queries(c, "/feed"), 0)
+            items = c.get("/feed?limit=1").json["items"]
+            self.assertEqual([(i["site_name"], i["rating"]) for i in items], [("Site2", 5)])
+
     def test_error_handler(self):
         """Does it display error page?"""
         with self.client as c:
@@ -729,6 +1307,10 @@ class ViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn('A new confirmation email has been sent.', html)
 
+            # resending before the first email went out replaces it
+            c.get("/resend")
+            self.assertEqual(Outbox_email.query.count(), 1)
+
     def test_resend_confirmation_unauthorized(self):
         """Does it show log in message?"""
         with self.client as c:
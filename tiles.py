@@ -0,0 +1,371 @@
+"""Mapbox vector tiles of every stored dive site, with a disk cache."""
+
+import os
+import struct
+import time
+import hashlib
+import tempfile
+import threading
+
+from sqlalchemy import func
+
+from geo import project, unproject, MAX_LAT, CELL_DEGREES, CELL_COLS, grid_cell, cells_in_box
+from models import db, Dive_site
+
+LAYER = "sites"
+EXTENT = 4096
+# points this far outside a tile, in tile widths, are drawn so edge circles aren't cut
+BUFFER = 1 / 16
+# below this zoom sites are merged into BINS x BINS clusters per tile
+CLUSTER_ZOOM = 5
+BINS = 64
+MAX_ZOOM = 14
+MIME_TYPE = "application/vnd.mapbox-vector-tile"
+
+
+def varint(value):
+    """Return value as a protobuf varint."""
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def zigzag(value):
+    """Return a signed integer zigzag encoded for a varint."""
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def key(number, wire_type):
+    """Return the key for a protobuf field."""
+    return varint((number << 3) | wire_type)
+
+
+def uint_field(number, value):
+    """Return a varint protobuf field."""
+    return key(number, 0) + varint(value)
+
+
+def bytes_field(number, payload):
+    """Return a length-delimited protobuf field."""
+    return key(number, 2) + varint(len(payload)) + payload
+
+
+def encode_value(value):
+    """Return a vector tile Value message for a property value."""
+    if isinstance(value, str):
+        return bytes_field(1, value.encode())
+    if isinstance(value, bool):
+        return uint_field(7, int(value))
+    if isinstance(value, int):
+        return uint_field(5, value) if value >= 0 else uint_field(6, zigzag(value))
+    return key(3, 1) + struct.pack("<d", value)
+
+
+def encode_tile(features, layer=LAYER, extent=EXTENT):
+    """Return a vector tile with one layer of point features.
+
+    features are (id, x, y, properties) with x and y in tile pixels from 0 to
+    extent. Follows version 2 of the Mapbox Vector Tile spec; a tile with no
+    features is empty.
+    """
+    if not features:
+        return b""
+
+    keys = {}
+    values = {}
+    body = []
+    for feature_id, x, y, properties in features:
+        tags = []
+        for name, value in properties.items():
+            tags.append(keys.setdefault(name, len(keys)))
+            tags.append(values.setdefault((type(value), value), len(values)))
+        # one MoveTo command followed by the point
+        geometry = varint(9) + varint(zigzag(x)) + varint(zigzag(y))
+        body.append(
+            bytes_field(
+                2,
+                uint_field(1, feature_id)
+                + bytes_field(2, b"".join(varint(tag) for tag in tags))
+                + uint_field(3, 1)
+                + bytes_field(4, geometry),
+            )
+        )
+
+    layer_message = (
+        uint_field(15, 2)
+        + bytes_field(1, layer.encode())
+        + b"".join(body)
+        + b"".join(bytes_field(3, name.encode()) for name in keys)
+        + b"".join(bytes_field(4, encode_value(value)) for _, value in values)
+        + uint_field(5, extent)
+    )
+    return bytes_field(3, layer_message)
+
+
+def tile_bounds(z, x, y, buffer=BUFFER):
+    """Return (west, south, east, north) of a tile grown by buffer tile widths.
+
+    Longitudes are clamped to -180 to 180 rather than wrapped, so the buffer
+    of a tile on the antimeridian doesn't draw sites just across it, and a
+    circle there may be cut at the tile edge.
+    """
+    n = 2 ** z
+    north, west = unproject((x - buffer) / n, (y - buffer) / n)
+    south, east = unproject((x + 1 + buffer) / n, (y + 1 + buffer) / n)
+    return (
+        max(west, -180.0),
+        max(south, -MAX_LAT),
+        min(east, 180.0),
+        min(north, MAX_LAT),
+    )
+
+
+def to_tile(z, x, y, lat, lng):
+    """Return the pixel position of a point in a tile."""
+    mx, my = project(lat, lng)
+    n = 2 ** z
+    return round((mx * n - x) * EXTENT), round((my * n - y) * EXTENT)
+
+
+def site_points(z, x, y):
+    """Return a point feature for each dive site in a tile."""
+    west, south, east, north = tile_bounds(z, x, y)
+    query = db.session.query(Dive_site.id, Dive_site.name, Dive_site.lat, Dive_site.lng).filter(
+        Dive_site.lat.between(south, north), Dive_site.lng.between(west, east)
+    )
+    cells = cells_in_box(south, north, west, east)
+    if cells is not None:
+        query = query.filter(Dive_site.cell.in_(cells))
+    return [
+        (site_id, *to_tile(z, x, y, lat, lng), {"cluster": False, "count": 1, "name": name})
+        for site_id, name, lat, lng in query
+    ]
+
+
+def site_clusters(z, x, y):
+    """Return a feature for each bin of a low zoom tile that holds sites.
+
+    Sites are first summed per dive_sites.cell in the database, a group by on
+    an indexed column, so a tile reads one row per occupied half degree cell
+    rather than one per site. Those cells are then merged into bins. A bin of
+    one site is drawn as that site, with its id and name, rather than as a
+    cluster.
+    """
+    west, south, east, north = tile_bounds(z, x, y)
+    first_cell = grid_cell(south, 0) - grid_cell(south, 0) % CELL_COLS
+    last_cell = grid_cell(north, 0) - grid_cell(north, 0) % CELL_COLS + CELL_COLS - 1
+    cells = (
+        db.session.query(
+            func.count(Dive_site.id),
+            func.sum(Dive_site.lat),
+            func.sum(Dive_site.lng),
+            func.min(Dive_site.id),
+        )
+        .filter(Dive_site.cell.between(first_cell, last_cell))
+        .group_by(Dive_site.cell)
+    )
+
+    bins = {}
+    for count, lat_sum, lng_sum, site_id in cells:
+        lat, lng = lat_sum / count, lng_sum / count
+        if not (south <= lat <= north and west <= lng <= east):
+            continue
+        px, py = to_tile(z, x, y, lat, lng)
+        total = bins.setdefault((py * BINS // EXTENT, px * BINS // EXTENT), [0, 0.0, 0.0, site_id])
+        total[0] += count
+        total[1] += lat_sum
+        total[2] += lng_sum
+
+    single = [site_id for count, _, _, site_id in bins.values() if count == 1]
+    names = dict(
+        db.session.query(Dive_site.id, Dive_site.name).filter(Dive_site.id.in_(single))
+        if single
+        else []
+    )
+
+    features = []
+    for (row, column), (count, lat, lng, site_id) in bins.items():
+        px, py = to_tile(z, x, y, lat / count, lng / count)
+        if count == 1:
+            properties = {"cluster": False, "count": 1, "name": names.get(site_id, "")}
+            features.append((site_id, px, py, properties))
+        else:
+            # bins in the buffer have rows and columns just outside 0 to BINS, so ids are offset
+            bin_id = (row + BINS) * BINS * 3 + column + BINS
+            features.append((bin_id, px, py, {"cluster": True, "count": count}))
+    return features
+
+
+def render_tile(z, x, y):
+    """Return the vector tile of dive sites for z/x/y."""
+    features = site_clusters(z, x, y) if z < CLUSTER_ZOOM else site_points(z, x, y)
+    return encode_tile(features)
+
+
+def tiles_covering(z, south, west, north, east):
+    """Return the z/x/y of every tile at zoom z that draws part of a box, buffers included."""
+    n = 2 ** z
+    x0, y0 = project(north, west)
+    x1, y1 = project(south, east)
+    # a point near an edge is also drawn in the buffer of the next tile
+    xs = range(max(int((x0 - BUFFER / n) * n), 0), min(int((x1 + BUFFER / n) * n), n - 1) + 1)
+    ys = range(max(int((y0 - BUFFER / n) * n), 0), min(int((y1 + BUFFER / n) * n), n - 1) + 1)
+    return {(z, x, y) for x in xs for y in ys}
+
+
+class TileCache:
+    """Content-addressed disk cache of rendered tiles.
+
+    Each tile is stored once under the sha256 of its bytes, so the many
+    identical (mostly empty) tiles share a file and the hash doubles as the
+    ETag. A small pointer file per z/x/y names the hash; invalidating a tile
+    just deletes its pointer. The directory can be shared by every worker on
+    a host.
+
+    Sites saved on another host don't invalidate this host's tiles, so
+    pointers older than ttl seconds are treated as missing.
+    """
+
+    def __init__(self, directory=None, ttl=None):
+        self.directory = directory
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def configure(self, directory, ttl=None):
+        """Use directory for the cache, creating it if needed."""
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, z, x, y):
+        """Return (digest, tile bytes) for a cached tile, or None."""
+        data = None
+        try:
+            with open(self._pointer_path(z, x, y)) as f:
+                age = time.time() - os.fstat(f.fileno()).st_mtime
+                digest = f.read()
+            if self.ttl is None or age <= self.ttl:
+                with open(self._object_path(digest), "rb") as f:
+                    data = f.read()
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return digest, data
+
+    def put(self, z, x, y, data, rendered_at=None):
+        """Store a rendered tile and return its digest.
+
+        If any tile was invalidated after rendered_at, when the render began,
+        the tile may predate the change, so no pointer is written for it.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            self._write(path, data)
+        if rendered_at is None or self._invalidated_at() < rendered_at:
+            self._write(self._pointer_path(z, x, y), digest.encode())
+        return digest
+
+    def invalidate(self, points, max_zoom=MAX_ZOOM):
+        """Drop every cached tile that draws any of the (lat, lng) points.
+
+        Below CLUSTER_ZOOM a tile draws each grid cell at the mean of its
+        sites, which a new site can move anywhere in the cell, so every tile
+        the cell overlaps is dropped there.
+        """
+        tiles = set()
+        for lat, lng in points:
+            cell = grid_cell(lat, lng)
+            south = cell // CELL_COLS * CELL_DEGREES - 90
+            west = cell % CELL_COLS * CELL_DEGREES - 180
+            north, east = south + CELL_DEGREES, west + CELL_DEGREES
+            for z in range(max_zoom + 1):
+                if z < CLUSTER_ZOOM:
+                    tiles.update(tiles_covering(z, south, west, north, east))
+                else:
+                    tiles.update(tiles_covering(z, lat, lng, lat, lng))
+
+        if not tiles:
+            return 0
+        # renders still running read the sites before this change; see put
+        self._write(self._stamp_path(), repr(time.time()).encode())
+
+        removed = 0
+        for z, x, y in tiles:
+            try:
+                os.remove(self._pointer_path(z, x, y))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self.invalidations += removed
+        return removed
+
+    def prune(self):
+        """Delete stored tiles no pointer names any more. Returns count deleted."""
+        live = set()
+        for root, _, files in os.walk(os.path.join(self.directory, "tiles")):
+            for name in files:
+                with open(os.path.join(root, name)) as f:
+                    live.add(f.read())
+
+        pruned = 0
+        for root, _, files in os.walk(os.path.join(self.directory, "objects")):
+            for name in files:
+                if name[: -len(".mvt")] not in live:
+                    os.remove(os.path.join(root, name))
+                    pruned += 1
+        return pruned
+
+    def stats(self):
+        """Return counters for monitoring."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "invalidations": self.invalidations}
+
+    def _invalidated_at(self):
+        """Return when a tile was last invalidated, or 0 if never."""
+        try:
+            with open(self._stamp_path()) as f:
+                return float(f.read())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _stamp_path(self):
+        return os.path.join(self.directory, "invalidated")
+
+    def _pointer_path(self, z, x, y):
+        return os.path.join(self.directory, "tiles", str(z), str(x), str(y))
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, "objects", digest[:2], digest + ".mvt")
+
+    def _write(self, path, data):
+        """Write a file atomically, so readers in other workers never see half of it."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+tile_cache = TileCache()
+
+
+def site_tile(z, x, y):
+    """Return (digest, tile bytes) for z/x/y, rendering and caching it on a miss."""
+    cached = tile_cache.get(z, x, y)
+    if cached is not None:
+        return cached
+    rendered_at = time.time()
+    data = render_tile(z, x, y)
+    return tile_cache.put(z, x, y, data, rendered_at), data
@@ -0,0 +1,137 @@
+"""Shared HTTP client for the divesites.com api."""
+
+import os
+import time
+import random
+import threading
+import requests
+
+from requests.adapters import HTTPAdapter
+
+
+class UpstreamUnavailable(Exception):
+    """Raised when the dive site api can't be reached or is failing."""
+
+
+class CircuitBreaker:
+    """Stop calling a failing service for a while after repeated errors.
+
+    Closed: calls go through. Open: calls fail fast until `reset_timeout`
+    passes. Half-open: one trial call is let through; success closes the
+    breaker, failure opens it again.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """Return 'closed', 'open' or 'half-open'."""
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        """Return True if a call may be attempted now."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        """Close the breaker after a good response."""
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        """Count a failure, opening the breaker at the threshold."""
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class UpstreamClient:
+    """Pooled, timeout-bounded GET client with retries and a circuit breaker."""
+
+    def __init__(self):
+        self._session = None
+        self._pid = None
+        self.breaker = CircuitBreaker()
+
+    def init_app(self, app):
+        """Read settings from app config."""
+        self.url = app.config["UPSTREAM_URL"]
+        self.timeout = (
+            app.config["UPSTREAM_CONNECT_TIMEOUT"],
+            app.config["UPSTREAM_READ_TIMEOUT"],
+        )
+        self.retries = app.config["UPSTREAM_RETRIES"]
+        self.backoff = app.config["UPSTREAM_BACKOFF"]
+        self.pool_size = app.config["UPSTREAM_POOL_SIZE"]
+        self.breaker = CircuitBreaker(
+            app.config["UPSTREAM_BREAKER_THRESHOLD"], app.config["UPSTREAM_BREAKER_RESET"]
+        )
+        self._session = None
+
+    @property
+    def session(self):
+        """Keep-alive session, created per process so forked workers don't share sockets."""
+        if self._session is None or self._pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._session = session
+            self._pid = os.getpid()
+        return self._session
+
+    def get(self, params):
+        """GET the api with params and return the response, retrying transient errors."""
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                raise UpstreamUnavailable(
+                    "The dive site service is temporarily unavailable. Please try again shortly."
+                )
+
+            try:
+                res = self.session.get(self.url, params=params, timeout=self.timeout)
+                if res.status_code < 500:
+                    self.breaker.record_success()
+                    return res
+            except requests.RequestException:
+                # any failed request, not just connect errors and timeouts, must be
+                # recorded or a half-open trial would never end
+                pass
+
+            self.breaker.record_failure()
+            if attempt < self.retries:
+                # full jitter keeps retrying workers from hitting the api in lockstep
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+        raise UpstreamUnavailable("The dive site service is not responding. Please try again later.")
+
+    def get_json(self, params):
+        """GET the api and return the decoded json body."""
+        res = self.get(params)
+        try:
+            return res.json()
+        except ValueError:
+            raise UpstreamUnavailable("The dive site service returned an invalid response.")
+
+
+upstream = UpstreamClient()
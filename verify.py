@@ -1,18 +1,17 @@
 from itsdangerous import URLSafeTimedSerializer
-from flask_mail import Mail, Message
-import os
 from app import app
 
+_mail = None
 
-app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER')
-app.config['MAIL_PORT'] = 465
-app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
-app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
-app.config['MAIL_USE_TLS'] = False
-app.config['MAIL_USE_SSL'] = True
-app.config['MAIL_SUPPRESS_SEND'] = app.testing
 
-mail = Mail(app)
+def get_mail():
+    """Return the Mail extension, set up on first use so flask_mail isn't loaded at import."""
+    global _mail
+    if _mail is None:
+        from flask_mail import Mail
+
+        _mail = Mail(app)
+    return _mail
 
 
 def generate_token(email):
@@ -37,7 +36,8 @@ def confirm_token(token, expiration=3600):
 
 def send_email(to, subject, template):
     """Send email."""
-    msg = Message(subject, sender=os.environ.get('MAIL_USERNAME'), recipients=[to])
+    from flask_mail import Message
+
+    msg = Message(subject, sender=app.config['MAIL_USERNAME'], recipients=[to])
     msg.html = template
-    mail.send(msg)
-   
\ No newline at end of file
+    get_mail().send(msg)